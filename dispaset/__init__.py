@@ -50,10 +50,11 @@ _LOGCONFIG = {
 
 # Importing the main Dispa-SET functions so that they can be called with "ds.function"
 from .preprocessing.preprocessing import build_simulation
-from .preprocessing.preprocessing import adjust_capacity, adjust_storage
+from .preprocessing.preprocessing import adjust_capacity, adjust_storage, adjust_fuel_prices
 from .solve import solve_GAMS, solve_pyomo
 from .misc.gdx_handler import write_variables
 from .preprocessing.data_handler import load_config_excel, load_config_yaml, export_yaml_config
+from .preprocessing.data_store import ingest_database
 from .postprocessing.postprocessing import get_sim_results
 from .postprocessing.postprocessing import ds_to_df
 from .postprocessing.postprocessing import plot_zone
@@ -64,6 +65,7 @@ from .postprocessing.postprocessing import aggregate_by_fuel
 from .postprocessing.postprocessing import plot_energy_zone_fuel
 from .postprocessing.postprocessing import plot_zone_capacities
 from .postprocessing.postprocessing import CostExPost
+from .postprocessing.aggregation import get_aggregated
 from .cli import *
 
 # Remove old log file:
@@ -16,6 +16,7 @@ Example:
 """
 import platform
 import os
+from array import array
 import sys
 import time as tm
 import numpy as np
@@ -84,35 +85,83 @@ else:
 #####################
 
 
-def _insert_symbols(gdxHandle, sets, parameters):
+def _register_uels(gdxHandle, sets):
     """
-    Function that writes all sets and parameters to the gdxHandle
+    Function that registers the labels of all the sets (unique elements) once, in the order of the sets, and returns
+    the arrays with the UEL numbers of the elements of each set
 
     :param sets: dictionary with all the sets
-    :param parameters: dictionary with all the parameters
     """
-
-    # It is essential to write the sets first, otherwise h might be written in the wrong order
+    uels = {}
+    numbers = {}
+    gdxcc.gdxUELRegisterRawStart(gdxHandle)
     for s in sets:
-        gdxSymbolType = gdxcc.GMS_DT_SET
-        dims = 1
+        numbers[s] = np.zeros(len(sets[s]), dtype=int)
+        for row, element in enumerate(sets[s]):
+            key = str(shrink_to_64(str(element)))  # Reduce the size if bigger than 64 characters
+            if key not in uels:
+                uels[key] = len(uels) + 1
+                gdxcc.gdxUELRegisterRaw(gdxHandle, key)
+            numbers[s][row] = uels[key]
+    gdxcc.gdxUELRegisterDone(gdxHandle)
+    return numbers
+
+
+def _write_raw(gdxHandle, name, dims, gdxSymbolType, keys, values):
+    """
+    Function that writes the records of a symbol with integer (UEL number) keys. The records are sorted by key, as
+    required by the raw mode of the gdx library
 
-        gdxcc.gdxDataWriteStrStart(gdxHandle, s, "", dims, gdxSymbolType, 0)
-        gdxValues = gdxcc.doubleArray(5)
-        gdxValues[gdxcc.GMS_VAL_LEVEL] = 0.0  # 0.0 == Y (explanatory text of set in gdx)
+    :param keys:    Array (records x dims) with the UEL numbers of the records
+    :param values:  Array with the values of the records
+    :returns:       Number of records that could not be written
+    """
+    order = np.lexsort(keys.T[::-1])
+    keys, values = keys[order], values[order]
+
+    gdxcc.gdxDataWriteRawStart(gdxHandle, name, "", dims, gdxSymbolType, 0)
+    gdxKeys = gdxcc.intArray(gdxcc.GMS_MAX_INDEX_DIM)
+    gdxValues = gdxcc.doubleArray(gdxcc.GMS_VAL_MAX)
+    write, level, last = gdxcc.gdxDataWriteRaw, gdxcc.GMS_VAL_LEVEL, dims - 1
+    failed = 0
+    # The records are written by groups sharing the same keys in the first dimensions, so that only the key of the
+    # last dimension is updated for each record:
+    if len(keys) > 0 and dims > 1:
+        bounds = np.flatnonzero((np.diff(keys[:, :last], axis=0) != 0).any(axis=1)) + 1
+    else:
+        bounds = np.array([], dtype=int)
+    starts = [0] + bounds.tolist() if len(keys) > 0 else []
+    ends = bounds.tolist() + [len(keys)]
+    for start, end in zip(starts, ends):
+        for i in range(last):
+            gdxKeys[i] = int(keys[start, i])
+        for key, value in zip(keys[start:end, last].tolist(), values[start:end].tolist()):
+            gdxKeys[last] = key
+            gdxValues[level] = value
+            if not write(gdxHandle, gdxKeys, gdxValues):
+                failed += 1
+    gdxcc.gdxDataWriteDone(gdxHandle)
+    return failed
 
-        Nrows = len(sets[s])
 
-        for row in range(Nrows):
-            gdxKeys = [str(ss) for ss in shrink_to_64([sets[s][row]])]  # Reduce the size if bigger than 64 characters
-            try:
-                success = gdxcc.gdxDataWriteStr(gdxHandle, gdxKeys, gdxValues)
-            except:
-                success = False
-            if not success:
-                logging.error('Key ' + gdxKeys[0] + ' of set ' + s + ' could not be written')
+def _insert_symbols(gdxHandle, sets, parameters):
+    """
+    Function that writes all sets and parameters to the gdxHandle. The labels of the sets are registered once and the
+    non-zero values of the parameters are written with their integer keys, so that the writing time depends on the
+    number of values and not on the handling of their labels.
 
-        gdxcc.gdxDataWriteDone(gdxHandle)
+    :param sets: dictionary with all the sets
+    :param parameters: dictionary with all the parameters
+    """
+
+    # It is essential to register the set elements first, otherwise h might be written in the wrong order
+    uels = _register_uels(gdxHandle, sets)
+    for s in sets:
+        # 0.0 == Y (explanatory text of set in gdx)
+        failed = _write_raw(gdxHandle, s, 1, gdxcc.GMS_DT_SET, uels[s][:, np.newaxis], np.zeros(len(sets[s])))
+        if failed:
+            logging.error(str(failed) + ' keys of set ' + s + ' could not be written')
+        logging.debug('Set ' + s + ' successfully written')
 
     # Check array sizes for parameters:
     for p in parameters:
@@ -121,12 +170,6 @@ def _insert_symbols(gdxHandle, sets, parameters):
         # Check that the required fields are present:
         dims = len(variable['sets'])
         shape = variable['val'].shape
-        Nrows = variable['val'].shape[0]
-        gdxSymbolType = gdxcc.GMS_DT_PAR
-
-        gdxcc.gdxDataWriteStrStart(gdxHandle, p, "", dims, gdxSymbolType, 0)
-        gdxValues = gdxcc.doubleArray(5)
-        gdxValues[gdxcc.GMS_VAL_LEVEL] = 0.0  # 0.0 == Y (explanatory text of set in gdx)
 
         if len(shape) != dims:
             logging.error('Variable ' + p + ': The \'val\' data matrix has ' + str(
@@ -140,31 +183,19 @@ def _insert_symbols(gdxHandle, sets, parameters):
                         len(variable['sets'])) + ' set values')
                 sys.exit(1)
 
-        for index, value in np.ndenumerate(variable['val']):
-            # Write line by line if value is non null
-            if value != 0 and not pd.isnull(value):
-                gdxKeys = []  # All the set values for this line
-                for i in range(dims):
-                    key = sets[variable['sets'][i]][
-                        index[i]]  # Get the string value of the set by using the indice in the val matrix
-                    gdxKeys.append(str(key))
-                gdxKeys = shrink_to_64(gdxKeys)  # Reduce the size if bigger than 64 characters
-                gdxValues[gdxcc.GMS_VAL_LEVEL] = float(value)
-                try:
-                    success = gdxcc.gdxDataWriteStr(gdxHandle, gdxKeys, gdxValues)
-                except:
-                    logging.error("Didn't work")
-                    success = False
-                if not success:
-                    logging.error('Key ' + gdxKeys[0] + ' of parameter ' + p + ' could not be written')
-        gdxcc.gdxDataWriteDone(gdxHandle)
+        # Only the non null values are written:
+        val = np.asarray(variable['val'])
+        index = np.nonzero((val != 0) & ~pd.isnull(val))
+        keys = np.zeros([len(index[0]), dims], dtype=int)
+        for i in range(dims):
+            keys[:, i] = uels[variable['sets'][i]][index[i]]
+        failed = _write_raw(gdxHandle, p, dims, gdxcc.GMS_DT_PAR, keys, val[index].astype(float))
+        if failed:
+            logging.error(str(failed) + ' keys of parameter ' + p + ' could not be written')
         logging.debug('Parameter ' + p + ' successfully written')
 
 
-    logging.debug('Set ' + s + ' successfully written')
-
-
-def write_variables(gams_dir, gdx_out, list_vars):
+def write_variables(gams_dir, gdx_out, list_vars, compress=False):
     """
     This function performs the following:
     * Use the gdxcc library to create a gdxHandle instance
@@ -174,6 +205,7 @@ def write_variables(gams_dir, gdx_out, list_vars):
     :param gams_dir:        (Relative) path to the gams directory
     :param gdx_out:         (Relative) path to the gdx file to be written
     :param list_vars:       List with the sets and parameters to be written
+    :param compress:        If true, the gdx file is compressed
     """
     gams_dir = get_gams_path(gams_dir=gams_dir.encode())
     if not gams_dir:  # couldn't locate
@@ -184,7 +216,7 @@ def write_variables(gams_dir, gdx_out, list_vars):
 
     gdxHandle = gdxcc.new_gdxHandle_tp()
     gdxcc.gdxCreateD(gdxHandle, gams_dir, gdxcc.GMS_SSSIZE) #it accepts only str type
-    gdxcc.gdxOpenWrite(gdxHandle, gdx_out, "")
+    gdxcc.gdxOpenWriteEx(gdxHandle, gdx_out, "", 1 if compress else 0)
 
     [sets, parameters] = list_vars
     _insert_symbols(gdxHandle, sets, parameters)
@@ -321,6 +353,212 @@ def gdx_to_dataframe(data, fixindex=False, verbose=False):
     return out
 
 
+def open_gdx(gams_dir, filename):
+    """
+    This function opens a gdx file for reading and indexes its table of unique elements (UELs) and its symbol table,
+    so that the symbols can then be read individually (see read_gdx_symbol). The file can be closed with close_gdx and
+    opened again with reopen_gdx without indexing it again.
+
+    :param gams_dir:    Gams working directory
+    :param filename:    Path to the gdx file to be read
+    :returns:           Dictionary with the gdx handle, the array of the UEL labels indexed by the UEL numbers
+                        ('uels') and the symbol table ('symbols': name -> (symbol number, dimensions, records))
+    """
+    gdxHandle = gdxcc.new_gdxHandle_tp()
+    gdxcc.gdxCreateD(gdxHandle, force_str(gams_dir), gdxcc.GMS_SSSIZE)
+
+    # make sure the file path is properly formatted:
+    filename = filename.replace('/', os.path.sep).replace('\\\\', os.path.sep).replace('\\', os.path.sep)
+    filename = str(filename)  # removing possible unicode formatting
+
+    if not os.path.isfile(filename):
+        logging.critical('Gdx file "' + filename + '" does not exist')
+        sys.exit(1)
+
+    gdxcc.gdxOpenRead(gdxHandle, filename)
+
+    # Table of the unique elements, indexed by their number (0 is not used):
+    ret, symCount, uelCount = gdxcc.gdxSystemInfo(gdxHandle)
+    uels = np.empty(uelCount + 1, dtype=object)
+    uels[0] = ''
+    for i in range(1, uelCount + 1):
+        uels[i] = gdxcc.gdxUMUelGet(gdxHandle, i)[1]
+
+    symbols = {}
+    for symNr in range(symCount + 1):
+        ret, name, dims, symType = gdxcc.gdxSymbolInfo(gdxHandle, symNr)
+        symbols[name] = (symNr, dims, gdxcc.gdxSymbolInfoX(gdxHandle, symNr)[1])
+    stat = os.stat(filename)
+    return {'handle': gdxHandle, 'filename': filename, 'gams_dir': gams_dir, 'version': [stat.st_size, stat.st_mtime],
+            'uels': uels, 'symbols': symbols, 'open': True}
+
+
+def reopen_gdx(gdx):
+    """
+    This function opens again a gdx file indexed by open_gdx and closed with close_gdx. Since the records are read with
+    the indexed UEL numbers, the file must not have been modified in the meantime.
+
+    :param gdx:     Gdx file indexed by open_gdx
+    :returns:       True if the file is open
+    """
+    if gdx['open']:
+        return True
+    try:
+        stat = os.stat(gdx['filename'])
+    except OSError:
+        logging.error('Gdx file "' + gdx['filename'] + '" does not exist anymore')
+        return False
+    if [stat.st_size, stat.st_mtime] != gdx['version']:
+        logging.error('Gdx file "' + gdx['filename'] + '" has been modified since it was opened. It must be read again')
+        return False
+    gdxHandle = gdxcc.new_gdxHandle_tp()
+    gdxcc.gdxCreateD(gdxHandle, force_str(gdx['gams_dir']), gdxcc.GMS_SSSIZE)
+    gdxcc.gdxOpenRead(gdxHandle, gdx['filename'])
+    gdx['handle'] = gdxHandle
+    gdx['open'] = True
+    return True
+
+
+def read_gdx_symbol(gdx, name):
+    """
+    This function reads the records of one symbol of a gdx file opened with open_gdx. The records are read with their
+    integer keys (raw mode) and appended to typed buffers, so that no string is handled and no python object is kept
+    for each record. The gdx library has no bulk read (gdxDataReadRawFast calls back into python for each record), so
+    there is still one gdxDataReadRaw call per record: the reading time remains proportional to the number of records.
+
+    :param gdx:     Opened gdx file (output of open_gdx)
+    :param name:    Name of the symbol
+    :returns:       Dictionary with the (records x dimensions) array of the UEL numbers of the keys ('keys'), the
+                    array of the values ('values') and the array of the UEL labels ('uels')
+    """
+    gdxHandle = gdx['handle']
+    symNr, dims, nrRecs = gdx['symbols'][name]
+    ret, nrRecs = gdxcc.gdxDataReadRawStart(gdxHandle, symNr)
+    assert ret, "Error in gdx data string" + gdxcc.gdxErrorStr(gdxHandle, gdxcc.gdxGetLastError(gdxHandle))[1]
+
+    keys, values = array('q'), array('d')
+    add_keys, add_value, read = keys.extend, values.append, gdxcc.gdxDataReadRaw
+    for i in range(nrRecs):
+        ret, elements, vals, afdim = read(gdxHandle)
+        add_keys(elements[:dims])
+        add_value(vals[0])
+    gdxcc.gdxDataReadDone(gdxHandle)
+    return {'keys': np.frombuffer(keys, dtype=np.int64).reshape(nrRecs, dims),
+            'values': np.frombuffer(values, dtype=float), 'uels': gdx['uels']}
+
+
+def close_gdx(gdx):
+    """
+    This function closes a gdx file opened with open_gdx
+    """
+    if gdx['open']:
+        gdxcc.gdxClose(gdx['handle'])
+        gdx['open'] = False
+
+
+def gdx_to_arrays(gams_dir, filename, varname='all', verbose=False):
+    """
+    This function loads the records of the symbols of a gdx file into numpy arrays. The table of the unique elements
+    (UELs) is read once and the records are read with their integer keys (raw mode), so that no string is handled
+    for each record.
+
+    :param gams_dir:    Gams working directory
+    :param filename:    Path to the gdx file to be read
+    :param varname:     In case only one variable is needed, specify its name (otherwise specify 'all')
+    :returns:           Dictionary with, for each symbol, the (records x dimensions) array of the UEL numbers of the
+                        keys ('keys'), the array of the values ('values') and the array of the UEL labels ('uels'),
+                        indexed by the UEL numbers
+    """
+    tgdx = tm.time()
+    gdx = open_gdx(gams_dir, filename)
+    if varname == 'all':
+        symbols = list(gdx['symbols'])
+    else:
+        assert varname in gdx['symbols'], "Symbol not found"
+        symbols = [varname]
+    out = dict((name, read_gdx_symbol(gdx, name)) for name in symbols)
+    close_gdx(gdx)
+    if verbose:
+        logging.info("Loading gdx file " + gdx['filename'] + " took {}s".format(tm.time() - tgdx))
+    return out
+
+
+def arrays_to_dataframe(data, fixindex=False, sparse=False, verbose=False):
+    """
+    This function pivots the arrays of the records of the symbols (output of the function gdx_to_arrays) into pandas
+    dataframes (or series), in the same format as the function gdx_to_dataframe: the last dimension of the symbol
+    is the index and the other dimensions are the columns. The missing records are set to zero.
+
+    :param data:        Dictionary with the records of the symbols, from the gdx_to_arrays function
+    :param fixindex:    This flag allows converting string index into integers and sort the data
+    :param sparse:      If true, the dataframes are stored as sparse dataframes (with zero as fill value)
+    :returns:           dictionary of dataframes
+    """
+    from scipy import sparse as sp
+    out = {}
+    tc = tm.time()
+    for symbol in data:
+        keys, values, uels = data[symbol]['keys'], data[symbol]['values'], data[symbol]['uels']
+        values = np.where(np.isnan(values), 0, values)
+        dims = keys.shape[1]
+        if len(values) == 0:
+            logging.debug('Variable ' + symbol + ' is empty. Skipping')
+            continue
+        elif dims == 0:
+            logging.warning('Variable ' + symbol + ' has dimension 0, which should not occur. Skipping')
+            continue
+        elif dims > 3:
+            logging.warning('Variable ' + symbol + ' has more than 3 dimensions, which is very tiring. Skipping')
+            continue
+        rows, index = _first_appearance(keys[:, -1:], uels)
+        if dims == 1:
+            out[symbol] = pd.Series(_dense(rows, 0, values, len(index[0]), 1)[:, 0], index=index[0])
+        else:
+            cols, columns = _first_appearance(keys[:, :-1], uels)
+            columns = columns[0] if dims == 2 else pd.MultiIndex.from_arrays(columns)
+            if sparse:
+                matrix = sp.coo_matrix((values, (rows, cols)), shape=(len(index[0]), len(columns)))
+                out[symbol] = pd.DataFrame.sparse.from_spmatrix(matrix, index=index[0], columns=columns)
+            else:
+                out[symbol] = pd.DataFrame(_dense(rows, cols, values, len(index[0]), len(columns)), index=index[0],
+                                           columns=columns)
+        logging.debug('Successfully loaded variable ' + symbol)
+    if fixindex:
+        for symbol in out:
+            try:
+                index_int = [int(idx) for idx in out[symbol].index]
+                out[symbol].index = index_int
+                out[symbol].sort_index(inplace=True)
+            except:
+                pass
+    if verbose:
+        logging.info("Time to convert to dataframes: {}s".format(tm.time() - tc))
+    return out
+
+
+def _first_appearance(keys, uels):
+    """
+    Codes of the combinations of keys (rows of the keys array), numbered in the order of their first appearance, and
+    the corresponding labels for each dimension
+    """
+    # The keys are combined into a single integer code (the UEL numbers are lower than len(uels)):
+    code = np.zeros(len(keys), dtype=np.int64)
+    for i in range(keys.shape[1]):
+        code = code * len(uels) + keys[:, i]
+    unique, first, inverse = np.unique(code, return_index=True, return_inverse=True)
+    order = np.argsort(first, kind='stable')
+    rank = np.empty(len(order), dtype=int)
+    rank[order] = np.arange(len(order))
+    labels = [pd.Index(uels[keys[first[order], i]], dtype=object) for i in range(keys.shape[1])]
+    return rank[inverse], labels
+
+
+def _dense(rows, cols, values, Nrows, Ncols):
+    array = np.zeros([Nrows, Ncols])
+    array[rows, cols] = values
+    return array
+
+
 def get_gdx(gams_dir, resultfile):
     """
     Short wrapper of the two gdx reading functions (GdxToDataframe and GdxToList)
@@ -329,9 +567,8 @@ def get_gdx(gams_dir, resultfile):
     :param resultfile:  Path to the gdx file to be read
     :returns:           dictionary of dataframes
     """
-    return gdx_to_dataframe(gdx_to_list(gams_dir, resultfile,
-                                        varname='all', verbose=True),
-                            fixindex=True, verbose=True)
+    return arrays_to_dataframe(gdx_to_arrays(gams_dir, resultfile, varname='all', verbose=True),
+                               fixindex=True, verbose=True)
 
 
 def get_gams_path(gams_dir=None):
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Network topology of a DispaSET simulation.
+
+The names of the lines ('Z1 -> Z2') are parsed once into an index shared by the pre-processing and the
+post-processing: the from and to nodes of each line, the lines connected to the rest of the world (RoW) and a sparse
+line-node incidence matrix. The imports, exports and RoW aggregates are then computed as matrix products.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+ROW = 'RoW'     # Name of the node representing the rest of the world, which is not explicitly simulated
+
+
+def network_topology(lines, nodes):
+    """
+    Function that parses the names of the lines and builds their incidence matrix with the nodes
+
+    :param lines:   List of lines, with names formatted as 'from_node -> to_node'
+    :param nodes:   List of nodes
+    :return:        Dictionary with the lists of the lines, nodes, from nodes and to nodes (empty strings if the name
+                    of the line is not valid), the position of the from and to nodes in the list of nodes (-1 if not
+                    in the list), the boolean arrays 'valid' (properly named lines) and 'RoW' (lines connected to the
+                    rest of the world), and the sparse (lines x nodes) incidence matrix, with -1 for the from node
+                    and 1 for the to node of each line
+    """
+    lines = [str(l) for l in lines]
+    nodes = [str(n) for n in nodes]
+    parts = [l.split('->') for l in lines]
+    valid = np.array([len(p) == 2 for p in parts], dtype=bool)
+    from_nodes = [p[0].strip() if len(p) == 2 else '' for p in parts]
+    to_nodes = [p[1].strip() if len(p) == 2 else '' for p in parts]
+    position = dict((n, i) for i, n in enumerate(nodes))
+    from_idx = np.array([position.get(n, -1) for n in from_nodes], dtype=int)
+    to_idx = np.array([position.get(n, -1) for n in to_nodes], dtype=int)
+    row = np.array([n == ROW for n in from_nodes], dtype=bool) | np.array([n == ROW for n in to_nodes], dtype=bool)
+
+    rows = np.concatenate([np.where(from_idx >= 0)[0], np.where(to_idx >= 0)[0]])
+    cols = np.concatenate([from_idx[from_idx >= 0], to_idx[to_idx >= 0]])
+    vals = np.concatenate([-np.ones((from_idx >= 0).sum()), np.ones((to_idx >= 0).sum())])
+    incidence = sparse.csr_matrix((vals, (rows, cols)), shape=(len(lines), len(nodes)))
+    return {'lines': lines, 'nodes': nodes, 'from': from_nodes, 'to': to_nodes, 'from_idx': from_idx,
+            'to_idx': to_idx, 'valid': valid, 'RoW': row, 'incidence': incidence}
+
+
+def get_topology(inputs):
+    """
+    Function that returns the network topology stored in the DispaSET inputs, or builds it from the sets if the
+    inputs were written by a previous version
+    """
+    if 'topology' in inputs:
+        return inputs['topology']
+    return network_topology(inputs['sets']['l'], inputs['sets']['n'])
+
+
+def flow_balance(topology, flows, direction='net'):
+    """
+    Function that aggregates the flows of the lines at each node
+
+    :param topology:    Network topology (see network_topology)
+    :param flows:       Pandas dataframe with the flows of the lines as columns. Missing lines are considered as zero
+    :param direction:   'net' for the net imports, 'in' for the imports or 'out' for the exports (negative)
+    :return:            Pandas dataframe with the nodes of the topology as columns
+    """
+    if direction == 'in':
+        matrix = topology['incidence'].maximum(0)
+    elif direction == 'out':
+        matrix = topology['incidence'].minimum(0)
+    else:
+        matrix = topology['incidence']
+    values = np.nan_to_num(flows.reindex(columns=topology['lines']).values.astype(float))
+    return pd.DataFrame(np.asarray(matrix.T.dot(values.T)).T, index=flows.index, columns=topology['nodes'])
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+Hierarchical aggregation of the DispaSET node-level results.
+
+The nodes (zones) of the simulation are grouped into countries (config['country_zones']) and, optionally, the
+countries into regions. Each level of the hierarchy is defined by a sparse (nodes x groups) aggregation matrix, so that
+any country- or region-level series is computed from the corresponding node-level series with one matrix product,
+when it is requested. The model therefore only needs to export the node-level results.
+"""
+
+import logging
+import sys
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+# Country-level symbols that are the sums of node-level symbols over the zones of a country:
+# (symbol computed by the GAMS model: (node-level symbol, country))
+AGGREGATED_SYMBOLS = {'TotalKSADemand': ('TotalNodeDemand', 'KSA'),
+                      'KSAFuelPower': ('NodeFuelPower', 'KSA'),
+                      'KSAFuelConsumption': ('NodeFuelConsumption', 'KSA')}
+
+
+def zone_hierarchy(nodes, country_zones, regions=None):
+    """
+    Function that defines the aggregation matrices of the nodes into countries and regions
+
+    :param nodes:           List of the simulated nodes
+    :param country_zones:   Dictionary with the countries as keys and the list of their zones as values. Zones that
+                            are not simulated are ignored
+    :param regions:         Dictionary with the regions as keys and the list of their countries as values (optional)
+    :return:                Dictionary with the list of nodes and, for each level ('node', 'country' and 'region' if
+                            regions are provided), the labels of the groups and the sparse (nodes x groups)
+                            aggregation matrix
+    """
+    nodes = [str(n) for n in nodes]
+    hierarchy = {'nodes': nodes, 'node': {'labels': nodes, 'matrix': sparse.identity(len(nodes), format='csr')}}
+    hierarchy['country'] = _membership(nodes, country_zones or {})
+    if regions is not None:
+        countries = hierarchy['country']['labels']
+        for region in regions:
+            for country in regions[region]:
+                if country not in countries:
+                    logging.error('The country ' + str(country) + ' of the region ' + str(region) +
+                                  ' is not defined in the country_zones')
+                    sys.exit(1)
+        # Nodes to regions is the product of nodes to countries and countries to regions:
+        region_countries = _membership(countries, regions)
+        hierarchy['region'] = {'labels': region_countries['labels'],
+                               'matrix': (hierarchy['country']['matrix'] * region_countries['matrix']).tocsr()}
+    return hierarchy
+
+
+def get_hierarchy(inputs, regions=None):
+    """
+    Function that builds the zone hierarchy from the DispaSET inputs (see zone_hierarchy)
+    """
+    return zone_hierarchy(inputs['sets']['n'], inputs['config'].get('country_zones', {}), regions)
+
+
+def aggregate(hierarchy, data, level='country', weights=None, node_level=0):
+    """
+    Function that aggregates node-level results at a given level of the zone hierarchy with a single matrix product
+
+    :param hierarchy:   Zone hierarchy (see zone_hierarchy)
+    :param data:        Pandas dataframe with the nodes as columns, or with a column multi-index one level of which
+                        contains the nodes (e.g. (node, fuel)). The other levels are kept
+    :param level:       Level of the aggregation ('node', 'country' or 'region')
+    :param weights:     Pandas dataframe with the same shape as data. If provided, the weighted average is computed
+                        instead of the sum (e.g. prices weighted by the demand)
+    :param node_level:  Level of the column multi-index containing the nodes
+    :return:            Pandas dataframe with the groups as columns (or in the node level of the column multi-index)
+    """
+    if level not in hierarchy:
+        logging.error('The aggregation level ' + str(level) + ' is not defined in the zone hierarchy')
+        sys.exit(1)
+    matrix = _column_matrix(hierarchy, data.columns, level, node_level)
+    columns = matrix['columns']
+    values = np.nan_to_num(data.values.astype(float))
+    if weights is None:
+        out = matrix['matrix'].T.dot(values.T).T
+    else:
+        w = np.nan_to_num(weights.reindex(index=data.index, columns=data.columns).values.astype(float))
+        with np.errstate(divide='ignore', invalid='ignore'):
+            out = matrix['matrix'].T.dot((values * w).T).T / matrix['matrix'].T.dot(w.T).T
+    return pd.DataFrame(np.asarray(out), index=data.index, columns=columns)
+
+
+def get_aggregated(inputs, results, key, level='country', weights=None, hierarchy=None):
+    """
+    Function that computes a country- or region-level result from the corresponding node-level result
+
+    :param inputs:      DispaSET inputs
+    :param results:     DispaSET results
+    :param key:         Name of the node-level result (e.g. 'NodeFuelPower')
+    :param level:       Level of the aggregation ('country' or 'region')
+    :param weights:     Name of the node-level result used as weights for an average, or dataframe (see aggregate)
+    :param hierarchy:   Zone hierarchy. Built from the inputs if not provided
+    """
+    if hierarchy is None:
+        hierarchy = get_hierarchy(inputs)
+    if isinstance(weights, str):
+        weights = results[weights]
+    return aggregate(hierarchy, results[key], level, weights)
+
+
+def aggregated_symbols(inputs, results, symbols=None):
+    """
+    Function that derives the country-level symbols listed in AGGREGATED_SYMBOLS from the node-level results, in the
+    format of the symbols written by the GAMS model
+
+    :param symbols:     List of the symbols to derive (by default, those not present in the results)
+    :return:            Dictionary with the derived symbols
+    """
+    if symbols is None:
+        symbols = [s for s in AGGREGATED_SYMBOLS if s not in results]
+    symbols = [s for s in symbols if AGGREGATED_SYMBOLS[s][0] in results]
+    if not symbols:
+        return {}
+    hierarchy = get_hierarchy(inputs)
+    out = {}
+    for symbol in symbols:
+        key, country = AGGREGATED_SYMBOLS[symbol]
+        if country not in hierarchy['country']['labels']:
+            continue
+        data = aggregate(hierarchy, results[key], 'country')
+        if country not in data.columns.get_level_values(0):    # empty node-level result
+            continue
+        if data.columns.nlevels > 1:
+            out[symbol] = data.xs(country, axis=1, level=0)
+        else:
+            out[symbol] = data[country]
+    return out
+
+
+def _membership(members, groups):
+    """
+    Sparse (members x groups) matrix with a 1 where the member belongs to the group
+    """
+    position = dict((m, i) for i, m in enumerate(members))
+    labels = [str(g) for g in groups]
+    rows, cols = [], []
+    for j, group in enumerate(groups):
+        for member in groups[group]:
+            if str(member) in position:
+                rows.append(position[str(member)])
+                cols.append(j)
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(members), len(labels)))
+    return {'labels': labels, 'matrix': matrix}
+
+
+def _column_matrix(hierarchy, columns, level, node_level):
+    """
+    Sparse (columns x aggregated columns) matrix mapping the columns of a node-level dataframe to the columns of the
+    aggregated dataframe
+    """
+    groups = hierarchy[level]
+    if columns.nlevels == 1:
+        nodes = pd.Index([str(c) for c in columns])
+        rest_codes = np.zeros(len(columns), dtype=int)
+        rest = [()]
+    else:
+        nodes = pd.Index([str(c) for c in columns.get_level_values(node_level)])
+        others = [i for i in range(columns.nlevels) if i != node_level]
+        keys = pd.MultiIndex.from_arrays([columns.get_level_values(i) for i in others]) if len(others) > 1 \
+            else columns.get_level_values(others[0])
+        rest_codes, rest = pd.factorize(keys)
+        rest = [r if isinstance(r, tuple) else (r,) for r in rest]
+    pos = pd.Index(hierarchy['nodes']).get_indexer(nodes)
+    known = pos >= 0
+    # Membership of each column in the groups, expanded over the other levels of the columns:
+    member = groups['matrix'][pos[known]].tocoo()
+    cols = np.where(known)[0][member.row]
+    target = member.col * len(rest) + rest_codes[cols]
+    matrix = sparse.csr_matrix((member.data, (cols, target)), shape=(len(columns), len(groups['labels']) * len(rest)))
+    used = np.unique(target)
+    labels = [(groups['labels'][t // len(rest)],) + rest[t % len(rest)] for t in used]
+    if columns.nlevels == 1:
+        new_columns = pd.Index([l[0] for l in labels])
+    else:
+        labels = [l[1:node_level + 1] + (l[0],) + l[node_level + 1:] for l in labels]
+        new_columns = pd.MultiIndex.from_arrays([[l[i] for l in labels] for i in range(columns.nlevels)],
+                                                names=columns.names)
+    return {'matrix': matrix[:, used], 'columns': new_columns}
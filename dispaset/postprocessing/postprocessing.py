@@ -13,12 +13,20 @@ import os
 import pickle
 import sys
 
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
 
-from ..misc.gdx_handler import gdx_to_list, gdx_to_dataframe, get_gams_path
+from ..misc.gdx_handler import open_gdx, close_gdx, get_gams_path
 from ..misc.str_handler import shrink_to_64, clean_strings
+from ..misc.topology import network_topology, get_topology, flow_balance
+from .results import SimResults
+from .result_cache import result_cache, RESULT_CACHE_MAX_SIZE
 from ..common import commons
 
 # get color definitions:
@@ -95,13 +103,7 @@ def get_load_data(inputs, c):
             if datain['Technology'].loc[t, u]:
                 VREunits.append(u)
                 VRE = VRE + datain['AvailabilityFactor'][u].values * datain['PowerCapacity'].loc[u, 'PowerCapacity']
-    Interconnections = np.zeros(len(out))
-    for l in datain['FlowMinimum']:
-        from_node, to_node = l.split('->')
-        if from_node.strip() == c:
-            Interconnections = Interconnections - datain['FlowMinimum'][l].values
-        elif to_node.strip() == c:
-            Interconnections = Interconnections + datain['FlowMinimum'][l].values
+    Interconnections = flow_balance(get_topology(inputs), datain['FlowMinimum'])[c].values
     out['ResidualLoad'] = out['Load'] - VRE
     out['NetResidualLoad'] = out['ResidualLoad'] - Interconnections
     return out
@@ -172,14 +174,9 @@ def get_plot_data(inputs, results, c):
         plotdata['Storage'] = 0
     plotdata.fillna(value=0, inplace=True)
 
-    plotdata['FlowIn'] = 0
-    plotdata['FlowOut'] = 0
-    for col in results['PowerFlow']:
-        from_node, to_node = col.split('->')
-        if to_node.strip() == c:
-            plotdata['FlowIn'] = plotdata['FlowIn'] + results['PowerFlow'][col]
-        if from_node.strip() == c:
-            plotdata['FlowOut'] = plotdata['FlowOut'] - results['PowerFlow'][col]
+    topology = get_topology(inputs)
+    plotdata['FlowIn'] = flow_balance(topology, results['PowerFlow'], 'in')[c]
+    plotdata['FlowOut'] = flow_balance(topology, results['PowerFlow'], 'out')[c]
 
     # re-ordering columns:
     OrderedColumns = [col for col in commons['MeritOrder'] if col in plotdata.columns]
@@ -405,11 +402,12 @@ def plot_energy_zone_fuel(inputs, results, PPindicators):
     for f in commons['Fuels'] + ['FlowIn']:
         if f not in GenPerZone:
             GenPerZone[f] = 0
+    balance = flow_balance(get_topology(inputs), results['PowerFlow']).sum()
     for c in zones:
         for f in fuels:
             tmp = PPindicators[(PPindicators.Fuel == f) & (PPindicators.Zone == c)]
             GenPerZone.loc[c, f] = tmp.Generation.sum()
-        NetImports = get_imports(results['PowerFlow'], c)
+        NetImports = balance.get(c, 0)
         if NetImports > 0:
             GenPerZone.loc[c, 'FlowIn'] = NetImports
 
@@ -457,15 +455,21 @@ def plot_zone_capacities(inputs, plot=True):
 
 
 
-def get_sim_results(path='.', gams_dir=None, cache=False, temp_path='.pickle'):
+def get_sim_results(path='.', gams_dir=None, cache=False, temp_path='.pickle', lazy=True, window=None,
+                    MaxCacheSize=RESULT_CACHE_MAX_SIZE):
     """
     This function reads the simulation environment folder once it has been solved and loads
     the input variables together with the results.
 
     :param path:                Relative path to the simulation environment folder (current path by default)
-    :param cache:               If true, caches the simulation results in a pickle file for faster loading the next time
-    :param temp_path:            Temporary path to store the cache file
-    :returns inputs,results:    Two dictionaries with all the input and outputs
+    :param cache:               If true, caches each symbol of the simulation results for faster loading the next time
+                                (see result_cache)
+    :param temp_path:            Temporary path to store the cache files
+    :param lazy:                If true, each result is only decoded when it is accessed for the first time
+    :param window:              Optional (start, stop) tuple of dates. If provided, only this time window is kept
+    :param MaxCacheSize:        Maximum size of the result cache, in bytes
+    :returns inputs,results:    Two dictionaries with all the input and outputs (results is a SimResults object
+                                if lazy is true)
     """
 
     inputfile = path + '/Inputs.p'
@@ -492,30 +496,6 @@ def get_sim_results(path='.', gams_dir=None, cache=False, temp_path='.pickle'):
         logging.error('GAMS path cannot be located. Cannot parse gdx files')
         return False
 
-    # Load results and store in cache file in the .pickle folder:
-    if cache:
-        import hashlib
-        m = hashlib.new('md5', resultfile.encode('utf-8'))
-        resultfile_hash = m.hexdigest()
-        filepath_pickle = str(temp_path + os.path.sep + resultfile_hash + '.p')
-        if not os.path.isdir(temp_path):
-            os.mkdir(temp_path)
-        if not os.path.isfile(filepath_pickle):
-            time_pd = 0
-        else:
-            time_pd = os.path.getmtime(filepath_pickle)
-        if os.path.getmtime(resultfile) > time_pd:
-            results = gdx_to_dataframe(gdx_to_list(gams_dir, resultfile, varname='all', verbose=True), fixindex=True,
-                                       verbose=True)
-            with open(filepath_pickle, 'wb') as pfile:
-                pickle.dump(results, pfile)
-        else:
-            with open(filepath_pickle, 'rb') as pfile:
-                results = pickle.load(pfile)
-    else:
-        results = gdx_to_dataframe(gdx_to_list(gams_dir, resultfile, varname='all', verbose=True), fixindex=True,
-                                   verbose=True)
-
     # Set datetime index:
     StartDate = inputs['config']['StartDate']
     StopDate = inputs['config']['StopDate']  # last day of the simulation with look-ahead period
@@ -523,92 +503,17 @@ def get_sim_results(path='.', gams_dir=None, cache=False, temp_path='.pickle'):
     index = pd.date_range(start=pd.datetime(*StartDate), end=pd.datetime(*StopDate), freq='h')
     index_long = pd.date_range(start=pd.datetime(*StartDate), end=StopDate_long, freq='h')
 
-    # Setting the proper index to the result dataframes:
-    for key in ['UnitCommitment','PowerFlow','TotalNodeOperationCost','TotalNodeVariableCost','TotalKSAVariableCost',
-                'NetNodeVariableCost','NetKSAVariableCost','ElectricityNodePrice','ElectricityNodePrice2',
-                'ElectricityNodePrice3','ElectricityKSAPrice','ElectricityKSAPrice2','ElectricityKSAPrice3',
-                'NodeOutputShedLoad','NodeOutputShedLoad','NodeShadowPrice','TotalNodeDemand','TotalKSADemand',
-                'OutputCurtailedPower','LostLoad_MaxPower','LostLoad_MinPower','LostLoad_2D','LostLoad_2U',
-                'LostLoad_3U','LostLoad_RampUp','LostLoad_RampDown','status','PowerFlowMaxLimit','PowerFlowMinLimit',
-                'UnitOutputPower','UnitOutputPowerInside','UnitOutputPowerOutside','UnitOutputPowerForNode',
-                'UnitFixedCost','UnitStartUpCost','UnitShutDownCost','UnitRampUpCost','UnitRampDownCost',
-                'UnitVariableCost','UnitOperationCost','LocalOutputPower','LocalOutputPowerCost','KSALocalOutputPower',
-                'KSALocalOutputPowerCost', 'TotalImportedPower','TotalImportedPowerCost','NetImportedPower',
-                'NetImportedPowerCost','KSANetImportedPower','KSANetImportedPowerCost','NetExportedPower',
-                'NetExportedPowerCost','KSANetExportedPower','KSANetExportedPowerCost','ImportedPowerFromNode',
-                'ImportedPowerFromNodeCost','NetImportedPowerFromNode','NetImportedPowerFromNodeCost',
-                'KSATotalImportedPower','KSATotalImportedPowerCost','KSAImportedPowerFromNode',
-                'KSAImportedPowerFromNodeCost','KSANetImportedPowerFromNode','KSANetImportedPowerFromNodeCost',
-                'TotalExportedPower','TotalExportedPowerCost','ExportedPowerToNode','ExportedPowerToNodeCost',
-                'NetExportedPowerToNode','NetExportedPowerToNodeCost','KSATotalExportedPower',
-                'KSATotalExportedPowerCost','KSAExportedPowerToNode','KSAExportedPowerToNodeCost',
-                'KSANetExportedPowerToNode','KSANetExportedPowerToNodeCost','LineCongestion','LineCongestion_KSA_GCC',
-                'LineCongestion_KW_GCC','LineCongestion_BA_GCC','LineCongestion_QA_GCC','LineCongestion_UAE_GCC',
-                'LineCongestion_OM_GCC','LineCongestion_UAE_Salwa','LineCongestion_Ghunan_Salwa',
-                'LineCongestion_Ghunan_Alfadhili','TotalSystemCost','NodeFuelPower','NodeFuelPowerCost',
-                'KSAFuelPowerCost','KSAFuelPower','NodeFuelConsumption','KSAFuelConsumption','NodeFuelCost',
-                'KSAFuelCost','NodeFuelGovSpending','KSAFuelGovSpending','NodeLocalFuelPowerCost',
-                'KSALocalFuelPowerCost','NodeFuelPowerExport','NodeFuelPowerExportCost','NodeFuelExport',
-                'NodeFuelExportCost','NodeFuelPowerImport','NodeFuelPowerImportCost','NodeFuelImport',
-                'NodeFuelImportCost','KSAFuelPowerExport','KSAFuelPowerExportCost','KSAFuelExport','KSAFuelExportCost',
-                'KSAFuelPowerImport','KSAFuelPowerImportCost','KSAFuelImport','KSAFuelImportCost']:
-        if key in results:
-            # Drop second level of DataFrame columns for some variables
-            if key in ['UnitVariableCost', 'UnitOperationCost'] and results[key].columns.nlevels > 2:
-                results[key].columns = results[key].columns.droplevel(1)
-            
-            if len(results[key]) == len(
-                    index_long):  # Case of variables for which the look-ahead period recorded (e.g. the lost loads)
-                results[key].index = index_long
-            elif len(results[key]) == len(
-                    index):  # Case of variables for which the look-ahead is not recorded (standard case)
-                results[key].index = index
-            else:  # Variables whose index is not complete (sparse formulation)
-                results[key].index = index_long[results[key].index - 1]
-                if key in ['UnitCommitment','PowerFlow','TotalNodeOperationCost','TotalNodeVariableCost','TotalKSAVariableCost',
-                            'NetNodeVariableCost','NetKSAVariableCost','ElectricityNodePrice','ElectricityNodePrice2',
-                            'ElectricityNodePrice3','ElectricityKSAPrice','ElectricityKSAPrice2','ElectricityKSAPrice3',
-                            'NodeOutputShedLoad','NodeOutputShedLoad','NodeShadowPrice','TotalNodeDemand','TotalKSADemand',
-                            'OutputCurtailedPower','LostLoad_MaxPower','LostLoad_MinPower','LostLoad_2D','LostLoad_2U','LostLoad_3U',
-                            'LostLoad_RampUp','LostLoad_RampDown','status','PowerFlowMaxLimit','PowerFlowMinLimit','UnitOutputPower',
-                            'UnitOutputPowerInside','UnitOutputPowerOutside','UnitOutputPowerForNode','UnitFixedCost',
-                            'UnitStartUpCost','UnitShutDownCost','UnitRampUpCost','UnitRampDownCost','UnitVariableCost',
-                            'UnitOperationCost','LocalOutputPower','LocalOutputPowerCost','KSALocalOutputPower',
-                            'KSALocalOutputPowerCost','TotalImportedPower','TotalImportedPowerCost','NetImportedPower',
-                            'NetImportedPowerCost','KSANetImportedPower','KSANetImportedPowerCost','NetExportedPower',
-                            'NetExportedPowerCost','KSANetExportedPower','KSANetExportedPowerCost','ImportedPowerFromNode',
-                            'ImportedPowerFromNodeCost','NetImportedPowerFromNode','NetImportedPowerFromNodeCost',
-                            'KSATotalImportedPower','KSATotalImportedPowerCost','KSAImportedPowerFromNode',
-                            'KSAImportedPowerFromNodeCost','KSANetImportedPowerFromNode','KSANetImportedPowerFromNodeCost',
-                            'TotalExportedPower','TotalExportedPowerCost','ExportedPowerToNode','ExportedPowerToNodeCost',
-                            'NetExportedPowerToNode','NetExportedPowerToNodeCost','KSATotalExportedPower',
-                            'KSATotalExportedPowerCost','KSAExportedPowerToNode','KSAExportedPowerToNodeCost',
-                            'KSANetExportedPowerToNode','KSANetExportedPowerToNodeCost','LineCongestion','LineCongestion_KSA_GCC',
-                            'LineCongestion_KW_GCC','LineCongestion_BA_GCC','LineCongestion_QA_GCC','LineCongestion_UAE_GCC',
-                            'LineCongestion_OM_GCC','LineCongestion_UAE_Salwa','LineCongestion_Ghunan_Salwa',
-                            'LineCongestion_Ghunan_Alfadhili','TotalSystemCost','NodeFuelPower','NodeFuelPowerCost',
-                            'KSAFuelPowerCost','KSAFuelPower','NodeFuelConsumption','KSAFuelConsumption','NodeFuelCost',
-                            'KSAFuelCost','NodeFuelGovSpending','KSAFuelGovSpending','NodeLocalFuelPowerCost',
-                            'KSALocalFuelPowerCost','NodeFuelPowerExport','NodeFuelPowerExportCost','NodeFuelExport',
-                            'NodeFuelExportCost','NodeFuelPowerImport','NodeFuelPowerImportCost','NodeFuelImport',
-                            'NodeFuelImportCost','KSAFuelPowerExport','KSAFuelPowerExportCost','KSAFuelExport','KSAFuelExportCost',
-                            'KSAFuelPowerImport','KSAFuelPowerImportCost','KSAFuelImport','KSAFuelImportCost']:
-                    results[key] = results[key].reindex(index).fillna(0)
-                    # results[key].fillna(0,inplace=True)
-        else:
-            results[key] = pd.DataFrame(index=index)
-
-    # Clean power plant names:
-    results['UnitOutputPower'].columns = clean_strings(results['UnitOutputPower'].columns.tolist())
-    # Remove epsilons:
-    if 'NodeShadowPrice' in results:
-        results['NodeShadowPrice'][results['NodeShadowPrice'] == 5e300] = 0
-
-    for key in results['UnitOutputPower']:
-        if key not in inputs['units'].index:
-            logging.error("Unit '" + key + "' present in the results cannot be found in the input 'units' dataframe")
-        if key not in inputs['sets']['u']:
-            logging.error("Unit '" + key + "' present in the results cannot be found in the set 'u' from the inputs")
+    # The symbols are decoded and indexed when they are accessed for the first time. With the cache, the symbols
+    # already read from the same result file are loaded from their cache entries. The result file is only kept open
+    # while symbols are read:
+    cache = result_cache(temp_path, resultfile, MaxCacheSize) if cache else None
+    gdx = open_gdx(gams_dir, resultfile)
+    close_gdx(gdx)
+    results = SimResults(inputs, index, index_long, gdx=gdx, window=window, cache=cache)
+    if not lazy:
+        results.load()
+        results.close()
+        results = dict(results.items())
 
     if "model" in results['status']:
         errors = results['status'][(results['status']['model'] != 1) & (results['status']['model'] != 8)]
@@ -686,13 +591,7 @@ def get_imports(flows, c):
     :param c:           Zone to consider
     :returns NetImports: Scalar with the net balance over the whole time period
     """
-    NetImports = 0
-    for key in flows:
-        if key[:len(c)] == c:
-            NetImports -= flows[key].sum()
-        elif key[-len(c):] == c:
-            NetImports += flows[key].sum()
-    return NetImports
+    return flow_balance(network_topology(flows.columns, [c]), flows)[c].sum()
 
 
 # %%
@@ -716,7 +615,10 @@ def get_result_analysis(inputs, results):
     # PeakLoad = inputs['parameters']['Demand']['val'][0,:,idx].sum(axis=0).max()
     PeakLoad = dfin['Demand']['DA'].sum(axis=1).max(axis=0)
 
-    NetImports = -get_imports(results['PowerFlow'], 'RoW')
+    # Net imports of each zone. The flows between simulated zones cancel out in the sum over the zones, which is
+    # therefore equal to the net imports from the rest of the world:
+    balance = flow_balance(get_topology(inputs), results['PowerFlow']).sum()
+    NetImports = balance.sum()
 
     Cost_kwh = results['TotalSystemCost'].sum() / (TotalLoad - NetImports)
 
@@ -742,9 +644,7 @@ def get_result_analysis(inputs, results):
     ZoneData['Demand'] = dfin['Demand']['DA'].sum(axis=0) / 1E6
     ZoneData['PeakLoad'] = dfin['Demand']['DA'].max(axis=0)
 
-    ZoneData['NetImports'] = 0
-    for c in ZoneData.index:
-        ZoneData.loc[c, 'NetImports'] = get_imports(results['PowerFlow'], str(c)) / 1E6
+    ZoneData['NetImports'] = balance.reindex([str(c) for c in ZoneData.index]).values / 1E6
 
     ZoneData['LoadShedding'] = results['NodeOutputShedLoad'].sum(axis=0) / 1E6
     ZoneData['Curtailment'] = results['NodeOutputCurtailedPower'].sum(axis=0) / 1E6
@@ -840,10 +740,11 @@ def get_indicators_powerplant(inputs, results):
 
 def ds_to_df(inputs):
     """
-    Function that converts the dispaset data format into a dictionary of dataframes
+    Function that converts the dispaset data format into a dictionary of dataframes. The dataframes are only built
+    when they are accessed for the first time, as views of the arrays of the parameters (without copy)
 
     :param inputs: input file
-    :return: dictionary of dataframes
+    :return: dictionary of dataframes (ParamFrames object)
     """
 
     sets, parameters = inputs['sets'], inputs['parameters']
@@ -870,52 +771,101 @@ def ds_to_df(inputs):
         logging.warn('The provided index has a length of ' + str(len(dates)) + ' while the simulation was designed for ' + str(
             len(sets['z'])) + ' time elements')
 
-    idx = range(len(dates))
-
-    out = {}
-    out['sets'] = sets
-
-    # Printing each parameter in a separate sheet and workbook:
     for p in parameters:
         var = parameters[p]
-        dim = len(var['sets'])
-        if var['sets'][-1] == 'h' and timeindex and dim > 1:
-            # if len(dates) != var['val'].shape[-1]:
-            #    sys.exit('The date range in the Config variable (' + str(len(dates)) + ' time steps) does not match the length of the time index (' + str(var['val'].shape[-1]) + ') for variable ' + p)
+        if var['sets'][-1] == 'h' and timeindex and len(var['sets']) > 1:
             var['firstrow'] = 5
         else:
             var['firstrow'] = 1
-        if dim == 1:
-            if var['sets'][0] == 'h':
-                out[p] = pd.DataFrame(var['val'][idx], columns=[p], index=dates)
-            else:
-                out[p] = pd.DataFrame(var['val'], columns=[p], index=sets[var['sets'][0]])
-        elif dim == 2:
-            values = var['val']
-            list_sets = [sets[var['sets'][0]], sets[var['sets'][1]]]
-            if var['sets'][1] == 'h':
-                out[p] = pd.DataFrame(values.transpose()[idx, :], index=dates, columns=list_sets[0])
-            else:
-                out[p] = pd.DataFrame(values.transpose(), index=list_sets[1], columns=list_sets[0])
-        elif dim == 3:
-            list_sets = [sets[var['sets'][0]], sets[var['sets'][1]], sets[var['sets'][2]]]
-            values = var['val']
-            values2 = np.zeros([len(list_sets[0]) * len(list_sets[1]), len(list_sets[2])])
-            cols = np.zeros([2, len(list_sets[0]) * len(list_sets[1])])
-            for i in range(len(list_sets[0])):
-                values2[i * len(list_sets[1]):(i + 1) * len(list_sets[1]), :] = values[i, :, :]
-                cols[0, i * len(list_sets[1]):(i + 1) * len(list_sets[1])] = i
-                cols[1, i * len(list_sets[1]):(i + 1) * len(list_sets[1])] = range(len(list_sets[1]))
-
-            columns = pd.MultiIndex([list_sets[0], list_sets[1]], cols)
-            if var['sets'][2] == 'h':
-                out[p] = pd.DataFrame(values2.transpose()[idx, :], index=dates, columns=columns)
-            else:
-                out[p] = pd.DataFrame(values2.transpose(), index=list_sets[2], columns=columns)
+    return ParamFrames(sets, parameters, dates)
+
+
+class ParamFrames(MutableMapping):
+    """
+    Dictionary of the parameters of the DispaSET inputs as dataframes (see ds_to_df), built on first access
+
+    :param sets:        Sets of the inputs
+    :param parameters:  Parameters of the inputs
+    :param dates:       Index of the time steps
+    """
+
+    def __init__(self, sets, parameters, dates):
+        self.sets = sets
+        self.parameters = parameters
+        self.dates = dates
+        self._data = {'sets': sets}
+        self._deleted = set()
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            if key in self._deleted or key not in self.parameters:
+                raise KeyError(key)
+            self._data[key] = param_to_df(self.sets, key, self.parameters[key], self.dates)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._data.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        return key not in self._deleted and (key in self._data or key in self.parameters)
+
+    def __iter__(self):
+        keys = ['sets'] + list(self.parameters)
+        keys += [key for key in self._data if key not in keys]
+        return iter([key for key in keys if key not in self._deleted])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __reduce__(self):
+        # Pickled as a regular dictionary, with all the dataframes built:
+        return dict, (dict(self.items()),)
+
+
+def param_to_df(sets, p, var, dates):
+    """
+    Function that wraps the array of a parameter into a dataframe, without copying the values
+
+    :param sets:    Sets of the inputs
+    :param p:       Name of the parameter
+    :param var:     Parameter (dictionary with the 'sets' and 'val' keys)
+    :param dates:   Index of the time steps
+    :return:        Dataframe with the last dimension of the parameter as index
+    """
+    dim = len(var['sets'])
+    values = np.asarray(var['val'])
+    if dim == 1:
+        if var['sets'][0] == 'h':
+            return pd.DataFrame(values[:len(dates)], columns=[p], index=dates)
         else:
-            logging.error('Only three dimensions currently supported. Parameter ' + p + ' has ' + str(dim) + ' dimensions.')
-            sys.exit(1)
-    return out
+            return pd.DataFrame(values, columns=[p], index=sets[var['sets'][0]])
+    elif dim == 2:
+        list_sets = [sets[var['sets'][0]], sets[var['sets'][1]]]
+        if var['sets'][1] == 'h':
+            return pd.DataFrame(values.transpose()[:len(dates), :], index=dates, columns=list_sets[0])
+        else:
+            return pd.DataFrame(values.transpose(), index=list_sets[1], columns=list_sets[0])
+    elif dim == 3:
+        list_sets = [sets[var['sets'][0]], sets[var['sets'][1]], sets[var['sets'][2]]]
+        # The first two dimensions are merged into the columns (the first one varying the slowest):
+        n0, n1 = len(list_sets[0]), len(list_sets[1])
+        values2 = values.reshape(n0 * n1, len(list_sets[2]))
+        columns = pd.MultiIndex([list_sets[0], list_sets[1]], [np.repeat(np.arange(n0), n1), np.tile(np.arange(n1), n0)])
+        if var['sets'][2] == 'h':
+            return pd.DataFrame(values2.transpose()[:len(dates), :], index=dates, columns=columns)
+        else:
+            return pd.DataFrame(values2.transpose(), index=list_sets[2], columns=columns)
+    else:
+        logging.error('Only three dimensions currently supported. Parameter ' + p + ' has ' + str(dim) + ' dimensions.')
+        sys.exit(1)
+
 
 def CostExPost(inputs,results):
     '''
@@ -1070,59 +1020,36 @@ def get_units_operation_cost(inputs, results, zone = 'All'):
     :returns UnitOperationCost:       Dataframe with the the power units in columns and the operatopn cost at each instant in rows
     """
 
-    datain = ds_to_df(inputs)
-
-    #DataFrame with startup times for each unit (1 for startup)
-    StartUps = results['UnitCommitment'].copy()
-    for u in StartUps:
-        values = StartUps.loc[:, u].values
-        diff = -(np.roll(values, 1) - values )
-        diff[diff <= 0] = 0
-        StartUps[u] = diff
-
-    #DataFrame with shutdown times for each unit (1 for shutdown)
-    ShutDowns = results['UnitCommitment'].copy()
-    for u in ShutDowns:
-        values = ShutDowns.loc[:, u].values
-        diff = (np.roll(values, 1) - values )
-        diff[diff <= 0] = 0
-        ShutDowns[u] = diff
-
-    #DataFrame with ramping up levels for each unit at each instant (0 for ramping-down & leveling out)
-    RampUps = results['UnitOutputPower'].copy()
-    for u in RampUps:
-        values = RampUps.loc[:, u].values
-        diff = -(np.roll(values, 1) - values )
-        diff[diff <= 0] = 0
-        RampUps[u] = diff
-
-    #DataFrame with ramping down levels for each unit at each instant (0 for ramping-up & leveling out)
-    RampDowns = results['UnitOutputPower'].copy()
-    for u in RampDowns:
-        values = RampDowns.loc[:, u].values
-        diff = (np.roll(values, 1) - values )
-        diff[diff <= 0] = 0
-        RampDowns[u] = diff
-
-    FixedCost = results['UnitCommitment'].copy()
-    StartUpCost = results['UnitCommitment'].copy()
-    ShutDownCost = results['UnitCommitment'].copy()
-    RampUpCost = results['UnitCommitment'].copy()
-    RampDownCost = results['UnitCommitment'].copy()
-    VariableCost = results['UnitCommitment'].copy()
-    UnitOperationCost = results['UnitCommitment'].copy()
-
-    OperatedUnitList = results['UnitCommitment'].columns
-    for u in OperatedUnitList:
-        unit_indexNo = inputs['units'].index.get_loc(u)
-        FixedCost.loc[:,[u]] = np.array(results['UnitCommitment'].loc[:,[u]])*inputs['parameters']['CostFixed']['val'][unit_indexNo]
-        StartUpCost.loc[:,[u]] = np.array(StartUps.loc[:,[u]])*inputs['parameters']['CostStartUp']['val'][unit_indexNo]
-        ShutDownCost.loc[:,[u]] = np.array(ShutDowns.loc[:,[u]])*inputs['parameters']['CostShutDown']['val'][unit_indexNo]
-        RampUpCost.loc[:,[u]] = np.array(RampUps.loc[:,[u]])*inputs['parameters']['CostRampUp']['val'][unit_indexNo]
-        RampDownCost.loc[:,[u]] = np.array(RampDowns.loc[:,[u]])*inputs['parameters']['CostRampDown']['val'][unit_indexNo]
-        VariableCost.loc[:,[u]] = np.array(datain['CostVariable'].loc[:,[u]])*np.array(results['UnitOutputPower'][u]).reshape(-1,1)
-
-    UnitOperationCost = FixedCost+StartUpCost+ShutDownCost+RampUpCost+RampDownCost+VariableCost
+    datain = inputs['param_df'] if 'param_df' in inputs else ds_to_df(inputs)
+
+    commitment = results['UnitCommitment']
+    units = commitment.columns
+    positions = inputs['units'].index.get_indexer(units)
+    if (positions < 0).any():
+        logging.error('The units ' + str(list(units[positions < 0])) + ' present in the results cannot be found in the '
+                      'inputs')
+        sys.exit(1)
+    # Costs of the units, broadcast over the time steps:
+    unit_cost = dict((p, np.asarray(inputs['parameters'][p]['val'])[positions]) for p in
+                     ['CostFixed', 'CostStartUp', 'CostShutDown', 'CostRampUp', 'CostRampDown'])
+
+    # Changes of the commitment and power of each unit since the previous time step (the first time step is
+    # compared with the last one):
+    committed = commitment.values
+    power = results['UnitOutputPower'][units].values
+    CommitmentChange = committed - np.roll(committed, 1, axis=0)
+    PowerChange = power - np.roll(power, 1, axis=0)
+
+    StartUps = np.maximum(CommitmentChange, 0)      # 1 for startup
+    ShutDowns = np.maximum(-CommitmentChange, 0)    # 1 for shutdown
+    RampUps = np.maximum(PowerChange, 0)            # ramping up levels
+    RampDowns = np.maximum(-PowerChange, 0)         # ramping down levels
+
+    CostVariable = datain['CostVariable'].reindex(index=commitment.index, columns=units).values
+    UnitOperationCost = pd.DataFrame(committed * unit_cost['CostFixed'] + StartUps * unit_cost['CostStartUp'] +
+                                     ShutDowns * unit_cost['CostShutDown'] + RampUps * unit_cost['CostRampUp'] +
+                                     RampDowns * unit_cost['CostRampDown'] + CostVariable * power,
+                                     index=commitment.index, columns=units)
 
     try:
         if zone == 'All':
@@ -1149,7 +1076,7 @@ def get_sorted_units(inputs, results, zone='All', sortby='CostVariable', ascendi
     :param ascending:   'True' when sorting in ascending order ('False' for descending order)
     :returns SortedInputs:       Dataframe with the the sorted power units in rows and their characteristics in columns
     """
-    datain = ds_to_df(inputs)
+    datain = inputs['param_df'] if 'param_df' in inputs else ds_to_df(inputs)
 
     try:
         DataType = inputs['units'][sortby].dtype
@@ -1220,9 +1147,9 @@ def get_nodes_generation_cost(inputs, results):
     :returns out:       Dataframe with the the zones in columns and the generation cost at each instant in rows
     """
     AllUnitsCosts = get_units_operation_cost(inputs, results)
-    NodesGenerationCost = pd.DataFrame(index = AllUnitsCosts.index, columns = inputs['config']['zones'])
-    for zone in inputs['config']['zones']:
-        NodesGenerationCost[zone] = get_units_operation_cost(inputs, results, zone = zone).sum(axis=1).values
+    # Sum of the costs of the units of each zone:
+    zones = inputs['units']['Zone'].reindex(AllUnitsCosts.columns).values
+    NodesGenerationCost = AllUnitsCosts.T.groupby(zones).sum().T.reindex(columns=inputs['config']['zones'], fill_value=0.)
 
     return NodesGenerationCost
 
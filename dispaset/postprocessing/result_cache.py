@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Per-symbol cache of the DispaSET results.
+
+Each symbol of a Results.gdx file is stored in the cache directory as a separate entry: the values as a column-major
+numpy array, which is memory-mapped when read, and a small pickled file with the index and the columns (dataframes
+with mixed or non-numeric types are pickled as a whole). The entries are identified by the hash of the content of the
+result file, so that a new solve never returns stale results. A result file that has been opened before then only costs
+the reading of the symbols that are actually accessed. The least recently used entries are removed when the size of the
+cache exceeds its maximum size (the hashes of the result files recorded in the cache directory are counted and removed
+in the same way). Entries are written atomically, so that several processes can share the same cache.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import pickle
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from ..preprocessing.data_handler import _file_hash
+from ..preprocessing.data_store import _atomic_write
+
+RESULT_CACHE_VERSION = 1                # To be incremented if the format of the entries changes
+RESULT_CACHE_MAX_SIZE = 5 * 1024 ** 3   # Default maximum size of the result cache directory, in bytes
+
+
+def result_cache(path, resultfile, MaxCacheSize=RESULT_CACHE_MAX_SIZE):
+    """
+    Function that defines the cache of the symbols of a result file
+
+    :param path:            Path to the cache directory
+    :param resultfile:      Path to the Results.gdx file
+    :param MaxCacheSize:    Maximum size of the cache directory, in bytes
+    :return:                Dictionary with the cache options and the key identifying the content of the result file
+    """
+    key = hashlib.sha1((str(RESULT_CACHE_VERSION) + _result_hash(path, resultfile)).encode('utf-8')).hexdigest()
+    return {'path': path, 'key': key, 'size': MaxCacheSize or RESULT_CACHE_MAX_SIZE}
+
+
+def read_result_entry(cache, symbol):
+    """
+    Function that loads a symbol from the result cache, or returns None if it is not available. The values are
+    memory-mapped in copy-on-write mode, so that the returned data can be modified without altering the cache.
+    """
+    entryfile = _entryfile(cache, symbol)
+    try:
+        with open(entryfile + '.p', 'rb') as f:
+            entry = pickle.load(f)
+        if entry['data'] is not None:
+            data = entry['data']
+        else:
+            values = np.load(entryfile + '.npy', mmap_mode='c')
+            if values.ndim == 1:
+                data = pd.Series(values, index=entry['index'], name=entry['name'], copy=False)
+            else:
+                data = pd.DataFrame(values, index=entry['index'], columns=entry['columns'], copy=False)
+        # The modification time of the entry is used for the least recently used eviction policy:
+        os.utime(entryfile + '.p', None)
+    except (IOError, OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+        return None
+    return data
+
+
+def write_result_entry(cache, symbol, data):
+    """
+    Function that writes a symbol in the result cache and removes the least recently used entries if the cache is full.
+    The files are written under temporary names and then renamed, so that concurrent readers never see a partially
+    written entry. The values are written before the entry file that refers to them, and removed if the entry file
+    cannot be written.
+
+    :return:    True if the entry has been written
+    """
+    entryfile = _entryfile(cache, symbol)
+    tmp = '.' + str(os.getpid()) + '_' + uuid.uuid4().hex + '.tmp'
+    if isinstance(data, pd.Series):
+        numeric = data.dtype.kind in 'fiub'
+    else:
+        numeric = data.shape[1] > 0 and len(set(data.dtypes)) == 1 and data.dtypes.iloc[0].kind in 'fiub'
+    try:
+        if not os.path.isdir(cache['path']):
+            os.makedirs(cache['path'])
+    except OSError:
+        pass
+    values = False
+    try:
+        if numeric:
+            with open(entryfile + '.npy' + tmp, 'wb') as f:
+                np.save(f, np.asfortranarray(data.values))
+            os.replace(entryfile + '.npy' + tmp, entryfile + '.npy')
+            values = True
+            entry = {'data': None, 'index': data.index, 'columns': getattr(data, 'columns', None),
+                     'name': getattr(data, 'name', None)}
+        else:
+            entry = {'data': data}
+        with open(entryfile + '.p' + tmp, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entryfile + '.p' + tmp, entryfile + '.p')
+    except (IOError, OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        logging.warning('Could not write the result cache entry ' + entryfile + ': ' + str(e))
+        tmpfiles = [entryfile + '.npy' + tmp, entryfile + '.p' + tmp] + ([entryfile + '.npy'] if values else [])
+        for filename in tmpfiles:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        return False
+    _evict_result_entries(cache['path'], cache['size'])
+    return True
+
+
+def result_cache_info(path):
+    """
+    Function that returns the number of entries and the total size of a result cache directory
+    """
+    entries = _list_result_entries(path)
+    return {'entries': len([files for _, _, files in entries if files[0].endswith('.p')]),
+            'size': sum(size for _, size, _ in entries)}
+
+
+def _entryfile(cache, symbol):
+    return os.path.join(cache['path'], 'gdx_' + cache['key'] + '_' + symbol)
+
+
+def _result_hash(path, resultfile):
+    """
+    Hash of the content of the result file. It is recorded in the cache directory together with the size and the
+    modification time of the file, so that a large result file is only hashed again when it has been modified.
+    """
+    stat = os.stat(resultfile)
+    version = [os.path.abspath(resultfile), stat.st_size, stat.st_mtime]
+    record = os.path.join(path, 'gdx_' + hashlib.sha1(version[0].encode('utf-8')).hexdigest() + '.json')
+    try:
+        with open(record, 'rb') as f:
+            content = json.loads(f.read().decode('utf-8'))
+        if content['version'] == version:
+            # The modification time of the record is used for the least recently used eviction policy:
+            os.utime(record, None)
+            return content['sha1']
+    except (IOError, OSError, ValueError, KeyError):
+        pass
+    sha1 = _file_hash(resultfile)
+    try:
+        _atomic_write(record, json.dumps({'version': version, 'sha1': sha1}).encode('utf-8'))
+    except (IOError, OSError) as e:
+        logging.warning('Could not write the hash of the result file in ' + record + ': ' + str(e))
+    return sha1
+
+
+def _list_result_entries(path):
+    """
+    Lists the files of the result cache with their last use time and their size on disk, grouped by entry: the symbol
+    entries (entry file and values), the values left without an entry file and the hash records of the result files
+    """
+    entries = []
+    if not os.path.isdir(path):
+        return entries
+    names = set(name for name in os.listdir(path) if name.startswith('gdx_') and name.endswith(('.p', '.npy', '.json')))
+    for name in names:
+        stem, suffix = os.path.splitext(name)
+        if suffix == '.npy' and stem + '.p' in names:
+            continue    # listed with its entry file
+        files = [os.path.join(path, name)]
+        if suffix == '.p' and stem + '.npy' in names:
+            files.append(os.path.join(path, stem + '.npy'))
+        try:
+            mtime = os.stat(files[0]).st_mtime
+            size = sum(os.path.getsize(filename) for filename in files)
+        except OSError:     # removed by another process
+            continue
+        entries.append((mtime, size, files))
+    return entries
+
+
+def _evict_result_entries(path, MaxCacheSize):
+    """
+    Removes the least recently used result cache entries until the cache size is below MaxCacheSize
+    """
+    entries = sorted(_list_result_entries(path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, files in entries:
+        if total <= MaxCacheSize:
+            break
+        for filename in files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        total -= size
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+"""
+Lazy loading of the DispaSET results.
+
+The Results.gdx file is opened once and its symbol table is indexed. Each symbol is only decoded when it is accessed
+for the first time, at which point its datetime index is set (and the optional time window applied), so that the
+analysis of large result files can start immediately. The file is closed after the indexing and only opened again
+while symbols are read, so that no file handle is held by the results between two reads. With a result cache (see result_cache), the symbols read once
+are memory-mapped from their cache entries the next time the same result file is opened.
+"""
+
+import logging
+
+try:
+    from collections.abc import MutableMapping
+except ImportError:
+    from collections import MutableMapping
+
+import pandas as pd
+
+from ..misc.gdx_handler import read_gdx_symbol, reopen_gdx, close_gdx, arrays_to_dataframe
+from ..misc.str_handler import clean_strings
+from .aggregation import AGGREGATED_SYMBOLS, aggregated_symbols
+from .result_cache import read_result_entry, write_result_entry
+
+# Results indexed by the time steps of the simulation (an empty dataframe is returned if they are not in the gdx):
+TIME_SYMBOLS = ['UnitCommitment', 'PowerFlow', 'TotalNodeOperationCost', 'TotalNodeVariableCost',
+                'TotalKSAVariableCost', 'NetNodeVariableCost', 'NetKSAVariableCost', 'ElectricityNodePrice',
+                'ElectricityNodePrice2', 'ElectricityNodePrice3', 'ElectricityKSAPrice', 'ElectricityKSAPrice2',
+                'ElectricityKSAPrice3', 'NodeOutputShedLoad', 'NodeShadowPrice', 'TotalNodeDemand', 'TotalKSADemand',
+                'OutputCurtailedPower', 'LostLoad_MaxPower', 'LostLoad_MinPower', 'LostLoad_2D', 'LostLoad_2U',
+                'LostLoad_3U', 'LostLoad_RampUp', 'LostLoad_RampDown', 'status', 'PowerFlowMaxLimit',
+                'PowerFlowMinLimit', 'UnitOutputPower', 'UnitOutputPowerInside', 'UnitOutputPowerOutside',
+                'UnitOutputPowerForNode', 'UnitFixedCost', 'UnitStartUpCost', 'UnitShutDownCost', 'UnitRampUpCost',
+                'UnitRampDownCost', 'UnitVariableCost', 'UnitOperationCost', 'LocalOutputPower',
+                'LocalOutputPowerCost', 'KSALocalOutputPower', 'KSALocalOutputPowerCost', 'TotalImportedPower',
+                'TotalImportedPowerCost', 'NetImportedPower', 'NetImportedPowerCost', 'KSANetImportedPower',
+                'KSANetImportedPowerCost', 'NetExportedPower', 'NetExportedPowerCost', 'KSANetExportedPower',
+                'KSANetExportedPowerCost', 'ImportedPowerFromNode', 'ImportedPowerFromNodeCost',
+                'NetImportedPowerFromNode', 'NetImportedPowerFromNodeCost', 'KSATotalImportedPower',
+                'KSATotalImportedPowerCost', 'KSAImportedPowerFromNode', 'KSAImportedPowerFromNodeCost',
+                'KSANetImportedPowerFromNode', 'KSANetImportedPowerFromNodeCost', 'TotalExportedPower',
+                'TotalExportedPowerCost', 'ExportedPowerToNode', 'ExportedPowerToNodeCost', 'NetExportedPowerToNode',
+                'NetExportedPowerToNodeCost', 'KSATotalExportedPower', 'KSATotalExportedPowerCost',
+                'KSAExportedPowerToNode', 'KSAExportedPowerToNodeCost', 'KSANetExportedPowerToNode',
+                'KSANetExportedPowerToNodeCost', 'LineCongestion', 'LineCongestion_KSA_GCC', 'LineCongestion_KW_GCC',
+                'LineCongestion_BA_GCC', 'LineCongestion_QA_GCC', 'LineCongestion_UAE_GCC', 'LineCongestion_OM_GCC',
+                'LineCongestion_UAE_Salwa', 'LineCongestion_Ghunan_Salwa', 'LineCongestion_Ghunan_Alfadhili',
+                'TotalSystemCost', 'NodeFuelPower', 'NodeFuelPowerCost', 'KSAFuelPowerCost', 'KSAFuelPower',
+                'NodeFuelConsumption', 'KSAFuelConsumption', 'NodeFuelCost', 'KSAFuelCost', 'NodeFuelGovSpending',
+                'KSAFuelGovSpending', 'NodeLocalFuelPowerCost', 'KSALocalFuelPowerCost', 'NodeFuelPowerExport',
+                'NodeFuelPowerExportCost', 'NodeFuelExport', 'NodeFuelExportCost', 'NodeFuelPowerImport',
+                'NodeFuelPowerImportCost', 'NodeFuelImport', 'NodeFuelImportCost', 'KSAFuelPowerExport',
+                'KSAFuelPowerExportCost', 'KSAFuelExport', 'KSAFuelExportCost', 'KSAFuelPowerImport',
+                'KSAFuelPowerImportCost', 'KSAFuelImport', 'KSAFuelImportCost']
+
+
+class SimResults(MutableMapping):
+    """
+    Dictionary of the results of a DispaSET simulation, whose symbols are decoded and indexed on first access.
+
+    :param inputs:      DispaSET inputs
+    :param index:       Datetime index of the simulation
+    :param index_long:  Datetime index of the simulation, including the look-ahead period
+    :param gdx:         Result file indexed with open_gdx. It is opened again when symbols are read
+    :param raw:         Alternatively, dictionary with the raw dataframes of the results (output of arrays_to_dataframe)
+    :param window:      Optional (start, stop) tuple. If provided, only this time window of the results is kept
+    :param cache:       Optional result cache (see result_cache). The symbols are read from the cache if available
+                        and written to it when they are read from the result file
+    """
+
+    def __init__(self, inputs, index, index_long, gdx=None, raw=None, window=None, cache=None):
+        self.inputs = inputs
+        self.index = index
+        self.index_long = index_long
+        self.window = window
+        self._gdx = gdx
+        self._cache = cache
+        self._raw = raw if raw is not None else {}
+        if gdx is not None:
+            self._symbols = [name for name in gdx['symbols'] if gdx['symbols'][name][2] > 0]
+        else:
+            self._symbols = list(self._raw)
+        self._data = {}
+        self._deleted = set()
+        self._closed = False
+
+    def __getitem__(self, key):
+        if key not in self._data:
+            if key in self._deleted:
+                raise KeyError(key)
+            self._data[key] = self._load(key)
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = value
+        self._deleted.discard(key)
+
+    def __delitem__(self, key):
+        if key not in self:
+            raise KeyError(key)
+        self._data.pop(key, None)
+        self._deleted.add(key)
+
+    def __contains__(self, key):
+        if key in self._deleted:
+            return False
+        return key in self._data or key in self._symbols or key in TIME_SYMBOLS
+
+    def __iter__(self):
+        keys = self._symbols + [key for key in TIME_SYMBOLS if key not in self._symbols]
+        keys += [key for key in self._data if key not in keys]
+        return iter([key for key in keys if key not in self._deleted])
+
+    def __len__(self):
+        return len(list(iter(self)))
+
+    def __reduce__(self):
+        # Pickled as a regular dictionary, with all the symbols loaded:
+        return dict, (dict(self.items()),)
+
+    def load(self, keys=None):
+        """
+        Decodes the specified symbols (all symbols by default) and returns the object
+        """
+        # The result file is opened once for all the symbols:
+        reopened = self._gdx is not None and not self._closed and not self._gdx['open'] and reopen_gdx(self._gdx)
+        try:
+            for key in (list(self) if keys is None else keys):
+                self[key]
+        finally:
+            if reopened:
+                close_gdx(self._gdx)
+        return self
+
+    def close(self):
+        """
+        Releases the result file. The symbols that have not been accessed yet can no longer be loaded
+        """
+        if self._gdx is not None:
+            close_gdx(self._gdx)
+        self._closed = True
+
+    def _read(self, key):
+        """
+        Raw dataframe of a symbol (None if the symbol is not available)
+        """
+        if key in self._raw:
+            # The index and columns are set on a copy, the raw dataframe may be shared:
+            return self._raw[key].copy(deep=False)
+        if self._gdx is not None and key in self._symbols:
+            if self._cache is not None:
+                data = read_result_entry(self._cache, key)
+                if data is not None:
+                    return data
+            if self._closed:
+                logging.error('The result file ' + self._gdx['filename'] + ' has been closed. ' + key +
+                              ' cannot be loaded')
+                return None
+            reopened = not self._gdx['open']
+            if not reopen_gdx(self._gdx):
+                logging.error(key + ' cannot be loaded')
+                return None
+            try:
+                data = arrays_to_dataframe({key: read_gdx_symbol(self._gdx, key)}, fixindex=True).get(key)
+            finally:
+                if reopened:
+                    close_gdx(self._gdx)
+            if data is not None and self._cache is not None:
+                write_result_entry(self._cache, key, data)
+            return data
+        return None
+
+    def _load(self, key):
+        data = self._read(key)
+        if data is None and key in AGGREGATED_SYMBOLS and AGGREGATED_SYMBOLS[key][0] in self:
+            # Country-level symbol not written by the model, derived from the node-level result:
+            source = AGGREGATED_SYMBOLS[key][0]
+            return aggregated_symbols(self.inputs, {source: self[source]}, [key]).get(key, self._empty())
+        if data is None:
+            if key in TIME_SYMBOLS:
+                return self._empty()
+            raise KeyError(key)
+        return process_symbol(self.inputs, key, data, self.index, self.index_long, self.window)
+
+    def _empty(self):
+        return _apply_window(pd.DataFrame(index=self.index), self.window)
+
+
+def process_symbol(inputs, key, data, index, index_long, window=None):
+    """
+    Function that sets the datetime index of a result and cleans it
+
+    :param inputs:      DispaSET inputs
+    :param key:         Name of the result
+    :param data:        Raw dataframe of the result (output of arrays_to_dataframe)
+    :param index:       Datetime index of the simulation
+    :param index_long:  Datetime index of the simulation, including the look-ahead period
+    :param window:      Optional (start, stop) tuple with the time window to be kept
+    """
+    if key in TIME_SYMBOLS:
+        # Drop second level of DataFrame columns for some variables
+        if key in ['UnitVariableCost', 'UnitOperationCost'] and data.columns.nlevels > 2:
+            data.columns = data.columns.droplevel(1)
+
+        if len(data) == len(index_long):  # Case of variables for which the look-ahead period recorded (e.g. the lost loads)
+            data.index = index_long
+        elif len(data) == len(index):  # Case of variables for which the look-ahead is not recorded (standard case)
+            data.index = index
+        else:  # Variables whose index is not complete (sparse formulation)
+            data.index = index_long[data.index - 1]
+            data = data.reindex(index).fillna(0)
+        data = _apply_window(data, window)
+
+    if key == 'UnitOutputPower':
+        # Clean power plant names:
+        data.columns = clean_strings(data.columns.tolist())
+        for u in data:
+            if u not in inputs['units'].index:
+                logging.error("Unit '" + u + "' present in the results cannot be found in the input 'units' dataframe")
+            if u not in inputs['sets']['u']:
+                logging.error("Unit '" + u + "' present in the results cannot be found in the set 'u' from the inputs")
+    elif key == 'NodeShadowPrice':
+        # Remove epsilons:
+        data[data == 5e300] = 0
+    return data
+
+
+def _apply_window(data, window):
+    if window is None:
+        return data
+    start, stop = window
+    return data.loc[start:stop]
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+"""
+Stage cache of the Dispa-SET pre-processing.
+
+The build of a simulation is divided into named stages (loading of the different inputs, clustering, merging of the
+time series, definition of the parameters). Each stage declares its inputs: the config values it depends on, the data
+files it reads (their content is hashed) and the upstream stages whose outputs it uses. The outputs of the stages are
+pickled in the cache directory under a hash of these inputs, so that a new build only executes the stages whose inputs
+have changed and the stages downstream of them. The least recently used entries are removed when the size of the
+cache exceeds its maximum size. Entries are written atomically, so that several builds can share the same cache.
+"""
+
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import uuid
+
+import numpy as np
+import pandas as pd
+
+from .data_handler import load_sources, _file_hash
+from .data_store import MANIFEST, _read_manifest, _atomic_write
+from .._version import __version__
+
+STAGE_CACHE_VERSION = 2                 # To be incremented if the outputs of the stages change
+STAGE_CACHE_MAX_SIZE = 5 * 1024 ** 3    # Default maximum size of the stage cache directory, in bytes
+BUILD_KEY = 'build.key'                 # File identifying the build written in a simulation directory
+_code_version = []
+
+
+def build_cache(path='', MaxCacheSize=STAGE_CACHE_MAX_SIZE, version=''):
+    """
+    Function that defines the stage cache of a build
+
+    :param path:            Path to the cache directory. If empty, the stages are always executed
+    :param MaxCacheSize:    Maximum size of the cache, in bytes
+    :param version:         Version of the code, included in the keys of the stages
+    :return:                Dictionary with the cache options, the keys of the stages already run in the build and
+                            the lists of the reused and executed stages
+    """
+    return {'path': path, 'size': MaxCacheSize or STAGE_CACHE_MAX_SIZE, 'version': version, 'keys': {},
+            'reused': [], 'executed': []}
+
+
+def run_stages(cache, stages, workers=1, pool='thread'):
+    """
+    Function that runs independent stages of the build, or loads their outputs from the cache if their inputs have
+    not changed. The stages to be executed are run concurrently if several workers are available (see load_sources).
+
+    :param cache:       Stage cache of the build (see build_cache)
+    :param stages:      Dictionary with the name of each stage as key and a tuple (function, args, kwargs, inputs,
+                        upstream) as value. inputs is a dictionary with the values that determine the output of the
+                        stage (config entries, paths of the data files). upstream is the list of the names of the stages
+                        whose outputs are used by the stage
+    :param workers:     Maximum number of concurrent workers
+    :param pool:        Type of pool ('thread' or 'process')
+    :return:            Dictionary with the name of each stage as key and its output as value
+    """
+    outputs, entries, missing = {}, {}, {}
+    for name in stages:
+        func, args, kwargs, inputs, upstream = stages[name]
+        if not cache['path']:
+            missing[name] = (func, args, kwargs)
+            continue
+        cache['keys'][name] = stage_key(name, inputs, [cache['keys'][stage] for stage in upstream], cache['version'])
+        entries[name] = os.path.join(cache['path'], 'stage_' + name + '_' + cache['keys'][name] + '.p')
+        entry = _read_stage_entry(entries[name])
+        if entry is None:
+            missing[name] = (func, args, kwargs)
+        else:
+            logging.info('Stage "' + name + '" reused from the build cache')
+            cache['reused'].append(name)
+            outputs[name] = entry['output']
+    executed = load_sources(missing, workers, pool)
+    for name in executed:
+        cache['executed'].append(name)
+        if name in entries and _write_stage_entry(entries[name], executed[name]):
+            _evict_stage_entries(cache['path'], cache['size'])
+    outputs.update(executed)
+    return dict((name, outputs[name]) for name in stages)
+
+
+def run_stage(cache, name, func, args, kwargs, inputs, upstream=()):
+    """
+    Function that runs a single stage of the build (see run_stages)
+    """
+    return run_stages(cache, {name: (func, args, kwargs, inputs, upstream)})[name]
+
+
+def code_version():
+    """
+    Function that returns the version of the code of the build: the version of the dispaset package and a hash of the
+    sources of the pre-processing (and of the modules and GAMS files it uses), so that the cached outputs of the stages are not reused
+    after an upgrade or a modification of the code. The hash is only computed once per process.
+    """
+    if not _code_version:
+        package = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        m = hashlib.sha1()
+        sources = glob.glob(os.path.join(package, 'preprocessing', '*.py')) + \
+            glob.glob(os.path.join(package, 'misc', '*.py')) + glob.glob(os.path.join(package, 'GAMS', '*.gms')) + \
+            [os.path.join(package, 'common.py')]
+        for path in sorted(sources):
+            m.update((os.path.relpath(path, package).replace(os.sep, '/') + _file_hash(path)).encode('utf-8'))
+        _code_version.append(__version__ + '-' + m.hexdigest()[:12])
+    return _code_version[0]
+
+
+def stage_key(name, inputs, upstream=(), version=''):
+    """
+    Hash of the inputs of a stage. Strings that are paths to data files are replaced by the hash of the files content.
+    Paths with the '##' wildcard (one file per zone) include all the matching files. Paths to a data store include
+    the version of the store.
+
+    :param name:        Name of the stage
+    :param inputs:      Values that determine the output of the stage (nested dictionaries, lists, scalars,
+                        dataframes or arrays)
+    :param upstream:    Keys of the upstream stages
+    :param version:     Version of the code
+    """
+    m = hashlib.sha1()
+    _update_hash(m, (name, STAGE_CACHE_VERSION, version, inputs, list(upstream)))
+    return m.hexdigest()
+
+
+def build_key(folder):
+    """
+    Function that returns the key of the build written in a simulation directory (None if not available)
+    """
+    try:
+        with open(os.path.join(folder, BUILD_KEY)) as f:
+            return f.read().strip()
+    except (IOError, OSError):
+        return None
+
+
+def write_build_key(folder, key):
+    """
+    Function that writes the key of a build in its simulation directory, once all its files have been written
+    """
+    _atomic_write(os.path.join(folder, BUILD_KEY), key.encode('utf-8'))
+
+
+def build_cache_info(path):
+    """
+    Function that returns the number of entries and the total size of a stage cache directory
+    """
+    entries = _list_stage_entries(path)
+    return {'entries': len(entries), 'size': sum(size for _, size, _ in entries)}
+
+
+def _update_hash(m, obj):
+    if isinstance(obj, dict):
+        m.update(b'{')
+        for key in sorted(obj, key=repr):
+            _update_hash(m, key)
+            _update_hash(m, obj[key])
+        m.update(b'}')
+    elif isinstance(obj, (list, tuple)):
+        m.update(b'[')
+        for item in obj:
+            _update_hash(m, item)
+        m.update(b']')
+    elif isinstance(obj, (pd.DataFrame, pd.Series, pd.Index)):
+        m.update(repr((type(obj).__name__, obj.shape)).encode('utf-8'))
+        if not isinstance(obj, pd.Index):
+            m.update(repr(list(getattr(obj, 'columns', [obj.name]))).encode('utf-8'))
+        m.update(pd.util.hash_pandas_object(obj).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        m.update(repr((obj.dtype.str, obj.shape)).encode('utf-8'))
+        m.update(np.ascontiguousarray(obj).tobytes() if obj.dtype.kind != 'O' else repr(obj.tolist()).encode('utf-8'))
+    elif isinstance(obj, str):
+        m.update(repr(obj).encode('utf-8'))
+        if os.path.isfile(obj):
+            m.update(_file_hash(obj).encode('utf-8'))
+        elif '##' in obj:
+            for path in sorted(glob.glob(obj.replace('##', '*'))):
+                m.update((path + _file_hash(path)).encode('utf-8'))
+        elif obj and os.path.isfile(os.path.join(obj, MANIFEST)):
+            m.update(_read_manifest(obj)['checksum'].encode('utf-8'))
+    else:
+        m.update(repr(obj).encode('utf-8'))
+
+
+def _read_stage_entry(entryfile):
+    try:
+        with open(entryfile, 'rb') as f:
+            entry = pickle.load(f)
+        # The modification time of the entry is used for the least recently used eviction policy:
+        os.utime(entryfile, None)
+    except (IOError, OSError, EOFError, ValueError, KeyError, AttributeError, ImportError, pickle.UnpicklingError):
+        return None
+    return entry
+
+
+def _write_stage_entry(entryfile, output):
+    """
+    Writes the output of a stage under a temporary name and renames it, so that concurrent builds never read a
+    partially written entry
+    """
+    tmp = entryfile + '.' + str(os.getpid()) + '_' + uuid.uuid4().hex + '.tmp'
+    try:
+        if not os.path.isdir(os.path.dirname(entryfile)):
+            os.makedirs(os.path.dirname(entryfile))
+        with open(tmp, 'wb') as f:
+            pickle.dump({'output': output}, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, entryfile)
+    except (IOError, OSError, pickle.PicklingError) as e:
+        logging.warning('Could not write the build cache entry ' + entryfile + ': ' + str(e))
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+        return False
+    return True
+
+
+def _list_stage_entries(path):
+    """
+    Lists the stage cache entries with their last use time and their size on disk
+    """
+    entries = []
+    if not os.path.isdir(path):
+        return entries
+    for name in os.listdir(path):
+        if name.startswith('stage_') and name.endswith('.p'):
+            entryfile = os.path.join(path, name)
+            try:
+                stat = os.stat(entryfile)
+            except OSError:     # removed by another process
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entryfile))
+    return entries
+
+
+def _evict_stage_entries(path, MaxCacheSize):
+    """
+    Removes the least recently used stage cache entries until the cache size is below MaxCacheSize
+    """
+    entries = sorted(_list_stage_entries(path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, entryfile in entries:
+        if total <= MaxCacheSize:
+            break
+        try:
+            os.remove(entryfile)
+        except OSError:
+            pass
+        total -= size
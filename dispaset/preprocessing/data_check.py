@@ -5,12 +5,20 @@ data
 __author__ = 'Sylvain Quoilin (sylvain.quoilin@ec.europa.eu)'
 """
 
+import hashlib
 import os
 import sys
+from collections import OrderedDict
 import numpy as np
 import pandas as pd
 import logging
 
+# Columns of the validation reports:
+REPORT_COLUMNS = ['Unit', 'Field', 'Rule', 'Value', 'Level']
+# Content hashes of the inputs validated in this session (only the most recent ones are kept):
+VALIDATED_MAX_ENTRIES = 1000
+_validated = OrderedDict()
+
 
 def isVRE(tech):
     '''
@@ -20,30 +28,50 @@ def isVRE(tech):
 
 def isStorage(tech):
     '''
-    Function that returns true the technology is a storage technology
+    Function that returns true the technology is a storage technology. If an array of technologies is provided
+    (e.g. a column of the units table), a boolean array is returned
     '''
-    return tech in ['HDAM','HPHS','CAES','BATS','BEVS','THMS','P2GS']
+    if isinstance(tech, str):
+        return tech in ['HDAM','HPHS','CAES','BATS','BEVS','THMS','P2GS']
+    return pd.Index(tech).isin(['HDAM','HPHS','CAES','BATS','BEVS','THMS','P2GS'])
+
 
 
+def validate_availability_factors(plants, AF):
+    '''
+    Function that checks the validity of the provided availability factors and reports the variable renewable units
+    for which a default value of 100% is used.
 
-def check_AvailabilityFactors(plants,AF):
+    :param plants:  Table of units
+    :param AF:      Availability factors (one column per unit)
+    :return:        Validation report (see the violations function)
+    '''
+    values = AF.values.astype('float')
+    report = [violations(AF.columns, 'AvailabilityFactor', '>= 0', (values < 0).any(axis=0), AF.min().values),
+              violations(AF.columns, 'AvailabilityFactor', '<= 1', (values > 1).any(axis=0), AF.max().values, level='warning')]
+    units = plants['Unit'][plants['Technology'].isin(['WTON', 'WTOF', 'PHOT', 'HROR'])].values
+    present = np.array([u in AF for u in units], dtype='bool')
+    always_one = np.zeros(len(units), dtype='bool')
+    if present.any():
+        always_one[present] = (AF[units[present]].values == 1).all(axis=0)
+    report.append(violations(units, 'AvailabilityFactor', 'not always 100%', always_one, 1, level='warning'))
+    report.append(violations(units, 'AvailabilityFactor', 'defined (100% assumed)', ~present, np.nan, level='warning'))
+    return pd.concat(report, ignore_index=True)
+
+
+def check_AvailabilityFactors(plants,AF,SkipValidated=False):
     '''
     Function that checks the validity of the provided availability factors and warns
     if a default value of 100% is used.
     '''
-    if (AF.dropna().values < 0).any():
-        logging.error('Some Availaibility factors are negative')
-        sys.exit(1)
-    if (AF.dropna().values > 1).any():
-        logging.warning('Some Availability factors are higher than one. They must be carefully checked')
-    for t in ['WTON', 'WTOF', 'PHOT', 'HROR']:
-        for i in plants[plants['Technology']==t].index:
-            u = plants.loc[i,'Unit']
-            if u in AF:
-                if (AF[u].values == 1).all():
-                    logging.critical('The availability factor of unit ' + str(u) + ' + for technology ' + t + ' is always 100%!')
-            else:
-                logging.critical('Unit ' + str(u) + ' (technology ' + t + ') does not appear in the availbilityFactors table. Its values will be set to 100%!')
+    # The inputs are only hashed if the validated tables are skipped:
+    key = _input_hash('AvailabilityFactors', plants[['Unit', 'Technology']], AF) if SkipValidated else None
+    if key in _validated:
+        logging.info('The availability factors have already been validated')
+        return True
+    report_violations(validate_availability_factors(plants, AF), 'AvailabilityFactors')
+    _set_validated(key)
+    return True
 
 def check_clustering(plants,plants_merged):
     '''
@@ -97,9 +125,11 @@ def check_MinMaxFlows(df_min,df_max):
     return True
 
 
-def check_sto(config, plants,raw_data=True):
+def validate_sto(config, plants, raw_data=True):
     """
     Function that checks the storage plant characteristics
+
+    :return:        Validation report (see the violations function)
     """
     if raw_data:
         keys = ['STOCapacity','STOSelfDischarge','STOMaxChargingPower','STOChargingEfficiency']
@@ -111,143 +141,97 @@ def check_sto(config, plants,raw_data=True):
     if 'StorageInitial' in plants:
         logging.warning('The "StorageInitial" column is present in the power plant table, although it is deprecated (it should now be defined in the ReservoirLevel data table). It will not be considered.')
 
-    for key in keys:
-        if key not in plants:
-            logging.critical('The power plants data does not contain the field "' + key + '", which is mandatory for storage units')
-            sys.exit(1)
+    report = _mandatory_fields(plants, keys) + _numeric_fields(plants, NonNaNKeys)
+    return pd.concat(report, ignore_index=True)
 
-    for key in NonNaNKeys:
-        for u in plants.index:
-            if 'Unit' in plants:
-                unitname = plants.loc[u,'Unit']
-            else:
-                unitname = str(u)
-            if isinstance(plants.loc[u, key], str):
-                logging.critical('A non numeric value was detected in the power plants inputs for parameter "' + key + '"')
-                sys.exit(1)
-            if np.isnan(plants.loc[u, key]):
-                logging.critical('The power plants data is missing for unit ' + unitname + ' and parameter "' + key + '"')
-                sys.exit(1)
-
-    return True
 
+def check_sto(config, plants,raw_data=True):
+    """
+    Function that checks the storage plant characteristics
+    """
+    return _check('storage units', validate_sto, config, plants, raw_data=raw_data)
 
 
-def check_chp(config, plants):
+def validate_chp(config, plants):
     """
     Function that checks the CHP plant characteristics
-    """   
+
+    :return:        Validation report (see the violations function)
+    """
     keys = ['CHPType','CHPPowerToHeat','CHPPowerLossFactor']
     NonNaNKeys = ['CHPPowerToHeat','CHPPowerLossFactor']
     StrKeys = ['CHPType']
-    
-    for key in keys:
-        if key not in plants:
-            logging.critical('The power plants data does not contain the field "' + key + '", which is mandatory for CHP units')
-            sys.exit(1)
-
-    for key in NonNaNKeys:
-        for u in plants.index:
-            if 'Unit' in plants:
-                unitname = plants.loc[u,'Unit']
-            else:
-                unitname = str(u)
-            if type(plants.loc[u, key]) == str:
-                logging.critical('A non numeric value was detected in the power plants inputs for parameter "' + key + '"')
-                sys.exit(1)
-            if np.isnan(plants.loc[u, key]):
-                logging.critical('The power plants data is missing for unit number ' + unitname + ' and parameter "' + key + '"')
-                sys.exit(1)
 
-    for key in StrKeys:
-        for u in plants.index:
-            if 'Unit' in plants:
-                unitname = plants.loc[u,'Unit']
-            else:
-                unitname = str(u)
-            if not isinstance(plants.loc[u, key], str):
-                logging.critical(
-                    'A numeric value was detected in the power plants inputs for parameter "' + key + '". This column should contain strings only.')
-                sys.exit(1)
-            elif plants.loc[u, key] == '':
-                logging.critical('An empty value was detected in the power plants inputs for unit "' + unitname + '" and parameter "' + key + '"')
-                sys.exit(1)
-    
-    # Check the efficiency values:
-    for u in plants.index:
-        if 'Unit' in plants:
-            unitname = plants.loc[u,'Unit']
-        else:
-            unitname = str(u)
-        plant_PowerCapacity = plants.loc[u,'PowerCapacity']
-        plant_MaxHeat = plants.loc[u, 'CHPMaxHeat']
-        plant_powertoheat =  plants.loc[u,'CHPPowerToHeat']
-        plant_powerlossfactor = plants.loc[u,'CHPPowerLossFactor']
-
-        if plants.loc[u,'CHPType'].lower() not in ['extraction','back-pressure', 'p2h']:
-            logging.critical('The value of CHPType should be "extraction", "back-pressure" or "p2h". The type of unit ' + u + ' is "' + str(plants.loc[u,'CHPType'] + '"'))
-            sys.exit(1)              
-        if 0 > plant_powertoheat > 10:
-            logging.critical('The value of CHPPowerToHeat should be higher or equal to zero and lower than 10. Unit ' + u + ' has a value of ' + str(plant_powertoheat))
-            sys.exit(1)         
-        if 0 > plant_powerlossfactor > 1 and plants.loc[u,'CHPType'].lower() != 'p2h':
-            logging.critical('The value of CHPPowerLossFactor should be higher or equal to zero and lower than 1. Unit ' + u + ' has a value of ' + str(plant_powerlossfactor))
-            sys.exit(1)   
-        if plants.loc[u,'CHPType'].lower() == 'back-pressure' and plant_powerlossfactor != 0:
-            logging.critical('The value of CHPPowerLossFactor must be zero if the CHP types is "back-pressure". Unit ' + u + ' has a value of ' + str(plant_powerlossfactor))
-            sys.exit(1)
-        if plants.loc[u, 'CHPType'].lower() == 'extraction':
-            intersection_MaxHeat = plant_PowerCapacity / plant_powertoheat
-            if not pd.isnull(plant_MaxHeat):
-                if intersection_MaxHeat < plant_MaxHeat:
-                    logging.warning('Given Maximum heat CHPMaxHeat ({}) is higher than the intersection point of the two other constraints ({}) '
-                                    '(power loss factor and backpressure line) therefore it will not be ignored'.format(plant_MaxHeat, intersection_MaxHeat) )
-                    plant_MaxHeat = intersection_MaxHeat
-            else:
-                plant_MaxHeat = intersection_MaxHeat
-
-        # Calculating the nominal total efficiency at the highest point:
-        if plants.loc[u,'CHPType'].lower() != 'p2h':
-            Fuel = (plant_PowerCapacity + plant_powerlossfactor * plant_MaxHeat)/plants.loc[u,'Efficiency'] # F = (P + C_v * Q)/eta_condensation
-            TotalEfficiency = (plant_PowerCapacity + plant_MaxHeat) / Fuel             # eta_tot = (P + Q) / F
-            logging.debug('Highest overall efficiency of CHP plant {} is {:.2f}'.format(u,TotalEfficiency))
-            if TotalEfficiency < 0 or TotalEfficiency > 1.14:
-                logging.critical('The calculated value of the total CHP efficiency for unit ' + unitname + ' is ' + str(TotalEfficiency) + ', which is unrealistic!')
-                sys.exit(1)
-            if TotalEfficiency > 0.95:
-                logging.warning('The calculated value of the total CHP efficiency for unit ' + unitname + ' is ' + str(TotalEfficiency) + ', which is very high!')
+    report = _mandatory_fields(plants, keys) + _numeric_fields(plants, NonNaNKeys) + _string_fields(plants, StrKeys)
+    if not all(key in plants for key in keys):
+        return pd.concat(report, ignore_index=True)
+    units = _unit_names(plants)
+    chptype = plants['CHPType'].astype(str).str.lower().values
+    P = _numeric(plants, 'PowerCapacity')
+    powertoheat = _numeric(plants, 'CHPPowerToHeat')
+    powerlossfactor = _numeric(plants, 'CHPPowerLossFactor')
+    MaxHeat = _numeric(plants, 'CHPMaxHeat') if 'CHPMaxHeat' in plants else np.full(len(plants), np.nan)
+
+    report.append(violations(units, 'CHPType', 'extraction, back-pressure or p2h',
+                             ~np.isin(chptype, ['extraction', 'back-pressure', 'p2h']), plants['CHPType'].values))
+    report.append(violations(units, 'CHPPowerToHeat', 'between 0 and 10', (powertoheat < 0) | (powertoheat > 10),
+                             powertoheat, level='warning'))
+    report.append(violations(units, 'CHPPowerLossFactor', 'between 0 and 1',
+                             ((powerlossfactor < 0) | (powerlossfactor > 1)) & (chptype != 'p2h'), powerlossfactor, level='warning'))
+    report.append(violations(units, 'CHPPowerLossFactor', 'zero for back-pressure units',
+                             (chptype == 'back-pressure') & (powerlossfactor != 0), powerlossfactor))
+
+    # The maximum heat of extraction units is limited by the intersection of the power loss factor and backpressure line:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        intersection_MaxHeat = P / powertoheat
+    extraction = chptype == 'extraction'
+    too_high = extraction & (intersection_MaxHeat < MaxHeat)
+    report.append(violations(units, 'CHPMaxHeat', 'lower than the intersection point of the power loss factor and '
+                             'backpressure line (the intersection is used)', too_high, MaxHeat, level='warning'))
+    MaxHeat = np.where(extraction & (too_high | np.isnan(MaxHeat)), intersection_MaxHeat, MaxHeat)
+
+    # Calculating the nominal total efficiency at the highest point:
+    with np.errstate(divide='ignore', invalid='ignore'):
+        Fuel = (P + powerlossfactor * MaxHeat) / _numeric(plants, 'Efficiency')    # F = (P + C_v * Q)/eta_condensation
+        TotalEfficiency = (P + MaxHeat) / Fuel                                      # eta_tot = (P + Q) / F
+    TotalEfficiency[chptype == 'p2h'] = np.nan
+    report.append(violations(units, 'Efficiency', 'total CHP efficiency between 0 and 1.14',
+                             (TotalEfficiency < 0) | (TotalEfficiency > 1.14), TotalEfficiency))
+    report.append(violations(units, 'Efficiency', 'total CHP efficiency lower than 0.95',
+                             (TotalEfficiency > 0.95) & (TotalEfficiency <= 1.14), TotalEfficiency, level='warning'))
 
     # Check the optional MaxHeatCapacity parameter. While it adds another realistic boundary it is not a required parameter for the definition of the CHP's operational envelope.:
     if 'CHPMaxHeat' in plants:
-        for u in plants.index:
-            plant_MaxHeat = plants.loc[u, 'CHPMaxHeat']
-            if plant_MaxHeat <=0:
-                logging.warning('CHPMaxHeat for plant {} is {} which shuts down any heat production.'.format(u, plant_MaxHeat))
+        report.append(violations(units, 'CHPMaxHeat', '> 0 (otherwise no heat production)', _numeric(plants, 'CHPMaxHeat') <= 0,
+                                 plants['CHPMaxHeat'].values, level='warning'))
     # Check the optional heat storage values:
     if 'STOCapacity' in plants:
-        for u in plants.index:
-            Qdot = plants.loc[u,'PowerCapacity']/plants.loc[u,'CHPPowerToHeat']
-            if plants.loc[u,'STOCapacity'] < Qdot * 0.5 :
-                logging.warning('Unit ' + unitname + ': The value of the thermal storage capacity (' + str(plants.loc[u,'STOCapacity']) + 'MWh) seems very low compared to its thermal power (' + str(Qdot) + 'MW).')
-            elif plants.loc[u,'STOCapacity'] > Qdot * 24:
-                logging.warning('Unit ' + unitname + ': The value of the thermal storage capacity (' + str(plants.loc[u,'STOCapacity']) + 'MWh) seems very high compared to its thermal power (' + str(Qdot) + 'MW).')
-
+        capacity = _numeric(plants, 'STOCapacity')
+        Qdot = intersection_MaxHeat
+        report.append(violations(units, 'STOCapacity', 'thermal storage higher than 0.5h of thermal power', capacity < Qdot * 0.5,
+                                 capacity, level='warning'))
+        report.append(violations(units, 'STOCapacity', 'thermal storage lower than 24h of thermal power', capacity > Qdot * 24,
+                                 capacity, level='warning'))
     if 'STOSelfDischarge' in plants:
-        for u in plants.index:     
-            if plants.loc[u,'STOSelfDischarge'] < 0 :
-                logging.error('Unit ' + unitname + ': The value of the thermal storage self-discharge (' + str(plants.loc[u,'STOSelfDischarge']*100) + '%/day) cannot be negative')
-                sys.exit(1)
-            elif plants.loc[u,'STOSelfDischarge'] > 1:
-                logging.warning('Unit ' + unitname + ': The value of the thermal storage self-discharge (' + str(plants.loc[u,'STOSelfDischarge']*100) + '%/day) seems very high')
-            elif plants.loc[u,'STOSelfDischarge'] > 24:
-                logging.error('Unit ' + unitname + ': The value of the thermal storage self-discharge (' + str(plants.loc[u,'STOSelfDischarge']*100) + '%/day) is too high')
-                sys.exit(1)                           
+        selfdischarge = _numeric(plants, 'STOSelfDischarge')
+        report.append(violations(units, 'STOSelfDischarge', '>= 0', selfdischarge < 0, selfdischarge))
+        report.append(violations(units, 'STOSelfDischarge', 'thermal storage self-discharge lower than 100%/day',
+                                 selfdischarge > 1, selfdischarge, level='warning'))
+    return pd.concat(report, ignore_index=True)
 
-    return True
 
-def check_units(config, plants):
+def check_chp(config, plants):
+    """
+    Function that checks the CHP plant characteristics
+    """
+    return _check('CHP units', validate_chp, config, plants)
+
+
+def validate_units(config, plants):
     """
     Function that checks the power plant characteristics
+
+    :return:        Validation report (see the violations function)
     """
 
     keys = ['Unit', 'Fuel', 'Zone', 'Technology', 'PowerCapacity', 'PartLoadMin', 'RampUpRate', 'RampDownRate',
@@ -256,40 +240,18 @@ def check_units(config, plants):
                   'CO2Intensity']
     StrKeys = ['Unit', 'Zone', 'Fuel', 'Technology']
 
+    report = []
+    units = _unit_names(plants)
     # Special treatment for the Optional key Nunits:
     if 'Nunits' in plants:
         keys.append('Nunits')
         NonNaNKeys.append('Nunits')
-        if any([not float(x).is_integer() for x in plants['Nunits']]):
-            logging.error('Some values are not integers in the "Nunits" column of the plant database')
-            sys.exit(1)
+        Nunits = _numeric(plants, 'Nunits')
+        report.append(violations(units, 'Nunits', 'integer', ~(Nunits == np.round(Nunits)), plants['Nunits'].values))
     else:
         logging.info('The columns "Nunits" is not present in the power plant database. A value of one will be assumed by default')
 
-    for key in keys:
-        if key not in plants:
-            logging.critical('The power plants data does not contain the field "' + key + '", which is mandatory')
-            sys.exit(1)
-
-    for key in NonNaNKeys:
-        for u in plants.index:
-            if type(plants.loc[u, key]) == str:
-                logging.critical('A non numeric value was detected in the power plants inputs for parameter "' + key + '"')
-                sys.exit(1)
-            if np.isnan(plants.loc[u, key]):
-                logging.critical('The power plants data is missing for unit number ' + str(u) + ' and parameter "' + key + '"')
-                sys.exit(1)
-
-    for key in StrKeys:
-        for u in plants.index:
-            if not type(plants.loc[u, key]) == str:
-                logging.critical(
-                    'A numeric value was detected in the power plants inputs for parameter "' + key + '". This column should contain strings only.')
-                sys.exit(1)
-            elif plants.loc[u, key] == '':
-                logging.critical('An empty value was detected in the power plants inputs for unit "' + str(
-                    u) + '" and parameter "' + key + '"')
-                sys.exit(1)
+    report += _mandatory_fields(plants, keys) + _numeric_fields(plants, NonNaNKeys) + _string_fields(plants, StrKeys)
 
     lower = {'PowerCapacity': 0, 'PartLoadMin': 0, 'StartUpTime': 0, 'MinUpTime': 0, 'MinDownTime': 0, 'NoLoadCost': 0,
              'StartUpCost': 0}
@@ -301,47 +263,69 @@ def check_units(config, plants):
     if 'Nunits' in plants:
         lower_hard['Nunits'] = 0
 
-    if len(plants['Unit'].unique()) != len(plants['Unit']):
-        duplicates = plants['Unit'][plants['Unit'].duplicated()].tolist()
-        logging.error('The names of the power plants are not unique. The following names are duplicates: ' + str(duplicates) + '. "' + str(duplicates[0] + '" appears for example in the following countries: ' + str(plants.Zone[plants['Unit']==duplicates[0]].tolist())))
-        sys.exit(1)
+    if 'Unit' in plants:
+        zones = plants['Zone'].values if 'Zone' in plants else np.nan
+        report.append(violations(units, 'Unit', 'unique name (the value is the zone)', plants['Unit'].duplicated(keep=False).values, zones))
 
-    for key in lower:
-        if any(plants[key] < lower[key]):
-            plantlist = plants[plants[key] < lower[key]]
-            plantlist = plantlist['Unit'].tolist()
-            logging.critical(
-                'The value of ' + key + ' should be higher or equal to zero. A negative value has been found for units ' + str(
-                    plantlist))
-            sys.exit(1)
+    for key in [k for k in lower if k in plants]:
+        report.append(violations(units, key, '>= ' + str(lower[key]), _numeric(plants, key) < lower[key], plants[key].values))
+    for key in [k for k in lower_hard if k in plants]:
+        report.append(violations(units, key, '> ' + str(lower_hard[key]), _numeric(plants, key) <= lower_hard[key], plants[key].values))
+    for key in [k for k in higher if k in plants]:
+        report.append(violations(units, key, '<= ' + str(higher[key]), _numeric(plants, key) > higher[key], plants[key].values))
+    for key in [k for k in higher_time if k in plants]:
+        report.append(violations(units, key, '< ' + str(config['HorizonLength'] * 24) + ' h (horizon length)',
+                                 _numeric(plants, key) >= config['HorizonLength'] * 24, plants[key].values))
+    return pd.concat(report, ignore_index=True)
 
-    for key in lower_hard:
-        if any(plants[key] <= lower_hard[key]):
-            plantlist = plants[plants[key] <= lower_hard[key]]
-            plantlist = plantlist['Unit'].tolist()
-            logging.critical(
-                'The value of ' + key + ' should be strictly higher than zero. A null or negative value has been found for units ' + str(
-                    plantlist))
-            sys.exit(1)
 
-    for key in higher:
-        if any(plants[key] > higher[key]):
-            plantlist = plants[plants[key] > higher[key]]
-            plantlist = plantlist['Unit'].tolist()
-            logging.critical(
-                'The value of ' + key + ' should be lower or equal to one. A higher value has been found for units ' + str(
-                    plantlist))
-            sys.exit(1)
+def check_units(config, plants):
+    """
+    Function that checks the power plant characteristics
+    """
+    return _check('power plants', validate_units, config, plants)
 
 
-    for key in higher_time:
-        if any(plants[key] >= config['HorizonLength'] * 24):
-            plantlist = plants[plants[key] >= config['HorizonLength'] * 24]
-            plantlist = plantlist['Unit'].tolist()
-            logging.critical('The value of ' + key + ' should be lower than the horizon length (' + str(
-                config['HorizonLength'] * 24) + ' hours). A higher value has been found for units ' + str(plantlist))
-            sys.exit(1)
-            
+def violations(units, field, rule, mask, values, level='error'):
+    """
+    Function that lists the units violating a validation rule. All the rules of a table are evaluated as vectorized
+    masks and their violations are gathered in a single report before deciding whether the execution must be stopped.
+
+    :param units:   Array with the name of each unit
+    :param field:   Field (column) concerned by the rule
+    :param rule:    Description of the rule
+    :param mask:    Boolean array, True for the units violating the rule
+    :param values:  Value reported for each unit (array or scalar)
+    :param level:   'error' if the violation prevents the simulation from being built, 'warning' otherwise
+    :return:        Dataframe with one row per violation and the columns Unit, Field, Rule, Value and Level
+    """
+    mask = np.asarray(mask, dtype='bool')
+    values = np.broadcast_to(np.asarray(values, dtype='object'), mask.shape)
+    return pd.DataFrame({'Unit': np.asarray(units, dtype='object')[mask], 'Field': field, 'Rule': rule,
+                         'Value': values[mask], 'Level': level}, columns=REPORT_COLUMNS)
+
+
+def report_violations(report, name=''):
+    """
+    Function that logs all the violations of a validation report (one message per rule) and stops the execution if at
+    least one of them is an error.
+
+    :param report:  Validation report (output of the violations function or concatenation thereof)
+    :param name:    Name of the validated data, used in the messages
+    """
+    for (field, rule, level), group in report.groupby(['Field', 'Rule', 'Level'], sort=False):
+        units = ', '.join(str(u) + ('' if _is_missing(v) else ' (' + str(v) + ')') for u, v in zip(group['Unit'], group['Value'])
+                          if u is not None)
+        msg = 'Data "' + name + '", field "' + str(field) + '": the rule "' + rule + '" is not respected'
+        msg += ' for units ' + units if units else ' (the field is not present)'
+        if level == 'error':
+            logging.critical(msg)
+        else:
+            logging.warning(msg)
+    errors = (report['Level'] == 'error').sum()
+    if errors > 0:
+        logging.critical(str(errors) + ' errors were found in the ' + name + ' data. The simulation cannot be built')
+        sys.exit(1)
     return True
 
 
@@ -402,15 +386,12 @@ def check_df(df, StartDate=None, StopDate=None, name=''):
             logging.warning('The start date ' + str(StartDate) + ' is not in the index of the provided dataframe')
         if not StopDate in df.index:
             logging.warning('The stop date ' + str(StopDate) + ' is not in the index of the provided dataframe')
-    if any(np.isnan(df)):
-        for key in df:
-            missing = np.sum(np.isnan(df[key]))
-            # pos = np.where(np.isnan(df.sum(axis=1)))
-            # idx_pos = [df.index[i] for i in pos]
-            if missing > 1:
-                logging.warning('There are ' + str(missing) + ' missing entries in the column ' + key + ' of the dataframe ' + name)
+    # Number of missing values in each column, in a single pass over the table:
+    missing = pd.isnull(df.values).sum(axis=0)
+    for key, number in zip(df.columns[missing > 1], missing[missing > 1]):
+        logging.warning('There are ' + str(number) + ' missing entries in the column ' + str(key) + ' of the dataframe ' + name)
     if not df.columns.is_unique:
-        logging.error('The column headers of table "' + name + '" are not unique!. The following headers are duplicated: ' + str(df.columns.get_duplicates()))
+        logging.error('The column headers of table "' + name + '" are not unique!. The following headers are duplicated: ' + str(df.columns[df.columns.duplicated()].unique().tolist()))
         sys.exit(1)
     return True
 
@@ -533,3 +514,98 @@ def check_simulation_environment(SimulationPath, store_type='pickle', firstline=
         sys.exit(1)
 
 
+def _check(name, validate, config, plants, **kwargs):
+    """
+    Validates a table of units and aborts if errors are found. If config['SkipValidated'] is set, tables with the
+    same content as a table already validated in this session are not checked again.
+    """
+    key = None
+    if config.get('SkipValidated', False):
+        key = _input_hash(validate.__name__, plants, config.get('HorizonLength'), sorted(kwargs.items()))
+    if key in _validated:
+        logging.info('The ' + name + ' data has already been validated')
+        return True
+    report_violations(validate(config, plants, **kwargs), name)
+    _set_validated(key)
+    return True
+
+
+def _set_validated(key):
+    """
+    Records the content hash of validated inputs (if any), removing the oldest ones above VALIDATED_MAX_ENTRIES
+    """
+    if key is None:
+        return
+    _validated[key] = True
+    while len(_validated) > VALIDATED_MAX_ENTRIES:
+        _validated.popitem(last=False)
+
+
+def _input_hash(*items):
+    """
+    Content hash of the inputs of a validation (dataframes and other values)
+    """
+    m = hashlib.sha1()
+    for item in items:
+        if isinstance(item, pd.DataFrame):
+            m.update(repr((list(item.columns), [str(dtype) for dtype in item.dtypes])).encode('utf-8'))
+            try:
+                m.update(pd.util.hash_pandas_object(item, index=True).values.tobytes())
+            except TypeError:
+                m.update(item.to_csv().encode('utf-8'))
+        else:
+            m.update(repr(item).encode('utf-8'))
+    return m.hexdigest()
+
+
+def _unit_names(plants):
+    if 'Unit' in plants:
+        return plants['Unit'].values
+    return plants.index.astype(str).values
+
+
+def _numeric(plants, key):
+    """
+    Values of a column as floats (NaN for the missing and non-numeric values)
+    """
+    return pd.to_numeric(plants[key], errors='coerce').values.astype('float')
+
+
+def _is_string(plants, key):
+    values = plants[key].values
+    if values.dtype != object:
+        return np.zeros(len(values), dtype='bool')
+    return np.array([isinstance(x, str) for x in values], dtype='bool')
+
+
+def _mandatory_fields(plants, keys):
+    missing = [key for key in keys if key not in plants]
+    return [pd.DataFrame({'Unit': None, 'Field': missing, 'Rule': 'mandatory field', 'Value': None, 'Level': 'error'},
+                         columns=REPORT_COLUMNS)]
+
+
+def _numeric_fields(plants, keys):
+    units = _unit_names(plants)
+    report = []
+    for key in [k for k in keys if k in plants]:
+        string = _is_string(plants, key)
+        report.append(violations(units, key, 'numeric value', string, plants[key].values))
+        report.append(violations(units, key, 'not missing', pd.isnull(plants[key].values) & ~string, np.nan))
+    return report
+
+
+def _string_fields(plants, keys):
+    units = _unit_names(plants)
+    report = []
+    for key in [k for k in keys if k in plants]:
+        string = _is_string(plants, key)
+        report.append(violations(units, key, 'string value', ~string, plants[key].values))
+        empty = string.copy()
+        empty[string] = plants[key].values[string] == ''
+        report.append(violations(units, key, 'not empty', empty, np.nan))
+    return report
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, (float, np.floating)) and np.isnan(value))
+
@@ -1,57 +1,69 @@
+import hashlib
 import logging
 import os
+import pickle
 import sys
+import threading
+import uuid
 
 import numpy as np
 import pandas as pd
 
 from six.moves import reload_module
+
+from .data_check import check_df
+from .data_store import data_store_entry, data_file_exists, read_data_store, _file_sha1
 try:
     from future.builtins import int
 except ImportError:
     pass
 
-def NodeBasedTable(path,idx,zones,tablename='',default=None):
+def NodeBasedTable(path,idx,zones,tablename='',default=None,store=''):
     '''
     This function loads the tabular data stored in csv files relative to each
     zone (a.k.a node, zone) of the simulation.
 
     :param path:                Path to the data to be loaded
-    :param idx:                 Pandas datetime index to be used for the output
+    :param idx:                 Pandas datetime index to be used for the output, or list of indexes. In that case,
+                                the files are parsed only once and one dataframe is returned for each index
     :param zones:           List with the country codes to be considered
     :param fallback:            List with the order of data source.
     :param tablename:           String with the name of the table being processed
     :param default:             Default value to be applied if no data is found
+    :param store:               Path to a data store in which the files are looked up first (optional)
 
-    :return:           Dataframe with the time series for each unit
+    :return:           Dataframe with the time series for each unit (or list of dataframes)
     '''
               
     paths = {}
-    if os.path.isfile(path):
+    if data_file_exists(path, store):
         paths['all'] = path
         SingleFile=True
     elif '##' in path:
         for c in zones:
             path_c = path.replace('##', str(c))
-            if os.path.isfile(path_c):
+            if data_file_exists(path_c, store, header=None):
                 paths[str(c)] = path_c
             else:
                 logging.error('No data file found for the table ' + tablename + ' and country ' + c + '. File ' + path_c + ' does not exist')
                 sys.exit(1)
         SingleFile=False
-    data = pd.DataFrame(index=idx)
+    # Time series (or constant values) for each zone, aligned on the required index(es) at the end:
+    data = {}
+    indexes = idx if isinstance(idx, list) else [idx]
+    window = (min(i[0] for i in indexes), max(i[-1] for i in indexes))
     if len(paths) == 0:
         logging.info('No data file found for the table ' + tablename + '. Using default value ' + str(default))
         if default is None:
             pass
         elif isinstance(default,(float,int)):
-            data = pd.DataFrame(default,index=idx,columns=zones)
+            data = {key: default for key in zones}
         else:
             logging.error('Default value provided for table ' + tablename + ' is not valid')
             sys.exit(1)
     elif SingleFile:
         # If it is only one file, there is a header with the country code
-        tmp = load_csv(paths['all'], index_col=0, parse_dates=True)
+        tmp = load_csv(paths['all'], index_col=0, parse_dates=True, window=window, store=store)
         if not tmp.index.is_unique:
             logging.error('The index of data file ' + paths['all'] + ' is not unique. Please check the data')
             sys.exit(1)
@@ -59,13 +71,12 @@ def NodeBasedTable(path,idx,zones,tablename='',default=None):
             if key in tmp:
                 data[key] = tmp[key]
             elif len(tmp.columns) == 1:    # if the country code is not in the header, it can also be because it is a single country simulation and no header is needed:
-                tmp = load_csv(paths['all'], index_col=0, header=None, parse_dates=True)
-                data[key] = tmp.iloc[:,0]
+                data[key] = _first_column(tmp)
             else:
                 logging.error('Country ' + key + ' could not be found in the file ' + path + '. Using default value ' + str(default))
                 if default is None:
                     pass
-                elif isinstance(default,(float,int,long)):
+                elif isinstance(default,(float,int)):
                     data[key] = default
                 else:
                     logging.error('Default value provided for table ' + tablename + ' is not valid')
@@ -74,18 +85,36 @@ def NodeBasedTable(path,idx,zones,tablename='',default=None):
         for c in paths:
             path = paths[c]
             # In case of separated files for each country, there is no header
-            tmp = load_csv(path, index_col=0, header=None, parse_dates=True)
+            tmp = load_csv(path, index_col=0, header=None, parse_dates=True, window=window, store=store)
             # check that the loaded file is ok:
             if not tmp.index.is_unique:
-                logging.error('The index of data file ' + paths['all'] + ' is not unique. Please check the data')
+                logging.error('The index of data file ' + path + ' is not unique. Please check the data')
                 sys.exit(1)
             data[c] = tmp.iloc[:,0]
-     
-    return data
+
+    if isinstance(idx, list):
+        return [pd.DataFrame(data, index=i) for i in indexes]
+    return pd.DataFrame(data, index=idx)
+
+
+def _first_column(data):
+    '''
+    Returns the first column of a dataframe loaded with a header from a file that may have none. If the header
+    is numeric, it is the first line of data and it is added back to the time series.
+    '''
+    series = data.iloc[:, 0]
+    try:
+        first = float(data.columns[0])
+        start = pd.Timestamp(data.index.name)
+    except (TypeError, ValueError):
+        return series
+    if start.tzinfo is not None:
+        start = start.tz_localize(None)
+    return pd.concat([pd.Series([first], index=[start]), series.astype('float')])
 
 
 
-def UnitBasedTable(plants,path,idx,zones,fallbacks=['Unit'],tablename='',default=None,RestrictWarning=None):
+def UnitBasedTable(plants,path,idx,zones,fallbacks=['Unit'],tablename='',default=None,RestrictWarning=None,store=''):
     '''
     This function loads the tabular data stored in csv files and assigns the
     proper values to each unit of the plants dataframe. If the unit-specific 
@@ -104,25 +133,25 @@ def UnitBasedTable(plants,path,idx,zones,fallbacks=['Unit'],tablename='',default
     :param fallback:            List with the order of data source. 
     :param tablename:           String with the name of the table being processed
     :param default:             Default value to be applied if no data is found
+    :param store:               Path to a data store in which the files are looked up first (optional)
     :param RestrictWarning:     Only display the warnings if the unit belongs to the list of technologies provided in this parameter
 
     :return:           Dataframe with the time series for each unit
     '''
               
     paths = {}
-    if os.path.isfile(path):
+    if data_file_exists(path, store):
         paths['all'] = path
         SingleFile=True
     elif '##' in path:
         for c in zones:
             path_c = path.replace('##', str(c))
-            if os.path.isfile(path_c):
+            if data_file_exists(path_c, store):
                 paths[str(c)] = path_c
             else:
                 logging.critical('No data file found for the table ' + tablename + ' and zone ' + c + '. File ' + path_c + ' does not exist')
 #                sys.exit(1)
         SingleFile=False
-    data = pd.DataFrame(index=idx)
     if len(paths) == 0:
         logging.info('No data file found for the table ' + tablename + '. Using default value ' + str(default))
         if default is None:
@@ -133,76 +162,275 @@ def UnitBasedTable(plants,path,idx,zones,fallbacks=['Unit'],tablename='',default
             logging.error('Default value provided for table ' + tablename + ' is not valid')
             sys.exit(1)
     else: # assembling the files in a single dataframe:
-        columns = []
+        # Only the columns that can be used by a fallback key are loaded:
+        headers = set()
+        for key in fallbacks:
+            headers.update(plants[key])
+        tables = {}
         for c in paths:
             path = paths[c]
-            tmp = load_csv(path, index_col=0, parse_dates=True)
+            tmp = load_csv(path, index_col=0, parse_dates=True, columns=headers, window=(idx[0], idx[-1]), store=store)
             # check that the loaded file is ok:
             if not tmp.index.is_unique:
                 logging.error('The index of data file ' + path + ' is not unique. Please check the data')
                 sys.exit(1)
+            tables[c] = tmp.reindex(idx)
+        if SingleFile:
+            data = tables['all']
+        else:    # use the multi-index header with the country
+            data = pd.concat(tables, axis=1, names=['Country', 'Data'])
+        # For each plant, find the position of the column corresponding to the first fallback key present in the data
+        position = np.full(len(plants), -1)
+        for key in fallbacks:
             if SingleFile:
-                for key in tmp:
-                    data[key] = tmp[key]                
-            else:    # use the multi-index header with the country
-                for key in tmp:
-                    columns.append((c,key))
-                    data[c+','+key] = tmp[key]
-        if not SingleFile:
-            data.columns = pd.MultiIndex.from_tuples(columns, names=['Country', 'Data'])
-        # For each plant and each fallback key, try to find the corresponding column in the data
-        out = pd.DataFrame(index=idx)
-        for j in plants.index:
-            warning = True
-            if not RestrictWarning is None:
-                warning = False
-                if plants.loc[j,'Technology'] in RestrictWarning:
-                    warning=True
-            u = plants.loc[j,'Unit']
-            found = False
-            for i,key in enumerate(fallbacks):
-                if SingleFile:
-                    header = plants.loc[j,key]
-                else:
-                    header = (plants.loc[j,'Zone'],plants.loc[j,key])
-                if header in data:
-                    out[u] = data[header]
-                    found = True
-                    if i > 0 and warning:
-                        #logging.warning('No specific information was found for unit ' + u + ' in table ' + tablename + '. The generic information for ' + str(header) + ' has been used')
-                        pass
-                    break
-            if not found:
-                if warning:
-                    #logging.info('No specific information was found for unit ' + u + ' in table ' + tablename + '. Using default value ' + str(default))
-                    pass
-                if not default is None:
-                    out[u] = default
+                headers = pd.Index(plants[key].values)
+            else:
+                headers = pd.MultiIndex.from_arrays([plants['Zone'].values, plants[key].values])
+            position = np.where(position < 0, data.columns.get_indexer(headers), position)
+        # Units for which no column was found take the default value (stored in an additional column), if any:
+        values = data.values
+        if default is None:
+            keep = position >= 0
+        else:
+            keep = np.ones(len(plants), dtype='bool')
+            values = np.hstack([values, np.full([len(idx), 1], default)])
+            position[position < 0] = values.shape[1] - 1
+        out = pd.DataFrame(values.take(position[keep], axis=1), index=idx, columns=plants['Unit'].values[keep])
     if not out.columns.is_unique:
-        logging.error('The column headers of table "' + tablename + '" are not unique!. The following headers are duplicated: ' + str(out.columns.get_duplicates()))
+        logging.error('The column headers of table "' + tablename + '" are not unique!. The following headers are duplicated: ' + str(out.columns[out.columns.duplicated()].tolist()))
         sys.exit(1)
     return out
 
 
 
-def merge_series(plants, data, mapping, method='WeightedAverage', tablename=''):
+def FuelPriceTable(config, idx, zones, entries, ZonePrices=None, ZoneFound=None, fallbacks=None, files=None):
+    '''
+    This function loads the fuel prices of one or several price sets into a single preallocated
+    (set x time x zone x fuel) array. Each distinct file is read only once and sliced once to the
+    simulation window. For each price entry, the following sources are considered:
+        - A csv file without header: the same time series is used for all the zones
+        - A csv file with the zones as header: the column of the zone. If not present, the constant price
+          from the FuelsPricesPerZone table or, if not defined in the table, the default value
+        - No file but a default value: the constant price from the FuelsPricesPerZone table or the default value
+        - No file and no default value: the prices of the fallback entry (e.g. black coal for lignite) or zero
+
+    :param config:          Dispa-SET config, with the path and the default value of each price entry
+    :param idx:             Pandas datetime index to be used for the output
+    :param zones:           List with the zone codes to be considered
+    :param entries:         List (one per price set) of lists with the price entries (e.g. 'PriceOfGas'), in the order of the fuel axis
+    :param ZonePrices:      Array (set x zone x fuel) with the constant prices from the FuelsPricesPerZone table (NaN if not applicable)
+    :param ZoneFound:       Boolean array (set x zone x fuel) indicating if the FuelsPricesPerZone table defines the price
+    :param fallbacks:       Dictionary with the entry to be used for an entry without file nor default value
+    :param files:           Dictionary with the price files already loaded with load_price_file (path as key), if any
+
+    :return prices, defined, zonal:    Price array, and boolean arrays (set x zone x fuel) indicating the prices that
+                                       have been defined and those taken from the FuelsPricesPerZone table
+    '''
+    Nsets, Nfuels = len(entries), len(entries[0])
+    prices = np.full([Nsets, len(idx), len(zones), Nfuels], np.nan)
+    defined = np.zeros([Nsets, len(zones), Nfuels], dtype='bool')
+    zonal = np.zeros([Nsets, len(zones), Nfuels], dtype='bool')
+    if ZonePrices is None:
+        ZonePrices = np.full(defined.shape, np.nan)
+        ZoneFound = np.zeros(defined.shape, dtype='bool')
+    if fallbacks is None:
+        fallbacks = {}
+
+    files = dict(files or {})
+    for k in range(Nsets):
+        missing = []
+        for j, entry in enumerate(entries[k]):
+            path = config.get(entry, '')
+            default = config['default'].get(entry)
+            if not isinstance(default, (int, float, complex)) or isinstance(default, bool):
+                default = None
+            if isinstance(path, str) and os.path.isfile(path):
+                if path not in files:
+                    files[path] = load_price_file(path, idx)
+                data = files[path]
+            else:
+                data = None
+            if data is None and default is None:
+                missing.append(j)
+            elif data is not None and data.columns[0] is None:
+                # Single time series without header, used for all zones:
+                prices[k, :, :, j] = data.values[:, [0]]
+                defined[k, :, j] = True
+            else:
+                for i, zone in enumerate(zones):
+                    if data is not None and zone in data:
+                        prices[k, :, i, j] = data[zone].values
+                        defined[k, i, j] = True
+                    elif ZoneFound[k, i, j]:
+                        if not np.isnan(ZonePrices[k, i, j]):
+                            prices[k, :, i, j] = ZonePrices[k, i, j]
+                            defined[k, i, j] = zonal[k, i, j] = True
+                    elif default is not None:
+                        prices[k, :, i, j] = default
+                        defined[k, i, j] = True
+        for j in missing:
+            entry = entries[k][j]
+            if entry in fallbacks and fallbacks[entry] in entries[k]:
+                j2 = entries[k].index(fallbacks[entry])
+                logging.warning('No price data found for ' + entry + '. Using the same values as for ' + fallbacks[entry])
+                prices[k, :, :, j] = prices[k, :, :, j2]
+                defined[k, :, j] = defined[k, :, j2]
+            else:
+                logging.warning('No data file or default value found for ' + entry + '. Assuming zero marginal price!')
+                prices[k, :, :, j] = 0
+                defined[k, :, j] = True
+    return prices, defined, zonal
+
+
+def load_price_file(path, idx):
+    '''
+    Loads a fuel price file and slices it to the simulation index. If the number of time steps within the simulation
+    window does not match the index, the window is extended by the missing number of hours.
+    Files without header (single time series) are returned with None as column header.
+
+    :param path:    Path to the csv file
+    :param idx:     Pandas datetime index of the simulation
+    :return:        Dataframe with the prices (None if the file could not be read)
+    '''
+    try:
+        data = load_csv(path, header=0, index_col=0, parse_dates=True, window=(idx[0], None))
+    except Exception:
+        logging.warning('Could not read the fuel price file ' + path)
+        return None
+    try:
+        float(data.columns[0])
+    except (TypeError, ValueError):
+        pass
+    else:
+        # No header: the first line of data has been read as the header
+        series = _first_column(data)
+        data = pd.DataFrame({None: series.values}, index=series.index)
+    window = (data.index >= idx[0]) & (data.index <= idx[-1])
+    if window.sum() != len(idx):
+        diff = abs(window.sum() - len(idx))
+        window = (data.index >= idx[0]) & (data.index <= idx[-1] + pd.Timedelta(hours=int(diff)))
+    data = data[window]
+    if len(data) != len(idx):
+        logging.error('The fuel price file ' + path + ' contains ' + str(len(data)) + ' time steps within the simulation period while ' + str(len(idx)) + ' are required')
+        sys.exit(1)
+    return data
+
+
+def load_sources(sources, workers=1, pool='thread'):
     """
-    Function that merges the times series corresponding to the merged units (e.g. outages, inflows, etc.)
+    Function that fetches independent data sources, concurrently if several workers are available. The sources are
+    declared as a dictionary of calls, e.g. {'Load': (load_csv, [path], {'index_col': 0})}. Since the sources are
+    mainly read from the disk, a pool of threads is generally sufficient. A pool of processes can be used if the
+    parsing of the files is the bottleneck (the functions and their results must then be picklable).
+
+    :param sources:     Dictionary with the name of each source as key and a tuple (function, args, kwargs) as value
+    :param workers:     Maximum number of concurrent workers. The sources are loaded one after the other if lower than 2
+    :param pool:        Type of pool ('thread' or 'process')
+    :return:            Dictionary with the name of each source as key and the output of its function as value
+    """
+    if workers is None or workers < 2 or len(sources) < 2:
+        return dict((key, sources[key][0](*sources[key][1], **sources[key][2])) for key in sources)
+    import concurrent.futures
+    if pool == 'thread':
+        # The threads are named after the calling thread, so that their messages are recorded in its build log:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=int(workers),
+                                                         thread_name_prefix=threading.current_thread().name + '-loader')
+    elif pool == 'process':
+        executor = concurrent.futures.ProcessPoolExecutor(max_workers=int(workers))
+    else:
+        logging.error('The pool type "' + str(pool) + '" is not valid. It should be "thread" or "process"')
+        sys.exit(1)
+    with executor:
+        futures = dict((key, executor.submit(sources[key][0], *sources[key][1], **sources[key][2])) for key in sources)
+        # The errors (including sys.exit calls) are raised in the order of the declaration of the sources:
+        return dict((key, futures[key].result()) for key in sources)
+
+
+def align_time_series(tables, idx, check=(), StartDate=None, StopDate=None):
+    """
+    Function that aligns time series tables on a common index. Each time step takes the value of the nearest time
+    step of the table and the missing values are filled backwards, as with
+    table.reindex(idx, method='nearest').fillna(method='bfill'). The positions of the nearest time steps are computed
+    once for all the tables sharing the same index.
+
+    :param tables:      Dictionary of dataframes with a datetime index
+    :param idx:         Target datetime index
+    :param check:       List of the tables (keys) to be checked with check_df before the alignment
+    :param StartDate:   Start date required in the tables to be checked
+    :param StopDate:    Stop date required in the tables to be checked
+    :return:            Dictionary with the aligned dataframes
+    """
+    indexes, positions = [], []
+    aligned = {}
+    for key in tables:
+        table = tables[key]
+        if key in check:
+            check_df(table, StartDate=StartDate, StopDate=StopDate, name=key)
+        for index, pos in zip(indexes, positions):
+            if table.index is index or table.index.equals(index):
+                break
+        else:
+            index = table.index
+            pos = index.get_indexer(idx, method='nearest') if len(index) > 0 else -np.ones(len(idx), dtype='int')
+            indexes.append(index)
+            positions.append(pos)
+        if len(table.index) > 0:
+            table = table.take(pos)
+        else:
+            table = table.reindex(idx)
+        table.index = idx
+        # Only the columns with missing values are filled:
+        missing = pd.isnull(table.values).any(axis=0)
+        if missing.all() and len(table.columns) > 0:
+            table = table.fillna(method='bfill')
+        elif missing.any():
+            table.iloc[:, missing] = table.iloc[:, missing].fillna(method='bfill')
+        aligned[key] = table
+    return aligned
+
+
+def merge_matrix(plants, mapping, method='WeightedAverage'):
+    """
+    Function that builds the sparse aggregation matrix between the original units and the merged units. The time series
+    of the merged units are obtained by multiplying the time series of the original units by this matrix.
 
     :param plants:      Pandas dataframe with the information relative to the original units
-    :param data:        Pandas dataframe with the time series and the original unit names as column header
     :param mapping:     Mapping between the merged units and the original units. Output of the clustering function
     :param method:      Select the merging method ('WeightedAverage'/'Sum')
-    :param tablename:   Name of the table being processed (e.g. 'Outages'), used in the warnings
-    :return merged:     Pandas dataframe with the merged time series when necessary
+    :return:            Sparse matrix (original units x merged units, in the order of mapping['FormerIndexes'])
     """
+    from scipy import sparse
     # backward compatibility:
     if not "Nunits" in plants:
         plants['Nunits'] = 1
 
+    Nunits = len(plants)
+    newunits = pd.Index(list(mapping['FormerIndexes']))
+    columns = newunits.get_indexer([mapping['NewIndex'][i] for i in range(Nunits)])
+    if method == 'WeightedAverage':
+        weights = np.maximum(1e-9, plants['PowerCapacity'].values * plants['Nunits'].values).astype('float')
+        weights = weights / np.bincount(columns, weights=weights, minlength=len(newunits))[columns]
+    elif method == 'Sum':
+        weights = np.ones(Nunits)
+    else:
+        logging.critical('Method "' + str(method) + '" unknown in function MergeSeries')
+        sys.exit(1)
+    return sparse.csr_matrix((weights, (np.arange(Nunits), columns)), shape=(Nunits, len(newunits)))
+
+
+def merge_series(plants, data, mapping, method='WeightedAverage', tablename='', matrix=None):
+    """
+    Function that merges the times series corresponding to the merged units (e.g. outages, inflows, etc.)
+
+    :param plants:      Pandas dataframe with the information relative to the original units
+    :param data:        Pandas dataframe with the time series and the original unit names as column header
+    :param mapping:     Mapping between the merged units and the original units. Output of the clustering function
+    :param method:      Select the merging method ('WeightedAverage'/'Sum')
+    :param tablename:   Name of the table being processed (e.g. 'Outages'), used in the warnings
+    :param matrix:      Aggregation matrix (output of merge_matrix with the same method). Computed if not provided
+    :return merged:     Pandas dataframe with the merged time series when necessary
+    """
     plants.index = range(len(plants))
-    merged = pd.DataFrame(index=data.index)
-    unitnames = plants.Unit.values.tolist()
     # First check the data:
     if not isinstance(data,pd.DataFrame):
         logging.error('The input "' + tablename + '" to the merge_series function must be a dataframe')
@@ -210,42 +438,39 @@ def merge_series(plants, data, mapping, method='WeightedAverage', tablename=''):
     for key in data:
         if str(data[key].dtype) not in ['bool','int','float','float16', 'float32', 'float64', 'float128','int8', 'int16', 'int32', 'int64']:
             logging.critical('The column "' + str(key) + '" of table + "' + tablename + '" is not numeric!')
-    for key in data:
-        if key in unitnames:
-            i = unitnames.index(key)
-            newunit = mapping['NewIndex'][i]
-            if newunit not in merged:  # if the columns name is in the mapping and the new unit has not been processed yet
-                oldindexes = mapping['FormerIndexes'][newunit]
-                oldnames = [plants['Unit'][x] for x in oldindexes]
-                if all([name in data for name in oldnames]):
-                    subunits = data[oldnames]
-                else:
-                    for name in oldnames:
-                        if name not in data:
-                            logging.critical('The column "' + name + '" is required for the aggregation of unit "' + key +
-                                             '", but it has not been found in the input data')
-                            sys.exit(1)
-                value = np.zeros(len(data))
-                # Renaming the subunits df headers with the old plant indexes instead of the unit names:
-                subunits.columns = mapping['FormerIndexes'][newunit]
-                if method == 'WeightedAverage':
-                    for idx in oldindexes:
-                        name = plants['Unit'][idx]
-                        value = value + subunits[idx] * np.maximum(1e-9, plants['PowerCapacity'][idx]*plants['Nunits'][idx])
-                    P_j = np.sum(np.maximum(1e-9, plants['PowerCapacity'][oldindexes]*plants['Nunits'][oldindexes]))
-                    merged[newunit] = value / P_j
-                elif method == 'Sum':
-                    merged[newunit] = subunits.sum(axis=1)
-                else:
-                    logging.critical('Method "' + str(method) + '" unknown in function MergeSeries')
-                    sys.exit(1)
-        elif key in plants['Unit']:
+    if matrix is None:
+        matrix = merge_matrix(plants, mapping, method)
+    newunits = list(mapping['FormerIndexes'])
+
+    # Position of each column in the table of power plants (-1 if not found):
+    unitnames = pd.Series(range(len(plants)), index=plants['Unit'].values)
+    unitnames = unitnames[~unitnames.index.duplicated()]
+    data = data.loc[:, ~data.columns.duplicated()]
+    positions = unitnames.reindex(data.columns).fillna(-1).values.astype('int')
+    for key in data.columns[positions < 0]:
+        if key in plants['Unit']:
             if not isinstance(key, tuple):  # if the columns header is a tuple, it does not come from the data and has been added by Dispa-SET
                 logging.warning('Column ' + str(key) + ' present in the table "' + tablename + '" not found in the mapping between original and clustered units. Skipping')
         else:
             if not isinstance(key, tuple):  # if the columns header is a tuple, it does not come from the data and has been added by Dispa-SET
                 logging.warning('Column ' + str(key) + ' present in the table "' + tablename + '" not found in the table of power plants. Skipping')
-    return merged
+    positions = positions[positions >= 0]
+
+    # Merged units to be computed (in the order of the columns) and original units required for their aggregation:
+    clusters = matrix.indices[matrix.indptr[positions]]
+    clusters = pd.unique(clusters)
+    required = np.where(np.isin(matrix.indices[matrix.indptr[:-1]], clusters))[0]
+    missing = np.setdiff1d(required, positions)
+    if len(missing) > 0:
+        newunit = newunits[matrix.indices[matrix.indptr[missing[0]]]]
+        logging.critical('The column "' + str(plants['Unit'][missing[0]]) + '" is required for the aggregation of unit "' + newunit +
+                         '", but it has not been found in the input data')
+        sys.exit(1)
+    values = data[plants['Unit'].values[required]].values.astype('float')
+    if method == 'Sum':
+        values = np.nan_to_num(values)
+    merged = (matrix[required][:, clusters].T.dot(values.T)).T
+    return pd.DataFrame(merged, index=data.index, columns=[newunits[c] for c in clusters])
 
 
 def define_parameter(sets_in, sets, value=0):
@@ -441,39 +666,207 @@ def write_to_excel(xls_out, list_vars):
     logging.info('Data Successfully written to the ' + xls_out + ' directory.')
 
 
-def load_csv(filename, TempPath='.pickle', header=0, skiprows=None, skipfooter=0, index_col=None, parse_dates=False):
+CACHE_VERSION = 1                   # To be incremented if the format of the cache entries changes
+CACHE_MAX_SIZE = 2 * 1024 ** 3      # Default maximum size of the csv cache directory, in bytes
+_cache_stats = {'hits': 0, 'misses': 0, 'writes': 0, 'evictions': 0}
+
+
+def load_csv(filename, TempPath='.pickle', header=0, skiprows=None, skipfooter=0, index_col=None, parse_dates=False,
+             MaxCacheSize=CACHE_MAX_SIZE, columns=None, window=None, store=''):
     """
-    Function that loads a csv sheet into a dataframe and saves a temporary pickle version of it.
-    If the pickle is newer than the sheet, do no load the sheet again.
+    Function that loads a csv sheet into a dataframe and saves a cached binary version of it.
+    The cache entries are identified by the content of the sheet and by the read options, so that a modified
+    sheet or different options never return stale data. Numeric tables are stored as raw column-major arrays
+    which are memory-mapped when loaded, so that only the requested columns and rows are actually read from
+    the disk. Other tables are pickled. Entries are written atomically, so that several
+    processes can share the same cache directory. The least recently used entries are removed when the
+    size of the cache exceeds MaxCacheSize.
 
     :param filename: path to csv file
     :param TempPath: path to store the temporary data files
+    :param MaxCacheSize: maximum size of the cache, in bytes
+    :param columns: if provided, only the columns of the table in this list are returned (the others are ignored)
+    :param window: tuple (start, end) of dates. If provided, only the rows of the table with a date index in
+                   this interval (limits included) are returned. None can be used for an open limit.
+    :param store: path to a data store (see ingest_database). If the file has been ingested in the store (and not
+                  modified since), it is read from there instead of the csv file
+    """
+    if store and index_col == 0 and parse_dates and skiprows is None and skipfooter == 0:
+        key = data_store_entry(store, filename, header)
+        if key is not None:
+            return read_data_store(store, key, columns, window)
+        key = data_store_entry(store, filename, None) if header == 0 else None
+        if key is not None:
+            # File without header read with a header: its first line is the header, as in the csv file
+            table = read_data_store(store, key)
+            data = pd.DataFrame(table.values[1:], index=table.index[1:], columns=[str(v) for v in table.values[0]])
+            data.index.name = str(table.index[0])
+            return _select(data, columns, window)
+    options = repr((header, skiprows, skipfooter, index_col, parse_dates, CACHE_VERSION))
+    key = hashlib.sha1((_file_hash(filename) + options).encode('utf-8')).hexdigest()
+    entryfile = os.path.join(TempPath, 'csv_' + key)
+
+    data = _read_cache_entry(entryfile)
+    if data is not None:
+        _cache_stats['hits'] += 1
+        return _select(data, columns, window)
+    _cache_stats['misses'] += 1
+    data = pd.read_csv(filename, header=header, skiprows=skiprows, skipfooter=skipfooter, index_col=index_col,
+                       parse_dates=parse_dates)
+    if parse_dates:
+        data.index = data.index.tz_localize(None)
+    if _write_cache_entry(entryfile, data):
+        _evict_cache_entries(TempPath, MaxCacheSize)
+    return _select(data, columns, window)
+
+
+def _select(data, columns=None, window=None):
+    """
+    Selects the rows of a dataframe within a date window and the required columns. The rows are selected first, as
+    a slice if the index is sorted, so that only the selected part of memory-mapped values is materialized.
     """
+    if window is not None and isinstance(data.index, pd.DatetimeIndex):
+        start, end = window
+        if data.index.is_monotonic_increasing:
+            first = 0 if start is None else data.index.searchsorted(pd.Timestamp(start), side='left')
+            last = len(data) if end is None else data.index.searchsorted(pd.Timestamp(end), side='right')
+            data = data.iloc[first:last]
+        else:
+            rows = np.ones(len(data), dtype='bool')
+            if start is not None:
+                rows &= data.index >= start
+            if end is not None:
+                rows &= data.index <= end
+            data = data[rows]
+    if columns is not None:
+        data = data.loc[:, data.columns.isin(list(columns))]
+    return data
 
-    import hashlib
-    m = hashlib.new('md5', filename.encode('utf-8'))
-    resultfile_hash = m.hexdigest()
-    filepath_pandas = TempPath + os.sep + resultfile_hash + '.p'
 
-    if not os.path.isdir(TempPath):
-        os.mkdir(TempPath)
-    if not os.path.isfile(filepath_pandas):
-        time_pd = 0
-    else:
-        time_pd = os.path.getmtime(filepath_pandas)
-    if os.path.getmtime(filename) > time_pd:
-        ####
-        data = pd.read_csv(filename, header=header, skiprows=skiprows, skipfooter=skipfooter, index_col=index_col,
-                           parse_dates=parse_dates)
-        if parse_dates:
-            data.index = data.index.tz_localize(None)
-        ####
-        data.to_pickle(filepath_pandas)
-    else:
-        data = pd.read_pickle(filepath_pandas)
+def load_csv_cache_info(TempPath='.pickle'):
+    """
+    Function that returns the statistics of the csv cache: hits, misses, writes and evictions
+    in the current process, together with the number of entries and the total size of the cache directory.
+
+    :param TempPath: path of the cache directory
+    """
+    info = dict(_cache_stats)
+    entries = _list_cache_entries(TempPath)
+    info['entries'] = len([files for _, _, files in entries if files[0].endswith('.p')])
+    info['size'] = sum(size for _, size, _ in entries)
+    return info
+
+
+def _file_hash(filename):
+    """
+    Hash of the content of a file. The hash is only computed once per process for a given file version
+    (identified by its size and modification time).
+    """
+    return _file_sha1(filename)
+
+
+def _read_cache_entry(entryfile):
+    """
+    Loads a cache entry, or returns None if it is not available. Numeric values are memory-mapped in copy-on-write
+    mode, so that the returned dataframe can be modified without altering the cache.
+    """
+    try:
+        with open(entryfile + '.p', 'rb') as f:
+            entry = pickle.load(f)
+        if entry['frame'] is not None:
+            data = entry['frame']
+        else:
+            values = np.load(entryfile + '.npy', mmap_mode='c')
+            data = pd.DataFrame(values, index=entry['index'], columns=entry['columns'], copy=False)
+        # The modification time of the entry is used for the least recently used eviction policy:
+        os.utime(entryfile + '.p', None)
+    except (IOError, OSError, EOFError, ValueError, KeyError, pickle.UnpicklingError):
+        return None
     return data
 
 
+def _write_cache_entry(entryfile, data):
+    """
+    Writes a cache entry. The files are written under temporary names and then renamed, so that concurrent
+    readers never see a partially written entry. The values are written before the entry file that refers to them,
+    and removed if the entry file cannot be written.
+    """
+    tmp = '.' + str(os.getpid()) + '_' + uuid.uuid4().hex + '.tmp'
+    numeric = data.shape[1] > 0 and len(set(data.dtypes)) == 1 and data.dtypes.iloc[0].kind in 'fiub'
+    try:
+        if not os.path.isdir(os.path.dirname(entryfile)):
+            os.makedirs(os.path.dirname(entryfile))
+    except OSError:
+        pass
+    values = False
+    try:
+        if numeric:
+            with open(entryfile + '.npy' + tmp, 'wb') as f:
+                np.save(f, np.asfortranarray(data.values))
+            os.replace(entryfile + '.npy' + tmp, entryfile + '.npy')
+            values = True
+            entry = {'frame': None, 'index': data.index, 'columns': data.columns}
+        else:
+            entry = {'frame': data}
+        with open(entryfile + '.p' + tmp, 'wb') as f:
+            pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(entryfile + '.p' + tmp, entryfile + '.p')
+    except (IOError, OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        logging.warning('Could not write the cache entry ' + entryfile + ': ' + str(e))
+        tmpfiles = [entryfile + '.npy' + tmp, entryfile + '.p' + tmp] + ([entryfile + '.npy'] if values else [])
+        for filename in tmpfiles:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        return False
+    _cache_stats['writes'] += 1
+    return True
+
+
+def _list_cache_entries(TempPath):
+    """
+    Lists the files of the csv cache with their last use time and their size on disk, grouped by entry: the cache
+    entries (entry file and values) and the values left without an entry file
+    """
+    entries = []
+    if not os.path.isdir(TempPath):
+        return entries
+    names = set(name for name in os.listdir(TempPath) if name.startswith('csv_') and name.endswith(('.p', '.npy')))
+    for name in names:
+        stem, suffix = os.path.splitext(name)
+        if suffix == '.npy' and stem + '.p' in names:
+            continue    # listed with its entry file
+        files = [os.path.join(TempPath, name)]
+        if suffix == '.p' and stem + '.npy' in names:
+            files.append(os.path.join(TempPath, stem + '.npy'))
+        try:
+            mtime = os.stat(files[0]).st_mtime
+            size = sum(os.path.getsize(filename) for filename in files)
+        except OSError:     # removed by another process
+            continue
+        entries.append((mtime, size, files))
+    return entries
+
+
+def _evict_cache_entries(TempPath, MaxCacheSize):
+    """
+    Removes the least recently used csv cache entries until the cache size is below MaxCacheSize
+    """
+    entries = sorted(_list_cache_entries(TempPath))
+    total = sum(size for _, size, _ in entries)
+    for _, size, files in entries:
+        if total <= MaxCacheSize:
+            break
+        for filename in files:
+            try:
+                os.remove(filename)
+            except OSError:
+                pass
+        total -= size
+        _cache_stats['evictions'] += 1
+
+
 def load_config_excel(ConfigFile,AbsPath=True):
     """
     Function that loads the DispaSET excel config file and returns a dictionary
@@ -515,6 +908,16 @@ def load_config_excel(ConfigFile,AbsPath=True):
     #Alternative NTC (1) & (2)
     config['NTC1'] = sheet.cell_value(66, 3)
     config['NTC2'] = sheet.cell_value(66, 4)
+    # The data store, the clustering targets, the loading options, the build cache and the compression of the gdx
+    # file are not defined in the excel file and can be added to the config afterwards:
+    config['DataStore'] = ''
+    config['ClusteringTarget'] = ''
+    config['MaxBinaries'] = ''
+    config['LoadingWorkers'] = ''
+    config['LoadingPool'] = ''
+    config['BuildCache'] = ''
+    config['BuildCacheSize'] = ''
+    config['CompressGDX'] = ''
 
     if AbsPath:
     # Changing all relative paths to absolute paths. Relative paths must be defined
@@ -645,6 +1048,9 @@ def load_config_yaml(filename,AbsPath=True):
         for param in params:
             if not os.path.isabs(config[param]):
                 config[param] = os.path.join(basefolder,config[param])
+        for param in ['DataStore', 'BuildCache']:
+            if config.get(param) and not os.path.isabs(config[param]):
+                config[param] = os.path.join(basefolder,config[param])
 
     return config
 
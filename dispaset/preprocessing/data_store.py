@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+Consolidated columnar store for the time series of the Dispa-SET database.
+
+The csv files of a database folder (e.g. Database/Load_DayAhead/##/1h/2015.csv) are compiled into a single store
+directory, with one partition per source file (i.e. table and zone) and calendar year. Each partition contains the
+values as a column-major numpy array and the datetime index, which are memory-mapped when read, so that range reads
+only touch the required part of the data. A json manifest lists the tables and partitions, with a checksum that
+identifies the version of the store. The store can be copied to another machine as a single folder.
+
+The csv paths of the config file are resolved in the store by their path relative to the database folder.
+"""
+
+import datetime
+import hashlib
+import json
+import logging
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+
+STORE_VERSION = 1
+MANIFEST = 'manifest.json'
+_manifests = {}
+_file_hashes = {}
+
+
+def ingest_database(source, store, tables=None):
+    """
+    Function that compiles the time series csv files of a database folder into a columnar store.
+    Files that have not changed since the last ingest are not processed again. Files that are not
+    numerical time series with a sorted datetime index (e.g. power plant lists) are skipped.
+
+    :param source:  Path to the database folder (e.g. 'Database')
+    :param store:   Path to the store directory to be created or updated
+    :param tables:  List of sub-folders of the database (e.g. ['Load_DayAhead']) to be ingested. All by default
+    :returns:       Manifest of the store (dictionary)
+    """
+    manifest = _read_manifest(store)
+    if manifest is None or manifest['version'] != STORE_VERSION:
+        manifest = {'version': STORE_VERSION, 'tables': {}, 'skipped': {}}
+    else:
+        manifest = {'version': STORE_VERSION, 'tables': dict(manifest['tables']), 'skipped': dict(manifest['skipped'])}
+    for root, _, files in os.walk(source):
+        for filename in sorted(files):
+            if not filename.lower().endswith('.csv'):
+                continue
+            path = os.path.join(root, filename)
+            key = os.path.relpath(path, source).replace(os.sep, '/')
+            if tables is not None and key.split('/')[0] not in tables:
+                continue
+            sha1 = _file_sha1(path)
+            if (key in manifest['tables'] and manifest['tables'][key]['sha1'] == sha1) or manifest['skipped'].get(key) == sha1:
+                continue
+            entry = _ingest_file(path, os.path.join(store, *key.split('/')))
+            if entry is None:
+                manifest['tables'].pop(key, None)
+                manifest['skipped'][key] = sha1
+                continue
+            manifest['skipped'].pop(key, None)
+            entry['sha1'] = sha1
+            manifest['tables'][key] = entry
+            logging.info('Ingested ' + key + ' (' + str(len(entry['partitions'])) + ' partitions)')
+    checksum = hashlib.sha1()
+    for key in sorted(manifest['tables']):
+        checksum.update((key + manifest['tables'][key]['sha1']).encode('utf-8'))
+    manifest['checksum'] = checksum.hexdigest()
+    manifest['created'] = datetime.datetime.now().isoformat()
+    _atomic_write(os.path.join(store, MANIFEST), json.dumps(manifest, indent=1).encode('utf-8'))
+    logging.info('Data store ' + store + ' written with ' + str(len(manifest['tables'])) + ' tables (version ' + manifest['checksum'][:8] + ')')
+    return manifest
+
+
+def data_store_entry(store, path, header=0):
+    """
+    Function that looks for a csv file in the store. The file is identified by the end of its path and must have
+    been ingested with the same header option (0 for a file with a header, None for a file without). If the csv file
+    exists on the disk, its content must also be the one that was ingested, so that a modified file is never
+    shadowed by an outdated table of the store
+
+    :param store:   Path to the store directory
+    :param path:    Path of the csv file
+    :param header:  Header option of the read
+    :returns:       Key of the table in the store or None if not found
+    """
+    manifest = _read_manifest(store)
+    if manifest is None:
+        return None
+    parts = os.path.normpath(path).replace(os.sep, '/').split('/')
+    for depth in manifest['depths']:
+        key = '/'.join(parts[-depth:])
+        if key in manifest['tables']:
+            if manifest['tables'][key]['header'] != (header is not None):
+                return None
+            if os.path.isfile(path) and _file_sha1(path) != manifest['tables'][key]['sha1']:
+                logging.info('File ' + path + ' has been modified since it was ingested in the store ' + store +
+                             '. The csv file is read')
+                return None
+            return key
+    return None
+
+
+def data_file_exists(path, store='', header=0):
+    """
+    Function that checks if a csv file exists on the disk or in the data store (if any). In the store, the file must
+    be readable with the header option of the caller (a file without header can be read with a header, its first line
+    then being the header)
+    """
+    if os.path.isfile(path):
+        return True
+    if not store:
+        return False
+    return data_store_entry(store, path, header) is not None or \
+        (header is not None and data_store_entry(store, path, None) is not None)
+
+
+def read_data_store(store, key, columns=None, window=None):
+    """
+    Function that reads a table of the store. Only the partitions overlapping the date window are opened and only the
+    requested rows and columns are materialized from the memory-mapped arrays.
+
+    :param store:   Path to the store directory
+    :param key:     Key of the table (returned by data_store_entry)
+    :param columns: If provided, only the columns in this list are returned
+    :param window:  Tuple (start, end) of dates (None for an open limit). If provided, only the rows within
+                    this interval (limits included) are returned
+    :returns:       Dataframe with the same content as the csv file loaded with load_csv
+    """
+    entry = _read_manifest(store)['tables'][key]
+    start, end = window if window is not None else (None, None)
+    start = None if start is None else pd.Timestamp(start).value
+    end = None if end is None else pd.Timestamp(end).value
+    cols = pd.Index(entry['columns'])
+    positions = np.arange(len(cols)) if columns is None else np.where(cols.isin(list(columns)))[0]
+    indexes, values = [], []
+    folder = os.path.join(store, *key.split('/'))
+    for year in sorted(entry['partitions'], key=int):
+        if (start is not None and pd.Timestamp(int(year) + 1, 1, 1).value <= start) or \
+                (end is not None and pd.Timestamp(int(year), 1, 1).value > end):
+            continue
+        index = np.load(os.path.join(folder, year + '.index.npy'), mmap_mode='r')
+        first = 0 if start is None else np.searchsorted(index, start, side='left')
+        last = len(index) if end is None else np.searchsorted(index, end, side='right')
+        data = np.load(os.path.join(folder, year + '.npy'), mmap_mode='c')
+        indexes.append(np.array(index[first:last]))
+        values.append(data[first:last].take(positions, axis=1))
+    if len(values) == 0:
+        indexes, values = [np.zeros(0, dtype='int64')], [np.zeros([0, len(positions)])]
+    index = pd.DatetimeIndex(np.concatenate(indexes).view('datetime64[ns]'), name=entry['index_name'])
+    return pd.DataFrame(np.concatenate(values), index=index, columns=cols[positions])
+
+
+def _ingest_file(path, folder):
+    """
+    Parses a csv time series and writes one partition per calendar year. Returns the manifest entry or None if the
+    file cannot be stored.
+    """
+    try:
+        data = pd.read_csv(path, header=0, index_col=0, parse_dates=True)
+        try:
+            float(data.columns[0])
+            header = False
+            data = pd.read_csv(path, header=None, index_col=0, parse_dates=True)
+        except (TypeError, ValueError, IndexError):
+            header = True
+    except Exception as e:
+        logging.warning('File ' + path + ' could not be parsed and is not ingested: ' + str(e))
+        return None
+    if not isinstance(data.index, pd.DatetimeIndex) or not data.index.is_monotonic_increasing:
+        logging.info('File ' + path + ' is not a sorted time series and is not ingested')
+        return None
+    if data.shape[1] == 0 or not all(dtype.kind in 'fiub' for dtype in data.dtypes):
+        logging.info('File ' + path + ' contains non-numerical data and is not ingested')
+        return None
+    data.index = data.index.tz_localize(None)
+    index = data.index.values.view('int64')
+    values = np.asfortranarray(data.values.astype('float64'))
+    years, starts = np.unique(data.index.year, return_index=True)
+    stops = list(starts[1:]) + [len(data)]
+    partitions = {}
+    for year, first, last in zip(years, starts, stops):
+        _atomic_save(os.path.join(folder, str(year) + '.index.npy'), index[first:last])
+        _atomic_save(os.path.join(folder, str(year) + '.npy'), np.asfortranarray(values[first:last]))
+        partitions[str(year)] = int(last - first)
+    columns = [c if isinstance(c, str) else int(c) for c in data.columns]
+    return {'header': header, 'columns': columns, 'index_name': data.index.name, 'partitions': partitions}
+
+
+def _read_manifest(store):
+    """
+    Loads the manifest of a store (only once per process and version of the manifest)
+    """
+    path = os.path.join(store, MANIFEST)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+    if path not in _manifests or _manifests[path][0] != mtime:
+        with open(path, 'rb') as f:
+            manifest = json.loads(f.read().decode('utf-8'))
+        manifest['depths'] = sorted(set(len(key.split('/')) for key in manifest['tables']), reverse=True)
+        _manifests[path] = (mtime, manifest)
+    return _manifests[path][1]
+
+
+def _file_sha1(path):
+    """
+    Hash of the content of a file. The hash is only computed once per process for a given file version
+    (identified by its size and modification time).
+    """
+    stat = os.stat(path)
+    version = (os.path.abspath(path), stat.st_size, stat.st_mtime)
+    if version not in _file_hashes:
+        m = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(2 ** 20), b''):
+                m.update(chunk)
+        _file_hashes[version] = m.hexdigest()
+    return _file_hashes[version]
+
+
+def _atomic_save(path, array):
+    """
+    Writes a numpy array under a temporary name and renames it, so that readers never see a partial file
+    """
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmp, 'wb') as f:
+        np.save(f, array)
+    os.replace(tmp, path)
+
+
+def _atomic_write(path, content):
+    if not os.path.isdir(os.path.dirname(os.path.abspath(path))):
+        os.makedirs(os.path.dirname(os.path.abspath(path)))
+    tmp = path + '.' + uuid.uuid4().hex + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(content)
+    os.replace(tmp, path)
@@ -5,11 +5,14 @@ This is the main file of the DispaSET pre-processing tool. It comprises a single
 @author: S. Quoilin
 """
 
+import copy
 import datetime as dt
 import logging
 import os
 import shutil
 import sys
+import threading
+import uuid
 
 import numpy as np
 import pandas as pd
@@ -21,13 +24,29 @@ except ImportError:
     pass
 
 from .data_check import check_units, check_chp, check_sto, check_heat_demand, check_df, isStorage, check_MinMaxFlows,check_AvailabilityFactors, check_clustering
-from .utils import clustering, interconnections, incidence_matrix
-from .data_handler import UnitBasedTable,NodeBasedTable,merge_series, define_parameter, write_to_excel, load_csv
+from .utils import clustering, interconnections, incidence_matrix, fuel_price_array, variable_costs, \
+    zone_fuel_prices, fuel_price_per_zone
+from .data_handler import UnitBasedTable,NodeBasedTable,FuelPriceTable,merge_series, merge_matrix, align_time_series, define_parameter, write_to_excel, load_csv, \
+    load_price_file, load_sources
+from .data_store import data_file_exists
+from .build_cache import build_cache, run_stage, run_stages, stage_key, build_key, write_build_key, code_version
 
 from ..misc.gdx_handler import write_variables
+from ..misc.topology import network_topology
 from ..common import commons  # Load fuel types, technologies, timestep, etc:
 
 GMS_FOLDER = os.path.join(os.path.dirname(__file__), '..', 'GAMS')
+# GAMS file of each model code (UCM_h.gms by default):
+GMS_FILES = {'Standard': 'UCM_h.gms', 'Standard_2': 'UCM_h_V2.0.gms',
+             'GCC_virtual_connections': 'UCM_h_GCC_virtual_connections.gms',
+             'GCC_substation_nodes': 'UCM_h_GCC.gms', 'GCC_isolated': 'UCM_h_GCC.gms'}
+
+# Equivalence between the fuel types and the price entries in the config sheet (the last one is the CO2 price).
+# The alternative fuel prices use the same entries with the " 2" suffix
+FUEL_CODES = ['BIO', 'GAS', 'HRD', 'LIG', 'NUC', 'OIL', 'PEA', 'DSL', 'HFO', 'MSW', 'LFG', 'CO2']
+FUEL_ENTRIES = ['PriceOfBiomass', 'PriceOfGas', 'PriceOfBlackCoal', 'PriceOfLignite', 'PriceOfNuclear', 'PriceOfCrudeOil',
+                'PriceOfPeat', 'PriceOfDiesel', 'PriceOfHFO', 'PriceOfMunicipalSolidWaste', 'PriceOfLandFillGas', 'PriceOfCO2']
+FUEL_ENTRIES2 = [entry + ' 2' for entry in FUEL_ENTRIES]
 
 def get_git_revision_tag():
     """Get version of DispaSET used for this run. tag + commit hash"""
@@ -43,11 +62,39 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
     processes it when needed, and formats it in the proper DispaSET format.
     The output of the function is a directory with all inputs and simulation files required to run a DispaSET simulation
 
+    The build works on a copy of the config and only writes into the simulation directory (including its log file,
+    warn_preprocessing.log), so that several builds can run concurrently in the same process or in a pool of processes.
+
     :param config: Dictionary with all the configuration fields loaded from the excel file. Output of the 'LoadConfig' function.
     :param plot_load: Boolean used to display a plot of the demand curves in the different zones
     :param PercentLocalSubsidy (used only when fuel prices are not provided in time series): Percentage of government subsidy or spending (reference subsidy is in table config['FuelsPricesPerZone'])
     :param PercentExportCost (used only when fuel prices are not provided in time series): Percentage of international price (reference international price is in table config['FuelsPricesPerZone'])
     """
+    config = copy.deepcopy(config)
+    sim = config['SimulationDirectory']
+    if not os.path.exists(sim):
+        os.makedirs(sim)
+    # Log file of the build, only recording the messages of the current thread and of its loading threads:
+    logfile = os.path.join(sim, 'warn_preprocessing.log')
+    tmp = logfile + '.' + str(os.getpid()) + '_' + uuid.uuid4().hex + '.tmp'
+    handler = logging.FileHandler(tmp, mode='w', encoding='utf8')
+    handler.setLevel(logging.INFO)
+    handler.setFormatter(logging.Formatter('%(asctime)s [%(levelname)-8s] (%(funcName)s): %(message)s', '%y/%m/%d %H:%M:%S'))
+    thread = threading.current_thread().name
+    handler.addFilter(lambda record: record.threadName == thread or record.threadName.startswith(thread + '-'))
+    logging.getLogger().addHandler(handler)
+    try:
+        return _build_simulation(config, LocalSubsidyMultiplier, ExportCostMultiplier)
+    finally:
+        logging.getLogger().removeHandler(handler)
+        handler.close()
+        os.replace(tmp, logfile)
+
+
+def _build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
+    """
+    Builds the simulation environment (see build_simulation). The config is modified in place.
+    """
     dispa_version = str(get_git_revision_tag())
     logging.info('New build started. DispaSET version: ' + dispa_version)
     # %%################################################################################################################
@@ -124,41 +171,242 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
     if not isinstance(config['default']['CostHeatSlack'],(float,int)):
         config['default']['CostHeatSlack'] = 50
 
-    # Load :
-    Load = NodeBasedTable(config['Demand'],idx_utc_noloc,config['zones'],tablename='Demand')
+    # Consolidated time series store (optional):
+    store = config.get('DataStore', '')
+    # Cache of the build stages (optional). The stages whose inputs have not changed since a previous build are
+    # loaded from the cache instead of being executed:
+    cache = build_cache(config.get('BuildCache', ''), config.get('BuildCacheSize') or None, code_version())
+
+    # Loading stage: the independent data sources are fetched together, concurrently if config['LoadingWorkers'] is
+    # higher than one (pool of threads or processes, see config['LoadingPool']):
+    workers, pool = config.get('LoadingWorkers') or 1, config.get('LoadingPool') or 'thread'
+    # Interconnections (only the simulation period, including the look-ahead and a one-day margin, is loaded):
+    window = (idx_utc_noloc[0] - dt.timedelta(days=1), idx_utc_noloc[-1] + dt.timedelta(days=config['LookAhead'] + 1))
+    # Power plants (single file or one file per zone):
+    if os.path.isfile(config['PowerPlantData']):
+        PlantFiles = [config['PowerPlantData']]
+    elif '##' in config['PowerPlantData']:
+        PlantFiles = [config['PowerPlantData'].replace('##', str(c)) for c in config['zones']]
+    else:
+        PlantFiles = []
+    # Each stage is defined by its function, its arguments, its inputs and its upstream stages:
+    stages = {'demand': (_load_demand, [config, idx_utc_noloc, idx_utc_year_noloc, store], {},
+                         [_config_inputs(config, ['Demand', 'LoadShedding', 'CostLoadShedding', 'zones', 'default']),
+                          idx_utc_noloc, idx_utc_year_noloc, store], []),
+              'interconnections': (_load_interconnections, [config, idx_utc_noloc, window, store], {},
+                                   [_config_inputs(config, ['Interconnections', 'NTC', 'zones']), idx_utc_noloc, window, store], []),
+              'units': (_load_units, [config, PlantFiles, workers], {},
+                        [_config_inputs(config, ['HorizonLength']), PlantFiles], []),
+              'fuel_prices': (_load_fuel_prices, [config, idx_utc_noloc, LocalSubsidyMultiplier, ExportCostMultiplier, workers], {},
+                              [_config_inputs(config, FUEL_ENTRIES + FUEL_ENTRIES2 + ['FuelsPricesPerZone', 'zones', 'default']),
+                               idx_utc_noloc, LocalSubsidyMultiplier, ExportCostMultiplier], [])}
+    inputs = run_stages(cache, stages, workers, pool)
+    plants = inputs['units']
+
+    # The unit-based tables depend on the list of units and are loaded in a second step:
+    stages = {'outages': (UnitBasedTable, [plants, config['Outages'], idx_utc_noloc, config['zones']],
+                          {'fallbacks': ['Unit', 'Technology'], 'tablename': 'Outages', 'store': store},
+                          [_config_inputs(config, ['Outages', 'zones']), idx_utc_noloc, store], ['units']),
+              'availability': (_load_availability, [config, plants, idx_utc_noloc, store], {},
+                               [_config_inputs(config, ['RenewablesAF', 'zones']), idx_utc_noloc, store], ['units'])}
+    inputs.update(run_stages(cache, stages, workers, pool))
+    #ReservoirLevels = UnitBasedTable(plants_sto,config['ReservoirLevels'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology','Zone'],tablename='ReservoirLevels',default=0)
+    #ReservoirScaledInflows = UnitBasedTable(plants_sto,config['ReservoirScaledInflows'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology','Zone'],tablename='ReservoirScaledInflows',default=0)
+    #HeatDemand = UnitBasedTable(plants_chp,config['HeatDemand'],idx_utc_noloc,config['zones'],fallbacks=['Unit'],tablename='HeatDemand',default=0)
+    #CostHeatSlack = UnitBasedTable(plants_chp,config['CostHeatSlack'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Zone'],tablename='CostHeatSlack',default=config['default']['CostHeatSlack'])
+    #check_heat_demand(plants,HeatDemand)
+
+    # Clustering of the plants:
+    inputs['clustering'] = run_stage(cache, 'clustering', _cluster_units, [config, plants], {},
+                                     _config_inputs(config, ['SimulationType', 'ClusteringTarget', 'MaxBinaries']), ['units'])
+    mapping = inputs['clustering'][1]
+
+    # Merging the time series relative to the clustered power plants:
+    inputs['merging'] = run_stage(cache, 'merging', _merge_unit_series, [plants, mapping, inputs['outages'], inputs['availability']], {},
+                                  {}, ['units', 'clustering', 'outages', 'availability'])
+
+    # Sets and parameters (including the modifiers of the config):
+    sets, parameters, Plants_merged, FuelPrices, FuelPrices2, topology = run_stage(
+        cache, 'parameters', _build_parameters, [config, idx_utc_noloc, inputs, LocalSubsidyMultiplier, ExportCostMultiplier], {},
+        [_config_inputs(config, ['zones', 'country_zones', 'modifiers', 'LookAhead', 'HorizonLength', 'AllowCurtailment',
+                                 'ReserveParticipation']), idx_utc_noloc, LocalSubsidyMultiplier, ExportCostMultiplier],
+        ['demand', 'interconnections', 'units', 'fuel_prices', 'clustering', 'merging'])
+    zonal = inputs['fuel_prices'][3]
+
+    # %%#################################################################################################################
+    ######################################   Simulation Environment     ################################################
+    ####################################################################################################################
+
+    # Output folder:
+    sim = config['SimulationDirectory']
+
+    # Simulation data:
+    SimData = {'sets': sets, 'parameters': parameters, 'config': config, 'units': Plants_merged, 'version': dispa_version}
+    # Lines, nodes and incidence matrix of the network, shared with the post-processing:
+    SimData['topology'] = topology
+    # Prices taken from the FuelsPricesPerZone table, required to re-derive the costs for other multipliers:
+    SimData['fuel_prices'] = {'codes': FUEL_CODES, 'entries': [FUEL_ENTRIES, FUEL_ENTRIES2], 'zonal': zonal}
+    # Deviation of the characteristics of the original units from the clustered units:
+    SimData['clustering_distortion'] = mapping['Distortion']
+
+    # Writing stage: the simulation environment is not written again if it already contains the same build
+    if cache['path']:
+        key = stage_key('write', [config, LocalSubsidyMultiplier, ExportCostMultiplier], [cache['keys']['parameters']], cache['version'])
+    else:
+        key = None
+    if key is not None and build_key(sim) == key:
+        logging.info('Stage "write" reused: the simulation environment ' + sim + ' is up to date')
+        cache['reused'].append('write')
+    else:
+        _write_simulation_environment(SimData, LP)
+        cache['executed'].append('write')
+        if key is not None:
+            write_build_key(sim, key)
+
+    if cache['path']:
+        logging.info('Build stages reused from the cache: ' + (', '.join(cache['reused']) or 'none') +
+                     '. Executed: ' + (', '.join(cache['executed']) or 'none'))
+    logging.info('Build finished')
+
+    return SimData, FuelPrices, FuelPrices2
+
+
+def _write_simulation_environment(SimData, LP):
+    """
+    Writes the inputs (gdx, excel and/or pickle files) and the GAMS files of the simulation in its directory.
+    Nothing is written in the current working directory and each file is written under a temporary name before
+    being renamed, so that several builds can run concurrently.
+    """
+    config, sets, parameters = SimData['config'], SimData['sets'], SimData['parameters']
+    sim = config['SimulationDirectory']
+
+    if not os.path.exists(sim):
+        os.makedirs(sim)
+
+    if config['WriteGDX']:
+        _write_atomic(os.path.join(sim, 'Inputs.gdx'), lambda tmp: write_variables(
+            config['GAMS_folder'], tmp, [sets, parameters], bool(config.get('CompressGDX'))))
+
+    #Choose what GAMS code to use based on specified GAMS code in the parameter ( config['GAMS_ModelCode'] )
+    gms = os.path.join(GMS_FOLDER, GMS_FILES.get(config['GAMS_ModelCode'], 'UCM_h.gms'))
+    if LP:
+        with open(gms) as fin:
+            code = fin.read().replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1')
+        _write_atomic(os.path.join(sim, 'UCM_h.gms'), lambda tmp: _write_text(tmp, code))
+    else:
+        _write_atomic(os.path.join(sim, 'UCM_h.gms'), lambda tmp: shutil.copyfile(gms, tmp))
+
+    _write_atomic(os.path.join(sim, 'UCM.gpr'), lambda tmp: _write_text(tmp,
+        '[PROJECT] \n \n[RP:UCM_H] \n1= \n[OPENWINDOW_1] \nFILE0=UCM_h.gms \nFILE1=UCM_h.gms \nMAXIM=1 \nTOP=50 \nLEFT=50 \nHEIGHT=400 \nWIDTH=400'))
+    _write_atomic(os.path.join(sim, 'writeresults.gms'),
+                  lambda tmp: shutil.copyfile(os.path.join(GMS_FOLDER, 'writeresults.gms'), tmp))
+    # Create cplex option file
+    cplex_options = {'epgap': 0.05, # TODO: For the moment hardcoded, it has to be moved to a config file
+                     'numericalemphasis': 0,
+                     'scaind': 1,
+                     'lpmethod': 0,
+                     'relaxfixedinfeas': 0,
+                     'mipstart':1,
+                     'epint':0}
+
+    lines_to_write = ['{} {}'.format(k, v) for k, v in cplex_options.items()]
+    _write_atomic(os.path.join(sim, 'cplex.opt'), lambda tmp: _write_text(tmp, ''.join(line + '\n' for line in lines_to_write)))
+
+    logging.debug('Using gams file from ' + GMS_FOLDER)
+    # Copy bat file to generate gdx file directly from excel:
+    _write_atomic(os.path.join(sim, 'makeGDX.bat'),
+                  lambda tmp: shutil.copyfile(os.path.join(GMS_FOLDER, 'makeGDX.bat'), tmp))
+
+    if config['WriteExcel']:
+        write_to_excel(sim, [sets, parameters])
+
+    if config['WritePickle']:
+        _write_atomic(os.path.join(sim, 'Inputs.p'), lambda tmp: _write_pickle(tmp, SimData))
+
+
+def _write_atomic(path, write):
+    """
+    Calls write with a temporary path in the directory of the target file and renames the written file to the
+    target, so that readers and concurrent builds never see a partially written file. The temporary file keeps the
+    extension of the target.
+    """
+    root, ext = os.path.splitext(path)
+    tmp = root + '.' + str(os.getpid()) + '_' + uuid.uuid4().hex + '.tmp' + ext
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.isfile(tmp):
+            os.remove(tmp)
+
+
+def _write_text(path, text):
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+def _write_pickle(path, SimData):
+    try:
+        import cPickle as pickle
+    except ImportError:
+        import pickle
+    with open(path, 'wb') as pfile:
+        pickle.dump(SimData, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _config_inputs(config, keys):
+    """
+    Selects the config entries used by a build stage
+    """
+    return dict((key, config.get(key)) for key in keys)
+
+
+def _load_demand(config, idx, idx_year, store=''):
+    """
+    Build stage loading the demand (for the simulation period and for the whole year) and the load shedding tables
+    """
     # For the peak load, the whole year is considered:
-    PeakLoad = NodeBasedTable(config['Demand'],idx_utc_year_noloc,config['zones'],tablename='PeakLoad').max()
+    Load, LoadYear = NodeBasedTable(config['Demand'],[idx,idx_year],config['zones'],tablename='Demand',store=store)
+    LoadShedding = NodeBasedTable(config['LoadShedding'],idx,config['zones'],tablename='LoadShedding',default=config['default']['LoadShedding'],store=store)
+    CostLoadShedding = NodeBasedTable(config['CostLoadShedding'],idx,config['zones'],tablename='CostLoadShedding',default=config['default']['CostLoadShedding'],store=store)
+    return Load, LoadYear, LoadShedding, CostLoadShedding
 
-    if config['modifiers']['Demand'] != 1:
-        logging.info('Scaling load curve by a factor ' + str(config['modifiers']['Demand']))
-        Load = Load * config['modifiers']['Demand']
-        PeakLoad = PeakLoad * config['modifiers']['Demand']
 
-    # Interconnections:
-    if os.path.isfile(config['Interconnections']):
-        flows = load_csv(config['Interconnections'], index_col=0, parse_dates=True).fillna(0)
+def _load_interconnections(config, idx, window, store=''):
+    """
+    Build stage loading the historical flows and the NTCs and defining the interconnections
+    """
+    if data_file_exists(config['Interconnections'], store):
+        flows = load_csv(config['Interconnections'], index_col=0, parse_dates=True, window=window, store=store).fillna(0)
     else:
         logging.warning('No historical flows will be considered (no valid file provided)')
-        flows = pd.DataFrame(index=idx_utc_noloc)
-    if os.path.isfile(config['NTC']):
-        NTC = load_csv(config['NTC'], index_col=0, parse_dates=True).fillna(0)
+        flows = pd.DataFrame(index=idx)
+    if data_file_exists(config['NTC'], store):
+        NTC = load_csv(config['NTC'], index_col=0, parse_dates=True, window=window, store=store).fillna(0)
     else:
         logging.warning('No NTC values will be considered (no valid file provided)')
-        NTC = pd.DataFrame(index=idx_utc_noloc)
+        NTC = pd.DataFrame(index=idx)
 
-    # Load Shedding:
-    LoadShedding = NodeBasedTable(config['LoadShedding'],idx_utc_noloc,config['zones'],tablename='LoadShedding',default=config['default']['LoadShedding'])
-    CostLoadShedding = NodeBasedTable(config['CostLoadShedding'],idx_utc_noloc,config['zones'],tablename='CostLoadShedding',default=config['default']['CostLoadShedding'])
+    [Interconnections_sim, Interconnections_RoW, Interconnections] = interconnections(config['zones'], NTC, flows)
 
-    # Power plants:
-    plants = pd.DataFrame()
-    if os.path.isfile(config['PowerPlantData']):
-        plants = load_csv(config['PowerPlantData'])
-    elif '##' in config['PowerPlantData']:
-        for c in config['zones']:
-            path = config['PowerPlantData'].replace('##', str(c))
-            tmp = load_csv(path)
-            plants = plants.append(tmp, ignore_index=True)
+    if len(Interconnections_sim.columns) > 0:
+        NTCs = Interconnections_sim.reindex(idx)
+    else:
+        NTCs = pd.DataFrame(index=idx)
+    Inter_RoW = Interconnections_RoW.reindex(idx)
+    return NTCs, Inter_RoW, Interconnections
+
+
+def _load_units(config, PlantFiles, workers=1):
+    """
+    Build stage loading and checking the power plant data. The files of the zones are loaded concurrently by a pool
+    of threads if several workers are available (see load_sources)
+    """
+    if len(PlantFiles) > 0:
+        files = load_sources(dict((path, (load_csv, [path], {})) for path in PlantFiles), workers)
+        plants = pd.concat([files[path] for path in PlantFiles], ignore_index=True, sort=False)
+    else:
+        plants = pd.DataFrame()
     plants = plants[plants['Technology'] != 'Other']
     plants = plants[pd.notnull(plants['PowerCapacity'])]
     plants.index = range(len(plants))
@@ -178,198 +426,99 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
         if key not in plants.columns:
             plants[key] = np.nan
 
-
     # Defining the hydro storages:
     plants_sto = plants[[u in commons['tech_storage'] for u in plants['Technology']]]
     # check storage plants:
     check_sto(config, plants_sto)
+    return plants
 
-    # Defining the CHPs:
-    plants_chp = plants[[str(x).lower() in commons['types_CHP'] for x in plants['CHPType']]]
-
-    Outages = UnitBasedTable(plants,config['Outages'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology'],tablename='Outages')
-    AF = UnitBasedTable(plants,config['RenewablesAF'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology'],tablename='AvailabilityFactors',default=1,RestrictWarning=commons['tech_renewables'])
-    #ReservoirLevels = UnitBasedTable(plants_sto,config['ReservoirLevels'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology','Zone'],tablename='ReservoirLevels',default=0)
-    #ReservoirScaledInflows = UnitBasedTable(plants_sto,config['ReservoirScaledInflows'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Technology','Zone'],tablename='ReservoirScaledInflows',default=0)
-    #HeatDemand = UnitBasedTable(plants_chp,config['HeatDemand'],idx_utc_noloc,config['zones'],fallbacks=['Unit'],tablename='HeatDemand',default=0)
-    #CostHeatSlack = UnitBasedTable(plants_chp,config['CostHeatSlack'],idx_utc_noloc,config['zones'],fallbacks=['Unit','Zone'],tablename='CostHeatSlack',default=config['default']['CostHeatSlack'])
-
-    # data checks:
-    check_AvailabilityFactors(plants,AF)
-    #check_heat_demand(plants,HeatDemand)
-    if os.path.isfile(config['FuelsPricesPerZone']):
-        FuelPricesPerZone = load_csv(config['FuelsPricesPerZone'], header=0, index_col=0)
-
-    FuelEntries = {'PriceOfBiomass':'BIO', 'PriceOfGas':'GAS', 'PriceOfBlackCoal':'HRD', 'PriceOfLignite':'LIG',
-                    'PriceOfNuclear':'NUC', 'PriceOfCrudeOil':'OIL', 'PriceOfPeat':'PEA', 'PriceOfDiesel':'DSL',
-                    'PriceOfHFO':'HFO', 'PriceOfMunicipalSolidWaste':'MSW', 'PriceOfLandFillGas':'LFG'}
-    # Fuel prices:
-    fuels = ['PriceOfNuclear', 'PriceOfGas', 'PriceOfCrudeOil', 'PriceOfBiomass', 'PriceOfCO2', 'PriceOfDiesel',
-             'PriceOfHFO', 'PriceOfMunicipalSolidWaste', 'PriceOfLandFillGas', 'PriceOfBlackCoal', 'PriceOfLignite',
-             'PriceOfPeat']
-    vals = {}
-    idx = pd.IndexSlice
-    FirstCell = 'Initially String'
-    for fuel in fuels:
-        try:
-            tmp = load_csv(config[fuel], header=0, index_col=0, parse_dates=True)
-            tmp.index = tmp.index.tz_localize(None)
-            try:
-                FirstCell = float(tmp.columns[0])
-            except:
-                FirstCell = 'String'
-        except:
-            # logging.warning('No data file found for  ' + fuel)
-            tmp = ['No file']
-            FirstCell = 'String'
-        if isinstance(FirstCell, float):
-            tmp2 = load_csv(config[fuel], header=None, index_col=0, parse_dates=True)
-            tmp2.index = tmp2.index.tz_localize(None)
-            for zone in config['zones']:
-                if len([i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (tmp2.index <= idx_utc_noloc[-1])].values])==len(idx_utc_noloc):
-                    vals[(zone, fuel)] = [i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (
-                                tmp2.index <= idx_utc_noloc[-1])].values]
-                else:
-                    diff = abs(len([i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (tmp2.index <= idx_utc_noloc[-1])].values]) - len(idx_utc_noloc))
-                    vals[(zone, fuel)] = [i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (tmp2.index <= idx_utc_noloc[-1]+dt.timedelta(hours=diff))].values]
-        elif isinstance(FirstCell, str) and isinstance(tmp, pd.DataFrame):
-            for zone in config['zones']:
-                if zone in tmp.columns:
-                    if len(tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values) == len(idx_utc_noloc):
-                        vals[(zone, fuel)] = tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values
-                    else:
-                        diff = abs(len(tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values) - len(idx_utc_noloc))
-                        vals[(zone, fuel)] = tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1]+dt.timedelta(hours=diff))][zone].values
-                else:
-                    try:
-                        if isinstance(FuelPricesPerZone[zone][FuelEntries[fuel]], (int, float, complex)) and FuelPricesPerZone[zone][FuelEntries[fuel]] > 0:
-                            FuelPricesPerZone[zone][FuelEntries[fuel]] = FuelPricesPerZone['International'][FuelEntries[fuel]] - (FuelPricesPerZone['International'][FuelEntries[fuel]]
-                                                                        - FuelPricesPerZone[zone][FuelEntries[fuel]]) * LocalSubsidyMultiplier
-                            vals[(zone, fuel)] = [FuelPricesPerZone[zone][FuelEntries[fuel]]] * len(idx_utc_noloc)
-                    except:
-                        if isinstance(config['default'][fuel], (int, float, complex)):
-                            #logging.warning('No data file found for ' + fuel + ' in the zone ' + zone + '. Using default value ' + str(config['default'][fuel]) + ' $')
-                            vals[(zone, fuel)] = [config['default'][fuel]] * len(idx_utc_noloc)
-        elif isinstance(config['default'][fuel], (int, float, complex)):
-            for zone in config['zones']:
-                try:
-                    #logging.warning('No data file found for ' + fuel + ' in the zone ' + zone + '. Using default value ' + str(config['default'][fuel]) + ' $')
-                    if isinstance(FuelPricesPerZone[zone][FuelEntries[fuel]], (int, float, complex)) and FuelPricesPerZone[zone][FuelEntries[fuel]] > 0:
-                        FuelPricesPerZone[zone][FuelEntries[fuel]] = FuelPricesPerZone['International'][FuelEntries[fuel]] - (FuelPricesPerZone['International'][FuelEntries[fuel]]
-                                                                    - FuelPricesPerZone[zone][FuelEntries[fuel]]) * LocalSubsidyMultiplier
-                        vals[(zone, fuel)] = [FuelPricesPerZone[zone][FuelEntries[fuel]]] * len(idx_utc_noloc)
-                except:
-                    vals[(zone, fuel)] = [config['default'][fuel]] * len(idx_utc_noloc)
-
-        elif fuel == 'PriceOfLignite':
-            logging.warning('No price data found for ' + fuel + ' in the zone ' + zone + '. Using the same value as for Black Coal')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = vals[(zone, 'PriceOfBlackCoal')]
-        elif fuel == 'PriceOfPeat':
-            logging.warning('No price data found for ' + fuel + ' in the zone ' + zone + '. Using the same value as for biomass')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = vals[(zone, 'PriceOfBiomass')]
-        else:
-            logging.warning('No data file or default value found for ' + fuel + ' in the zone ' + zone + '. Assuming zero marginal price!')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = [0] * len(idx_utc_noloc)
-    FuelPrices = pd.DataFrame(vals, index=idx_utc_noloc)
-
-    # Alternative Fuel prices:
-    fuels2 = ['PriceOfNuclear 2', 'PriceOfGas 2', 'PriceOfCrudeOil 2', 'PriceOfBiomass 2', 'PriceOfCO2 2', 'PriceOfDiesel 2',
-              'PriceOfHFO 2', 'PriceOfMunicipalSolidWaste 2', 'PriceOfLandFillGas 2', 'PriceOfBlackCoal 2', 'PriceOfLignite 2',
-              'PriceOfPeat 2']
-    FuelEntries2 = {'PriceOfBiomass 2': 'BIO', 'PriceOfGas 2': 'GAS', 'PriceOfBlackCoal 2': 'HRD', 'PriceOfLignite 2': 'LIG',
-                   'PriceOfNuclear 2': 'NUC', 'PriceOfCrudeOil 2': 'OIL', 'PriceOfPeat 2': 'PEA', 'PriceOfDiesel 2': 'DSL',
-                   'PriceOfHFO 2': 'HFO', 'PriceOfMunicipalSolidWaste 2': 'MSW', 'PriceOfLandFillGas 2': 'LFG'}
-    vals = {}
-    FirstCell = 'Initially String'
-    for fuel in fuels2:
-        try:
-            tmp = load_csv(config[fuel], header=0, index_col=0, parse_dates=True)
-            tmp.index = tmp.index.tz_localize(None)
-            try:
-                FirstCell = float(tmp.columns[0])
-            except:
-                FirstCell = 'String'
-        except:
-            # logging.warning('No data file found for  ' + fuel)
-            tmp = ['No file']
-            FirstCell = 'String'
-        if isinstance(FirstCell, float):
-            tmp2 = load_csv(config[fuel], header=None, index_col=0, parse_dates=True)
-            tmp2.index = tmp2.index.tz_localize(None)
-            for zone in config['zones']:
-                if len([i[0] for i in
-                        tmp2[(tmp2.index >= idx_utc_noloc[0]) & (tmp2.index <= idx_utc_noloc[-1])].values]) == len(
-                        idx_utc_noloc):
-                    vals[(zone, fuel)] = [i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (
-                            tmp2.index <= idx_utc_noloc[-1])].values]
-                else:
-                    diff = abs(len([i[0] for i in tmp2[
-                        (tmp2.index >= idx_utc_noloc[0]) & (tmp2.index <= idx_utc_noloc[-1])].values]) - len(
-                        idx_utc_noloc))
-                    vals[(zone, fuel)] = [i[0] for i in tmp2[(tmp2.index >= idx_utc_noloc[0]) & (
-                                tmp2.index <= idx_utc_noloc[-1] + dt.timedelta(hours=diff))].values]
-        elif isinstance(FirstCell, str) and isinstance(tmp, pd.DataFrame):
-            for zone in config['zones']:
-                if zone in tmp.columns:
-                    if len(tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values) == len(idx_utc_noloc):
-                        vals[(zone, fuel)] = tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values
-                    else:
-                        diff = abs(len(tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1])][zone].values) - len(idx_utc_noloc))
-                        vals[(zone, fuel)] = tmp[(tmp.index >= idx_utc_noloc[0]) & (tmp.index <= idx_utc_noloc[-1]+dt.timedelta(hours=diff))][zone].values
-                else:
-                    try:
-                        if isinstance(FuelPricesPerZone['International'][FuelEntries2[fuel]], (int, float, complex)) and \
-                                FuelPricesPerZone['International'][FuelEntries2[fuel]] > 0:
-                            FuelPricesPerZone['International'][FuelEntries2[fuel]] = FuelPricesPerZone['International'][FuelEntries2[fuel]] * ExportCostMultiplier
-                            vals[(zone, fuel)] = [FuelPricesPerZone['International'][FuelEntries2[fuel]]] * len(idx_utc_noloc)
-                    except:
-                        if isinstance(config['default'][fuel], (int, float, complex)):
-                            # logging.warning('No data file found for ' + fuel + ' in the zone ' + zone + '. Using default value ' + str(config['default'][fuel]) + ' $')
-                            vals[(zone, fuel)] = [config['default'][fuel]] * len(idx_utc_noloc)
-        elif isinstance(config['default'][fuel], (int, float, complex)):
-            for zone in config['zones']:
-                try:
-                    # logging.warning('No data file found for ' + fuel + ' in the zone ' + zone + '. Using default value ' + str(config['default'][fuel]) + ' $')
-                    if isinstance(FuelPricesPerZone['International'][FuelEntries2[fuel]], (int, float, complex)) and \
-                            FuelPricesPerZone['International'][FuelEntries2[fuel]] > 0:
-                        FuelPricesPerZone['International'][FuelEntries2[fuel]] = FuelPricesPerZone['International'][FuelEntries2[fuel]] * ExportCostMultiplier
-                        vals[(zone, fuel)] = [FuelPricesPerZone['International'][FuelEntries2[fuel]]] * len(idx_utc_noloc)
-                except:
-                    vals[(zone, fuel)] = [config['default'][fuel]] * len(idx_utc_noloc)
-
-        elif fuel == 'PriceOfLignite':
-            logging.warning('No price data found for ' + fuel + ' in the zone ' + zone + '. Using the same value as for Black Coal')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = vals[(zone, 'PriceOfBlackCoal')]
-        elif fuel == 'PriceOfPeat':
-            logging.warning('No price data found for ' + fuel + ' in the zone ' + zone + '. Using the same value as for biomass')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = vals[(zone, 'PriceOfBiomass')]
-        else:
-            logging.warning('No data file or default value found for ' + fuel + ' in the zone ' + zone + '. Assuming zero marginal price!')
-            for zone in config['zones']:
-                vals[(zone, fuel)] = [0] * len(idx_utc_noloc)
-    FuelPrices2 = pd.DataFrame(vals, index=idx_utc_noloc)
 
-    # Interconnections:
-    [Interconnections_sim, Interconnections_RoW, Interconnections] = interconnections(config['zones'], NTC, flows)
+def _load_availability(config, plants, idx, store=''):
+    """
+    Build stage loading and checking the availability factors of the units
+    """
+    AF = UnitBasedTable(plants,config['RenewablesAF'],idx,config['zones'],fallbacks=['Unit','Technology'],tablename='AvailabilityFactors',default=1,RestrictWarning=commons['tech_renewables'],store=store)
+    check_AvailabilityFactors(plants,AF,SkipValidated=config.get('SkipValidated', False))
+    return AF
 
-    if len(Interconnections_sim.columns) > 0:
-        NTCs = Interconnections_sim.reindex(idx_utc_noloc)
-    else:
-        NTCs = pd.DataFrame(index=idx_utc_noloc)
-    Inter_RoW = Interconnections_RoW.reindex(idx_utc_noloc)
 
-    # Clustering of the plants:
+def _load_fuel_prices(config, idx, LocalSubsidyMultiplier=1, ExportCostMultiplier=1, workers=1):
+    """
+    Build stage loading the fuel prices (time series or constant prices per zone). The distinct price files are
+    loaded concurrently by a pool of threads if several workers are available (see load_sources)
+    """
+    paths = [config.get(entry, '') for entry in FUEL_ENTRIES + FUEL_ENTRIES2]
+    paths = sorted(set(path for path in paths if isinstance(path, str) and os.path.isfile(path)))
+    sources = dict((path, (load_price_file, [path, idx], {})) for path in paths)
+    if os.path.isfile(config.get('FuelsPricesPerZone', '')):
+        sources['FuelsPricesPerZone'] = (load_csv, [config['FuelsPricesPerZone']], {'header': 0, 'index_col': 0})
+    files = load_sources(sources, workers)
+    FuelPricesPerZone = files.pop('FuelsPricesPerZone', None)
+    # Local (subsidized) prices for the first set, export prices for the second one. The CO2 price is not zone-specific:
+    ZonePrices, ZoneFound = zone_fuel_prices(FuelPricesPerZone, config['zones'], FUEL_CODES, LocalSubsidyMultiplier, ExportCostMultiplier)
+    ZoneFound[:, :, FUEL_CODES.index('CO2')] = False
+    PriceData, defined, zonal = FuelPriceTable(config, idx, config['zones'], [FUEL_ENTRIES, FUEL_ENTRIES2], ZonePrices, ZoneFound,
+                                            fallbacks={'PriceOfLignite': 'PriceOfBlackCoal', 'PriceOfPeat': 'PriceOfBiomass'},
+                                            files=files)
+    FuelPrices, FuelPrices2 = [pd.DataFrame(PriceData[k].reshape(len(idx), -1), index=idx,
+                                            columns=pd.MultiIndex.from_product([config['zones'], entries])).loc[:, defined[k].ravel()]
+                               for k, entries in enumerate([FUEL_ENTRIES, FUEL_ENTRIES2])]
+    return FuelPricesPerZone, FuelPrices, FuelPrices2, zonal
+
+
+def _cluster_units(config, plants):
+    """
+    Build stage clustering the power plants
+    """
     tc = tm.time()
-    Plants_merged, mapping = clustering(plants, method=config['SimulationType'])
+    # A target number of units per zone and technology or a maximum number of units can be imposed:
+    Plants_merged, mapping = clustering(plants, method=config['SimulationType'],
+                                        Ntarget=config.get('ClusteringTarget') or None,
+                                        MaxBinaries=config.get('MaxBinaries') or None)
     logging.info("Time to cluster power plants: {}s".format(tm.time() - tc))
     # Check clustering:
     check_clustering(plants,Plants_merged)
+    return Plants_merged, mapping
+
+
+def _merge_unit_series(plants, mapping, Outages, AF):
+    """
+    Build stage merging the time series relative to the clustered power plants
+    """
+    #ReservoirScaledInflows_merged = merge_series(plants, ReservoirScaledInflows, mapping, method='WeightedAverage', tablename='ScaledInflows')
+    #ReservoirLevels_merged = merge_series(plants, ReservoirLevels, mapping, tablename='ReservoirLevels')
+    # The capacity-weighted aggregation matrix is common to all the tables:
+    MergeMatrix = merge_matrix(plants, mapping)
+    Outages_merged = merge_series(plants, Outages, mapping, tablename='Outages', matrix=MergeMatrix)
+    #HeatDemand_merged = merge_series(plants, HeatDemand, mapping, tablename='HeatDemand',method='Sum')
+    AF_merged = merge_series(plants, AF, mapping, tablename='AvailabilityFactors', matrix=MergeMatrix)
+    #CostHeatSlack_merged = merge_series(plants, CostHeatSlack, mapping, tablename='CostHeatSlack')
+    return Outages_merged, AF_merged
+
+
+def _build_parameters(config, idx_utc_noloc, inputs, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
+    """
+    Build stage defining the sets and parameters of the simulation from the outputs of the loading, clustering and
+    merging stages. The modifiers of the config are applied in this stage.
 
+    :param inputs:  Dictionary with the outputs of the upstream stages
+    :return:        Sets, parameters, clustered units, fuel prices over the simulation period (with look-ahead) and
+                    network topology
+    """
+    Load, LoadYear, LoadShedding, CostLoadShedding = inputs['demand']
+    NTCs, Inter_RoW, Interconnections = inputs['interconnections']
+    FuelPricesPerZone, FuelPrices, FuelPrices2, zonal = inputs['fuel_prices']
+    Outages_merged, AF_merged = inputs['merging']
+    plants = inputs['units']
+    # The clustered units are modified below and are therefore copied:
+    Plants_merged = inputs['clustering'][0].copy()
+    FuelCodes, FuelEntries, FuelEntries2 = FUEL_CODES, FUEL_ENTRIES, FUEL_ENTRIES2
+
+    PeakLoad = LoadYear.max()
+    if config['modifiers']['Demand'] != 1:
+        logging.info('Scaling load curve by a factor ' + str(config['modifiers']['Demand']))
+        Load = Load * config['modifiers']['Demand']
+        PeakLoad = PeakLoad * config['modifiers']['Demand']
     # Renaming the columns to ease the production of parameters:
     Plants_merged.rename(columns={'StartUpCost': 'CostStartUp',
                                   'RampUpMax': 'RampUpMaximum',
@@ -383,58 +532,53 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
                                   'STOSelfDischarge': 'StorageSelfDischarge',
                                   'CO2Intensity': 'EmissionRate'}, inplace=True)
 
+    # The minimum up and down times must be integers (the decimal part is dropped):
     for key in ['TimeUpMinimum','TimeDownMinimum']:
-        if any([not x.is_integer() for x in Plants_merged[key].fillna(0).values.astype('float')]):
+        values = Plants_merged[key].fillna(0).values.astype('float')
+        if (np.mod(values, 1) != 0).any():
             logging.warning(key + ' in the power plant data has been rounded to the nearest integer value')
-            Plants_merged.loc[:,key] = Plants_merged[key].fillna(0).values.astype('int32')
+            Plants_merged.loc[:,key] = values.astype('int32')
 
     if not len(Plants_merged.index.unique()) == len(Plants_merged):
         # Very unlikely case:
         logging.error('plant indexes not unique!')
         sys.exit(1)
 
-    # Apply scaling factors:
+    # Apply scaling factors (to all the units of the technologies at once):
     if config['modifiers']['Solar'] != 1:
         logging.info('Scaling Solar Capacity by a factor ' + str(config['modifiers']['Solar']))
-        for u in Plants_merged.index:
-            if Plants_merged.Technology[u] == 'PHOT':
-                Plants_merged.loc[u, 'PowerCapacity'] = Plants_merged.loc[u, 'PowerCapacity'] * config['modifiers']['Solar']
+        units = (Plants_merged['Technology'] == 'PHOT').values
+        Plants_merged.loc[units, 'PowerCapacity'] = Plants_merged.loc[units, 'PowerCapacity'] * config['modifiers']['Solar']
     if config['modifiers']['Wind'] != 1:
         logging.info('Scaling Wind Capacity by a factor ' + str(config['modifiers']['Wind']))
-        for u in Plants_merged.index:
-            if Plants_merged.Technology[u] == 'WTON' or Plants_merged.Technology[u] == 'WTOF':
-                Plants_merged.loc[u, 'PowerCapacity'] = Plants_merged.loc[u, 'PowerCapacity'] * config['modifiers']['Wind']
+        units = Plants_merged['Technology'].isin(['WTON', 'WTOF']).values
+        Plants_merged.loc[units, 'PowerCapacity'] = Plants_merged.loc[units, 'PowerCapacity'] * config['modifiers']['Wind']
     if config['modifiers']['Storage'] != 1:
         logging.info('Scaling Storage Power and Capacity by a factor ' + str(config['modifiers']['Storage']))
-        for u in Plants_merged.index:
-            if isStorage(Plants_merged.Technology[u]):
-                Plants_merged.loc[u, 'PowerCapacity'] = Plants_merged.loc[u, 'PowerCapacity'] * config['modifiers']['Storage']
-                Plants_merged.loc[u, 'StorageCapacity'] = Plants_merged.loc[u, 'StorageCapacity'] * config['modifiers']['Storage']
-                Plants_merged.loc[u, 'StorageChargingCapacity'] = Plants_merged.loc[u, 'StorageChargingCapacity'] * config['modifiers']['Storage']
+        units = isStorage(Plants_merged['Technology'])
+        for key in ['PowerCapacity', 'StorageCapacity', 'StorageChargingCapacity']:
+            Plants_merged.loc[units, key] = Plants_merged.loc[units, key] * config['modifiers']['Storage']
 
     # Defining the hydro storages:
-    Plants_sto = Plants_merged[[u in commons['tech_storage'] for u in Plants_merged['Technology']]]
+    Plants_sto = Plants_merged[Plants_merged['Technology'].isin(commons['tech_storage']).values]
     # check storage plants:
     #check_sto(config, Plants_sto,raw_data=False)
     # Defining the CHPs:
-    Plants_chp = Plants_merged[[x.lower() in commons['types_CHP'] for x in Plants_merged['CHPType']]].copy()
+    CHPType = Plants_merged['CHPType'].astype(str).str.lower()
+    chp = CHPType.isin(commons['types_CHP']).values
+    Plants_chp = Plants_merged[chp].copy()
     # check chp plants:
     #check_chp(config, Plants_chp)
     # For all the chp plants correct the PowerCapacity, which is defined in cogeneration mode in the inputs and in power generation model in the optimization model
-    for u in Plants_chp.index:
-        PowerCapacity = Plants_chp.loc[u, 'PowerCapacity']
-
-        if Plants_chp.loc[u,'CHPType'].lower() == 'p2h':
-            PurePowerCapacity = PowerCapacity
-        else:
-            if pd.isnull(Plants_chp.loc[u,'CHPMaxHeat']):  # If maximum heat is not defined, then it is defined as the intersection between two lines
-                MaxHeat = PowerCapacity / Plants_chp.loc[u,'CHPPowerToHeat']
-                Plants_chp.loc[u, 'CHPMaxHeat'] = 'inf'
-            else:
-                MaxHeat = Plants_chp.loc[u, 'CHPMaxHeat']
-            PurePowerCapacity = PowerCapacity + Plants_chp.loc[u,'CHPPowerLossFactor'] * MaxHeat
-        Plants_merged.loc[u,'PartLoadMin'] = Plants_merged.loc[u,'PartLoadMin'] * PowerCapacity / PurePowerCapacity  # FIXME: Is this correct?
-        Plants_merged.loc[u,'PowerCapacity'] = PurePowerCapacity
+    PowerCapacity = Plants_chp['PowerCapacity']
+    # If maximum heat is not defined, then it is defined as the intersection between two lines:
+    nomax = (pd.isnull(Plants_chp['CHPMaxHeat']) & (CHPType[chp] != 'p2h')).values
+    MaxHeat = Plants_chp['CHPMaxHeat'].where(~nomax, PowerCapacity / Plants_chp['CHPPowerToHeat'])
+    if nomax.any():
+        Plants_chp.loc[nomax, 'CHPMaxHeat'] = 'inf'
+    PurePowerCapacity = PowerCapacity.where((CHPType[chp] == 'p2h').values, PowerCapacity + Plants_chp['CHPPowerLossFactor'] * MaxHeat)
+    Plants_merged.loc[chp, 'PartLoadMin'] = Plants_chp['PartLoadMin'] * PowerCapacity / PurePowerCapacity  # FIXME: Is this correct?
+    Plants_merged.loc[chp, 'PowerCapacity'] = PurePowerCapacity
 
     # Get the hydro time series corresponding to the original plant list: #FIXME Unused variable ?
     #StorageFormerIndexes = [s for s in plants.index if
@@ -455,63 +599,27 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
             logging.warning('No heat cost profile found for CHP plant "' + str(oldname) + '". Assuming zero')
             CostHeatSlack[oldname] = 0
 
-
-    # merge the outages:
-    for i in plants.index:  # for all the old plant indexes
-        # get the old plant name corresponding to s:
-        oldname = plants['Unit'][i]
-        newname = mapping['NewIndex'][i]
-
-    # Merging the time series relative to the clustered power plants:
-    #ReservoirScaledInflows_merged = merge_series(plants, ReservoirScaledInflows, mapping, method='WeightedAverage', tablename='ScaledInflows')
-    #ReservoirLevels_merged = merge_series(plants, ReservoirLevels, mapping, tablename='ReservoirLevels')
-    Outages_merged = merge_series(plants, Outages, mapping, tablename='Outages')
-    #HeatDemand_merged = merge_series(plants, HeatDemand, mapping, tablename='HeatDemand',method='Sum')
-    AF_merged = merge_series(plants, AF, mapping, tablename='AvailabilityFactors')
-    #CostHeatSlack_merged = merge_series(plants, CostHeatSlack, mapping, tablename='CostHeatSlack')
-
-
-    # %%
-    # checking data
-    check_df(Load, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='Load')
-    check_df(AF_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1],
-             name='AF_merged')
-    check_df(Outages_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='Outages_merged')
-    check_df(Inter_RoW, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='Inter_RoW')
-    check_df(FuelPrices, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='FuelPrices')
-    check_df(FuelPrices2, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='FuelPrices2')
-    check_df(NTCs, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='NTCs')
-    #check_df(ReservoirLevels_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='ReservoirLevels_merged')
-    #check_df(ReservoirScaledInflows_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='ReservoirScaledInflows_merged')
-    #check_df(HeatDemand_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='HeatDemand_merged')
-    #check_df(CostHeatSlack_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='CostHeatSlack_merged')
-    #check_df(LoadShedding, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='LoadShedding')
-    #check_df(CostLoadShedding, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='CostLoadShedding')
-
-#    for key in Renewables:
-#        check_df(Renewables[key], StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1],
-#                 name='Renewables["' + key + '"]')
-
-    # %%%
-
     # Extending the data to include the look-ahead period (with constant values assumed)
     enddate_long = idx_utc_noloc[-1] + dt.timedelta(days=config['LookAhead'])
     idx_long = pd.DatetimeIndex(pd.date_range(start=idx_utc_noloc[0], end=enddate_long, freq=commons['TimeStep']))
     Nhours_long = len(idx_long)
 
-    # re-indexing with the longer index and filling possibly missing data at the beginning and at the end::
-    Load = Load.reindex(idx_long, method='nearest').fillna(method='bfill')
-    AF_merged = AF_merged.reindex(idx_long, method='nearest').fillna(method='bfill')
-    Inter_RoW = Inter_RoW.reindex(idx_long, method='nearest').fillna(method='bfill')
-    NTCs = NTCs.reindex(idx_long, method='nearest').fillna(method='bfill')
-    FuelPrices = FuelPrices.reindex(idx_long, method='nearest').fillna(method='bfill')
-    FuelPrices2 = FuelPrices2.reindex(idx_long, method='nearest').fillna(method='bfill')
-    Load = Load.reindex(idx_long, method='nearest').fillna(method='bfill')
-    Outages_merged = Outages_merged.reindex(idx_long, method='nearest').fillna(method='bfill')
+    # checking data and re-indexing with the longer index, filling possibly missing data at the beginning and at the end:
+    aligned = align_time_series({'Load': Load, 'AF_merged': AF_merged, 'Outages_merged': Outages_merged,
+                                 'Inter_RoW': Inter_RoW, 'FuelPrices': FuelPrices, 'FuelPrices2': FuelPrices2,
+                                 'NTCs': NTCs, 'LoadShedding': LoadShedding, 'CostLoadShedding': CostLoadShedding},
+                                idx_long, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1],
+                                check=['Load', 'AF_merged', 'Outages_merged', 'Inter_RoW', 'FuelPrices', 'FuelPrices2', 'NTCs'])
+    Load, AF_merged, Outages_merged = aligned['Load'], aligned['AF_merged'], aligned['Outages_merged']
+    Inter_RoW, NTCs = aligned['Inter_RoW'], aligned['NTCs']
+    FuelPrices, FuelPrices2 = aligned['FuelPrices'], aligned['FuelPrices2']
+    LoadShedding, CostLoadShedding = aligned['LoadShedding'], aligned['CostLoadShedding']
     #ReservoirLevels_merged = ReservoirLevels_merged.reindex(idx_long, method='nearest').fillna(method='bfill')
     #ReservoirScaledInflows_merged = ReservoirScaledInflows_merged.reindex(idx_long, method='nearest').fillna(method='bfill')
-    LoadShedding = LoadShedding.reindex(idx_long, method='nearest').fillna(method='bfill')
-    CostLoadShedding = CostLoadShedding.reindex(idx_long, method='nearest').fillna(method='bfill')
+    #check_df(ReservoirLevels_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='ReservoirLevels_merged')
+    #check_df(ReservoirScaledInflows_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='ReservoirScaledInflows_merged')
+    #check_df(HeatDemand_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='HeatDemand_merged')
+    #check_df(CostHeatSlack_merged, StartDate=idx_utc_noloc[0], StopDate=idx_utc_noloc[-1], name='CostHeatSlack_merged')
 #    for tr in Renewables:
 #        Renewables[tr] = Renewables[tr].reindex(idx_long, method='nearest').fillna(method='bfill')
 
@@ -709,47 +817,9 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
 
     # %%#################################################################################################################################################################################################
     # Variable Cost
-    # Equivalence dictionary between fuel types and price entries in the config sheet:
-    FuelEntries = {'BIO':'PriceOfBiomass', 'GAS':'PriceOfGas', 'HRD':'PriceOfBlackCoal', 'LIG':'PriceOfLignite', 'NUC':'PriceOfNuclear', 'OIL':'PriceOfCrudeOil', 'PEA':'PriceOfPeat', 'DSL':'PriceOfDiesel', 'HFO':'PriceOfHFO', 'MSW':'PriceOfMunicipalSolidWaste', 'LFG':'PriceOfLandFillGas'}
-    for unit in range(Nunits):
-        found = False
-        zone = Plants_merged['Zone'][unit]
-        if zone in config['zones']:
-            for FuelEntry in FuelEntries:
-                if Plants_merged['Fuel'][unit] == FuelEntry:
-                    parameters['CostVariable']['val'][unit, :] = FuelPrices[zone][FuelEntries[FuelEntry]] / Plants_merged['Efficiency'][unit] + \
-                                                                 Plants_merged['EmissionRate'][unit] * FuelPrices[zone]['PriceOfCO2']
-                    found = True
-            # Special case for biomass plants, which are not included in EU ETS:
-            if Plants_merged['Fuel'][unit] == 'BIO':
-                parameters['CostVariable']['val'][unit, :] = FuelPrices[zone]['PriceOfBiomass'] / Plants_merged['Efficiency'][
-                    unit]
-                found = True
-            if not found:
-                #logging.warning('No fuel price value has been found for fuel ' + Plants_merged['Fuel'][unit] + ' in unit ' + \
-                #             Plants_merged['Unit'][unit] + '. A null variable cost has been assigned')
-                pass
-
-    # Alternative Variable Cost
-    FuelEntries2 = {'BIO':'PriceOfBiomass 2', 'GAS':'PriceOfGas 2', 'HRD':'PriceOfBlackCoal 2', 'LIG':'PriceOfLignite 2', 'NUC':'PriceOfNuclear 2', 'OIL':'PriceOfCrudeOil 2', 'PEA':'PriceOfPeat 2', 'DSL':'PriceOfDiesel 2', 'HFO':'PriceOfHFO 2', 'MSW':'PriceOfMunicipalSolidWaste 2', 'LFG':'PriceOfLandFillGas 2'}
-    for unit in range(Nunits):
-        found = False
-        zone = Plants_merged['Zone'][unit]
-        if zone in config['zones']:
-            for FuelEntry in FuelEntries2:
-                if Plants_merged['Fuel'][unit] == FuelEntry:
-                    parameters['CostVariableB']['val'][unit, :] = FuelPrices2[zone][FuelEntries2[FuelEntry]] / Plants_merged['Efficiency'][unit] + \
-                                                                 Plants_merged['EmissionRate'][unit] * FuelPrices2[zone]['PriceOfCO2 2']
-                    found = True
-            # Special case for biomass plants, which are not included in EU ETS:
-            if Plants_merged['Fuel'][unit] == 'BIO':
-                parameters['CostVariableB']['val'][unit, :] = FuelPrices2[zone]['PriceOfBiomass 2'] / Plants_merged['Efficiency'][
-                    unit]
-                found = True
-            if not found:
-                #logging.warning('No fuel price value has been found for fuel ' + Plants_merged['Fuel'][unit] + ' in unit ' + \
-                #             Plants_merged['Unit'][unit] + '. A null variable cost has been assigned')
-                pass
+    prices = np.stack([fuel_price_array(FuelPrices, config['zones'], FuelEntries),
+                       fuel_price_array(FuelPrices2, config['zones'], FuelEntries2)])
+    parameters['CostVariable']['val'], parameters['CostVariableB']['val'] = variable_costs(Plants_merged, config['zones'], prices, FuelCodes)
 
     # %%#################################################################################################################################################################################################
 
@@ -763,7 +833,8 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
     # Check values:
     check_MinMaxFlows(parameters['FlowMinimum']['val'],parameters['FlowMaximum']['val'])
 
-    parameters['LineNode'] = incidence_matrix(sets, 'l', parameters, 'LineNode')
+    topology = network_topology(sets['l'], sets['n'])
+    parameters['LineNode'] = incidence_matrix(sets, 'l', parameters, 'LineNode', topology)
 
     # Outage Factors
     if len(Outages_merged.columns) != 0:
@@ -836,157 +907,11 @@ def build_simulation(config, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
 
     sets['FuelPriceTypes'] = ['International', 'Subsidized']
 
-    values = np.zeros([len(a) for a in [sets['n'],sets['f'],sets['FuelPriceTypes']]])
-    for i, zone in enumerate(sets['n']):
-        for j, fuel in enumerate(sets['f']):
-            for typ in sets['FuelPriceTypes']:
-                try:
-                    if typ == 'International' and isinstance(FuelPricesPerZone['International'][fuel], (int, float, complex)):
-                        values[i][j][0] = FuelPricesPerZone['International'][fuel]
-                    elif typ == 'Subsidized' and isinstance(FuelPricesPerZone[zone][fuel], (int, float, complex)):
-                        values[i][j][1] = FuelPricesPerZone[zone][fuel]
-                except:
-                    pass
-
+    values = fuel_price_per_zone(FuelPricesPerZone, sets['n'], sets['f'], zonal, FuelCodes, LocalSubsidyMultiplier, ExportCostMultiplier)
     parameters['FuelPricePerZone'] = {'sets': ['n', 'f','FuelPriceTypes'], 'val': values}
 
-    # %%#################################################################################################################
-    ######################################   Simulation Environment     ################################################
-    ####################################################################################################################
-
-    # Output folder:
-    sim = config['SimulationDirectory']
-
-    # Simulation data:
-    SimData = {'sets': sets, 'parameters': parameters, 'config': config, 'units': Plants_merged, 'version': dispa_version}
-
-    # list_vars = []
-    gdx_out = "Inputs.gdx"
-    if config['WriteGDX']:
-        write_variables(config['GAMS_folder'], gdx_out, [sets, parameters])
-
-    # if the sim variable was not defined:
-    if 'sim' not in locals():
-        logging.error('Please provide a path where to store the DispaSET inputs (in the "sim" variable)')
-        sys.exit(1)
+    return sets, parameters, Plants_merged, FuelPrices, FuelPrices2, topology
 
-    if not os.path.exists(sim):
-        os.makedirs(sim)
-
-    #Choose what GAMS code to use based on specified GAMS code in the parameter ( config['GAMS_ModelCode'] )
-    if config['GAMS_ModelCode'] == 'Standard':
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-    if config['GAMS_ModelCode'] == 'Standard_2':
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h_V2.0.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h_V2.0.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-    elif config['GAMS_ModelCode'] == 'GCC_virtual_connections':
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h_GCC_virtual_connections.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h_GCC_virtual_connections.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-    elif config['GAMS_ModelCode'] == 'GCC_substation_nodes':
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h_GCC.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h_GCC.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-    elif config['GAMS_ModelCode'] == 'GCC_isolated':
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h_GCC.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h_GCC.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-    else:
-        if LP:
-            fin = open(os.path.join(GMS_FOLDER, 'UCM_h.gms'))
-            fout = open(os.path.join(sim,'UCM_h.gms'), "wt")
-            for line in fin:
-                fout.write(line.replace('$setglobal LPFormulation 0', '$setglobal LPFormulation 1'))
-            fin.close()
-            fout.close()
-        else:
-            shutil.copyfile(os.path.join(GMS_FOLDER, 'UCM_h.gms'),
-                            os.path.join(sim, 'UCM_h.gms'))
-
-    gmsfile = open(os.path.join(sim, 'UCM.gpr'), 'w')
-    gmsfile.write(
-        '[PROJECT] \n \n[RP:UCM_H] \n1= \n[OPENWINDOW_1] \nFILE0=UCM_h.gms \nFILE1=UCM_h.gms \nMAXIM=1 \nTOP=50 \nLEFT=50 \nHEIGHT=400 \nWIDTH=400')
-    gmsfile.close()
-    shutil.copyfile(os.path.join(GMS_FOLDER, 'writeresults.gms'),
-                    os.path.join(sim, 'writeresults.gms'))
-    # Create cplex option file
-    cplex_options = {'epgap': 0.05, # TODO: For the moment hardcoded, it has to be moved to a config file
-                     'numericalemphasis': 0,
-                     'scaind': 1,
-                     'lpmethod': 0,
-                     'relaxfixedinfeas': 0,
-                     'mipstart':1,
-                     'epint':0}
-
-    lines_to_write = ['{} {}'.format(k, v) for k, v in cplex_options.items()]
-    with open(os.path.join(sim, 'cplex.opt'), 'w') as f:
-        for line in lines_to_write:
-            f.write(line + '\n')
-
-    logging.debug('Using gams file from ' + GMS_FOLDER)
-    if config['WriteGDX']:
-        shutil.copy(gdx_out, sim + '/')
-        os.remove(gdx_out)
-    # Copy bat file to generate gdx file directly from excel:
-    shutil.copy(os.path.join(GMS_FOLDER, 'makeGDX.bat'),
-                os.path.join(sim, 'makeGDX.bat'))
-
-    if config['WriteExcel']:
-        write_to_excel(sim, [sets, parameters])
-
-    if config['WritePickle']:
-        try:
-            import cPickle as pickle
-        except ImportError:
-            import pickle
-        with open(os.path.join(sim, 'Inputs.p'), 'wb') as pfile:
-            pickle.dump(SimData, pfile, protocol=pickle.HIGHEST_PROTOCOL)
-
-    logging.info('Build finished')
-
-    if os.path.isfile(commons['logfile']):
-        shutil.copy(commons['logfile'], os.path.join(sim, 'warn_preprocessing.log'))
-
-
-    return SimData, FuelPrices, FuelPrices2
 
 def adjust_capacity(inputs,tech_fuel,scaling=1,value=None,singleunit=False,write_gdx=False,dest_path=''):
     '''
@@ -1064,12 +989,11 @@ def adjust_capacity(inputs,tech_fuel,scaling=1,value=None,singleunit=False,write
             shutil.copytree(path,dest_path)
             logging.info('Created simulation environment directory ' + dest_path)
         logging.info('Writing input files to ' + dest_path)
-        with open(os.path.join(dest_path, 'Inputs.p'), 'wb') as pfile:
-            pickle.dump(SimData, pfile, protocol=pickle.HIGHEST_PROTOCOL)
+        _write_atomic(os.path.join(dest_path, 'Inputs.p'), lambda tmp: _write_pickle(tmp, SimData))
         if write_gdx:
-            write_variables(SimData['config']['GAMS_folder'], 'Inputs.gdx', [SimData['sets'], SimData['parameters']])
-            shutil.copy('Inputs.gdx', dest_path + '/')
-            os.remove('Inputs.gdx')
+            _write_atomic(os.path.join(dest_path, 'Inputs.gdx'), lambda tmp: write_variables(
+                SimData['config']['GAMS_folder'], tmp, [SimData['sets'], SimData['parameters']],
+                bool(SimData['config'].get('CompressGDX'))))
     return SimData
 
 
@@ -1129,15 +1053,102 @@ def adjust_storage(inputs,tech_fuel,scaling=1,value=None,write_gdx=False,dest_pa
             shutil.copytree(path,dest_path)
             logging.info('Created simulation environment directory ' + dest_path)
         logging.info('Writing input files to ' + dest_path)
-        import cPickle
-        with open(os.path.join(dest_path, 'Inputs.p'), 'wb') as pfile:
-            cPickle.dump(SimData, pfile, protocol=cPickle.HIGHEST_PROTOCOL)
+        _write_atomic(os.path.join(dest_path, 'Inputs.p'), lambda tmp: _write_pickle(tmp, SimData))
         if write_gdx:
-            write_variables(SimData['config']['GAMS_folder'], 'Inputs.gdx', [SimData['sets'], SimData['parameters']])
-            shutil.copy('Inputs.gdx', dest_path + '/')
-            os.remove('Inputs.gdx')
+            _write_atomic(os.path.join(dest_path, 'Inputs.gdx'), lambda tmp: write_variables(
+                SimData['config']['GAMS_folder'], tmp, [SimData['sets'], SimData['parameters']],
+                bool(SimData['config'].get('CompressGDX'))))
     return SimData
 
 
+def adjust_fuel_prices(inputs, FuelPrices, FuelPrices2, multipliers, FuelPricesPerZone=None, write_gdx=False, dest_path=''):
+    '''
+    Function used to re-derive the fuel price dependent parameters (CostVariable, CostVariableB and FuelPricePerZone)
+    for one or several values of the local subsidy and export cost multipliers, without rebuilding the simulation.
+    Only the prices taken from the FuelsPricesPerZone table depend on the multipliers, all other prices are taken from
+    the FuelPrices and FuelPrices2 dataframes returned by build_simulation.
+
+    :param inputs:              Input data dictionary OR path to the simulation directory containing Inputs.p
+    :param FuelPrices:          Fuel prices returned by build_simulation
+    :param FuelPrices2:         Alternative fuel prices returned by build_simulation
+    :param multipliers:         Tuple (LocalSubsidyMultiplier, ExportCostMultiplier) or list of such tuples
+    :param FuelPricesPerZone:   Dataframe with the fuel prices per zone. If unspecified, it is loaded from the config
+    :param write_gdx:           boolean defining if Inputs.gdx should be also overwritten with the new data
+    :param dest_path:           Simulation environment path to write the new input data. If several multiplier pairs
+                                are provided, one sub-directory is written per pair. If unspecified, no data is written!
+    :return:                    Dictionary with the re-derived parameters for each multiplier pair. The input data
+                                dictionary is not modified (the written Inputs.p files contain a copy of it with the
+                                re-derived parameters)
+    '''
+    import pickle
 
+    if isinstance(inputs,str):
+        path = inputs
+        inputfile = path + '/Inputs.p'
+        if not os.path.exists(path):
+            sys.exit('Path + "' + path + '" not found')
+        with open(inputfile, 'rb') as f:
+            SimData = pickle.load(f)
+    elif isinstance(inputs,dict):
+        SimData = inputs
+        path = SimData['config']['SimulationDirectory']
+    else:
+        logging.error('The input data must be either a dictionary or string containing a valid directory')
+        sys.exit(1)
+    if 'fuel_prices' not in SimData:
+        logging.error('The input data does not contain the fuel price information. Please rebuild the simulation')
+        sys.exit(1)
 
+    # The re-derived parameters are written in a copy of the input data:
+    SimData = dict(SimData)
+    SimData['parameters'] = dict(SimData['parameters'])
+    for p in ['CostVariable', 'CostVariableB', 'FuelPricePerZone']:
+        SimData['parameters'][p] = dict(SimData['parameters'][p])
+
+    if isinstance(multipliers, tuple):
+        multipliers = [multipliers]
+    if FuelPricesPerZone is None and os.path.isfile(SimData['config'].get('FuelsPricesPerZone', '')):
+        FuelPricesPerZone = load_csv(SimData['config']['FuelsPricesPerZone'], header=0, index_col=0)
+
+    zones = SimData['sets']['n']
+    codes = SimData['fuel_prices']['codes']
+    zonal = SimData['fuel_prices']['zonal']
+    entries = SimData['fuel_prices']['entries']
+    # The prices that do not depend on the multipliers are only gathered once:
+    prices = np.stack([fuel_price_array(FuelPrices, zones, entries[0]), fuel_price_array(FuelPrices2, zones, entries[1])])
+    slots = np.nonzero(zonal)
+
+    results = {}
+    for LocalSubsidyMultiplier, ExportCostMultiplier in multipliers:
+        ZonePrices, _ = zone_fuel_prices(FuelPricesPerZone, zones, codes, LocalSubsidyMultiplier, ExportCostMultiplier)
+        prices[slots[0], :, slots[1], slots[2]] = ZonePrices[slots][:, np.newaxis]
+        CostVariable, CostVariableB = variable_costs(SimData['units'], zones, prices, codes)
+        FuelPricePerZone = fuel_price_per_zone(FuelPricesPerZone, zones, SimData['sets']['f'], zonal, codes,
+                                               LocalSubsidyMultiplier, ExportCostMultiplier)
+        results[(LocalSubsidyMultiplier, ExportCostMultiplier)] = {'CostVariable': CostVariable, 'CostVariableB': CostVariableB,
+                                                                   'FuelPricePerZone': FuelPricePerZone}
+        SimData['parameters']['CostVariable']['val'] = CostVariable
+        SimData['parameters']['CostVariableB']['val'] = CostVariableB
+        SimData['parameters']['FuelPricePerZone']['val'] = FuelPricePerZone
+        logging.info('Fuel prices re-derived for LocalSubsidyMultiplier = ' + str(LocalSubsidyMultiplier) +
+                     ' and ExportCostMultiplier = ' + str(ExportCostMultiplier))
+
+        if dest_path == '':
+            continue
+        if len(multipliers) > 1:
+            dest = os.path.join(dest_path, 'LSM' + str(LocalSubsidyMultiplier) + '_ECM' + str(ExportCostMultiplier))
+        else:
+            dest = dest_path
+        if not os.path.isdir(dest):
+            # The directories written for the other multiplier pairs are not copied (dest_path may contain path):
+            shutil.copytree(path, dest, ignore=shutil.ignore_patterns('LSM*_ECM*'))
+            logging.info('Created simulation environment directory ' + dest)
+        logging.info('Writing input files to ' + dest)
+        _write_atomic(os.path.join(dest, 'Inputs.p'), lambda tmp: _write_pickle(tmp, SimData))
+        if write_gdx:
+            _write_atomic(os.path.join(dest, 'Inputs.gdx'), lambda tmp: write_variables(
+                SimData['config']['GAMS_folder'], tmp, [SimData['sets'], SimData['parameters']],
+                bool(SimData['config'].get('CompressGDX'))))
+    if dest_path == '':
+        logging.info('Not writing any input data to the disk')
+    return results
@@ -11,33 +11,174 @@ import sys
 
 import numpy as np
 import pandas as pd
+from scipy.spatial.distance import cdist
 
 from ..misc.str_handler import clean_strings, shrink_to_64
+from ..misc.topology import ROW, network_topology
 
 
-def incidence_matrix(sets, set_used, parameters, param_used):
+def incidence_matrix(sets, set_used, parameters, param_used, topology=None):
     """
     This function generates the incidence matrix of the lines within the nodes
     A particular case is considered for the node "Rest Of the World", which is no explicitely defined in DispaSET
-    """
 
-    for i in range(len(sets[set_used])):
-        [from_node, to_node] = sets[set_used][i].split('->')
-        if (from_node.strip() in sets['n']) and (to_node.strip() in sets['n']):
-            parameters[param_used]['val'][i, sets['n'].index(to_node.strip())] = 1
-            parameters[param_used]['val'][i, sets['n'].index(from_node.strip())] = -1
-        elif (from_node.strip() == 'RoW') and (to_node.strip() in sets['n']):
-            parameters[param_used]['val'][i, sets['n'].index(to_node.strip())] = 1
-        elif (from_node.strip() in sets['n']) and (to_node.strip() == 'RoW'):
-            parameters[param_used]['val'][i, sets['n'].index(from_node.strip())] = -1
-        else:
-            logging.error('The format of the interconnection is not valid.')
-            logging.warning("The line " + str(sets[set_used][i]) + " contains unrecognized nodes")
-            sys.exit(1)
+    :param topology:    Network topology of the lines in sets[set_used] (see network_topology). Built if not provided
+    """
+    if topology is None:
+        topology = network_topology(sets[set_used], sets['n'])
+    from_ok = topology['from_idx'] >= 0
+    to_ok = topology['to_idx'] >= 0
+    from_row = np.array([n == ROW for n in topology['from']], dtype=bool)
+    to_row = np.array([n == ROW for n in topology['to']], dtype=bool)
+    valid = (from_ok & to_ok) | (from_row & to_ok) | (from_ok & to_row)
+    if not valid.all():
+        logging.error('The format of the interconnection is not valid.')
+        logging.warning("The line " + str(sets[set_used][np.where(~valid)[0][0]]) + " contains unrecognized nodes")
+        sys.exit(1)
+    parameters[param_used]['val'][:, :] = topology['incidence'].toarray()
 
     return parameters[param_used]
 
 
+def fuel_price_array(FuelPrices, zones, entries):
+    """
+    Gathers the fuel price time series stored in a dataframe with (zone, price entry) headers into a
+    (time x zone x fuel) array. The columns that are not present in the dataframe are filled with NaN.
+
+    :param FuelPrices:  Dataframe with the fuel prices and a (zone, price entry) multi-index header
+    :param zones:       List of zones
+    :param entries:     List with the price entries (e.g. 'PriceOfGas') in the order of the fuel axis
+    :returns:           Numpy array (time x zone x fuel)
+    """
+    columns = pd.MultiIndex.from_product([zones, entries])
+    if len(FuelPrices.columns) > 0:
+        pos = FuelPrices.columns.get_indexer(columns)
+    else:
+        pos = -np.ones(len(columns), dtype='int')
+    values = np.full([len(FuelPrices), len(columns)], np.nan)
+    values[:, pos >= 0] = FuelPrices.values[:, pos[pos >= 0]]
+    return values.reshape(len(FuelPrices), len(zones), len(entries))
+
+
+def zone_fuel_prices(FuelPricesPerZone, zones, fuels, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
+    """
+    Computes the constant fuel prices defined in the FuelsPricesPerZone table (fuels as rows, zones and 'International'
+    as columns) for the two price sets:
+        - Set 0 (local price): International - (International - Local) * LocalSubsidyMultiplier
+        - Set 1 (export price): International * ExportCostMultiplier
+    Only strictly positive prices are applied.
+
+    :param FuelPricesPerZone:       Dataframe with the fuel prices per zone (or None if not provided)
+    :param zones:                   List of zones
+    :param fuels:                   List of fuel codes (e.g. 'GAS')
+    :param LocalSubsidyMultiplier:  Multiplier of the government subsidy (difference between international and local price)
+    :param ExportCostMultiplier:    Multiplier of the international price
+    :returns prices, found:         Arrays (set x zone x fuel) with the prices (NaN if they do not apply) and a boolean
+                                    flag indicating if the table defines a value (otherwise the default value is used)
+    """
+    prices = np.full([2, len(zones), len(fuels)], np.nan)
+    found = np.zeros(prices.shape, dtype='bool')
+    if FuelPricesPerZone is None:
+        return prices, found
+    has_fuel = np.isin(fuels, FuelPricesPerZone.index)
+    has_zone = np.isin(zones, FuelPricesPerZone.columns)
+    has_intl = 'International' in FuelPricesPerZone.columns
+    table = FuelPricesPerZone.apply(pd.to_numeric, errors='coerce')
+    table = table.reindex(index=fuels, columns=list(zones) + ['International'])
+    local = table[list(zones)].values.T.astype('float')
+    intl = table['International'].values.astype('float')
+
+    with np.errstate(invalid='ignore'):
+        valid = local > 0
+        found[0] = has_zone[:, np.newaxis] & has_fuel & (~valid | has_intl)
+        prices[0] = np.where(valid & found[0], intl - (intl - local) * LocalSubsidyMultiplier, np.nan)
+        found[1] = has_fuel & has_intl
+        prices[1] = np.where(intl > 0, intl * ExportCostMultiplier, np.nan)
+    prices[1][~found[1]] = np.nan
+    return prices, found
+
+
+def fuel_price_per_zone(FuelPricesPerZone, zones, fuels, zonal, codes, LocalSubsidyMultiplier=1, ExportCostMultiplier=1):
+    """
+    Builds the values of the FuelPricePerZone parameter (zone x fuel x ['International', 'Subsidized']).
+    The prices of the FuelsPricesPerZone table are used, with the multipliers applied to the prices that
+    have actually been used in the price time series (zonal flags).
+
+    :param FuelPricesPerZone:       Dataframe with the fuel prices per zone (or None if not provided)
+    :param zones:                   List of zones
+    :param fuels:                   List of fuel codes of the parameter
+    :param zonal:                   Boolean array (set x zone x code) flagging the prices taken from the table
+    :param codes:                   List of the fuel codes of the zonal array
+    :returns:                       Numpy array (zone x fuel x 2)
+    """
+    values = np.zeros([len(zones), len(fuels), 2])
+    if FuelPricesPerZone is None:
+        return values
+    table = FuelPricesPerZone.apply(pd.to_numeric, errors='coerce')
+    table = table.reindex(index=fuels, columns=list(zones) + ['International']).fillna(0)
+    values[:, :, 0] = table['International'].values
+    values[:, :, 1] = table[list(zones)].values.T
+    prices, found = zone_fuel_prices(FuelPricesPerZone, zones, fuels, LocalSubsidyMultiplier, ExportCostMultiplier)
+    for c, code in enumerate(codes):
+        if code in fuels:
+            j = fuels.index(code)
+            values[zonal[0, :, c], j, 1] = prices[0, zonal[0, :, c], j]
+            if zonal[1, :, c].any():
+                values[:, j, 0] = prices[1, 0, j]
+    return values
+
+
+def variable_costs(plants, zones, prices, fuels, NoEmission=('BIO',)):
+    """
+    Vectorized computation of the variable cost of each unit at each time step, for one or several sets of fuel
+    prices: fuel price / efficiency + emission rate * CO2 price.
+    A (unit x fuel) gather index is built once and applied to all the price sets in a single pass.
+    Units located outside the simulated zones or whose fuel has no price entry get a null variable cost.
+
+    :param plants:      Dataframe with the units (Zone, Fuel, Efficiency and EmissionRate columns)
+    :param zones:       List of the simulated zones
+    :param prices:      Array (time x zone x fuel) or (set x time x zone x fuel) with the fuel prices
+    :param fuels:       List with the fuel codes of the last axis of prices. The CO2 price has the code 'CO2'
+    :param NoEmission:  Fuels whose emissions are not priced (biomass plants are not included in EU ETS)
+    :returns:           Array (unit x time), or (set x unit x time) if several price sets are provided
+    """
+    prices = np.asarray(prices, dtype='float')
+    single = prices.ndim == 3
+    if single:
+        prices = prices[np.newaxis]
+    Nsets, Nsteps = prices.shape[0], prices.shape[1]
+    out = np.zeros([Nsets, len(plants), Nsteps])
+
+    # Gather index: position of the zone and of the fuel of each unit in the price array
+    fuels = list(fuels)
+    co2 = fuels.index('CO2')
+    zone_idx = pd.Index(zones).get_indexer(plants['Zone'])
+    fuel_idx = pd.Index(fuels).get_indexer(plants['Fuel'])
+    priced = (zone_idx >= 0) & (fuel_idx >= 0) & (fuel_idx != co2)
+    if not priced.any():
+        return out[0] if single else out
+    zone_idx, fuel_idx = zone_idx[priced], fuel_idx[priced]
+
+    FuelPrice = prices[:, :, zone_idx, fuel_idx]            # set x time x unit
+    missing = np.isnan(FuelPrice).all(axis=1).any(axis=0)
+    if missing.any():
+        pairs = sorted(set(zip(np.array(zones)[zone_idx[missing]], np.array(fuels)[fuel_idx[missing]])))
+        logging.error('No fuel price could be found for the following (zone, fuel) pairs, although they are used by some units: ' + str(pairs))
+        sys.exit(1)
+
+    costs = FuelPrice / plants['Efficiency'].values[priced].astype('float')
+    taxed = ~plants['Fuel'].isin(NoEmission).values[priced]
+    missing = np.isnan(prices[:, :, zone_idx[taxed], co2]).all(axis=1).any(axis=0)
+    if missing.any():
+        logging.error('No CO2 price could be found for the following zones, although they contain units with priced '
+                      'emissions: ' + str(sorted(set(np.array(zones)[zone_idx[taxed][missing]]))))
+        sys.exit(1)
+    EmissionRate = plants['EmissionRate'].values[priced].astype('float')
+    costs[:, :, taxed] += EmissionRate[taxed] * prices[:, :, zone_idx[taxed], co2]
+    out[:, priced, :] = costs.transpose(0, 2, 1)
+    return out[0] if single else out
+
+
 def interconnections(Simulation_list, NTC_inter, Historical_flows):
     """
     Function that checks for the possible interconnections of the zones included
@@ -66,83 +207,75 @@ def interconnections(Simulation_list, NTC_inter, Historical_flows):
     if (Historical_flows.values < 0).any():
         pos = np.where(Historical_flows.values < 0)
         logging.warning('WARNING: At least one historical flow is negative, for example in line ' + str(Historical_flows.columns[pos[1][0]]) + ' and time step ' + str(Historical_flows.index[pos[0][0]]))
-    all_connections = []
-    simulation_connections = []
     # List all connections from the dataframe headers:
     ConList = Historical_flows.columns.tolist() + [x for x in NTC_inter.columns.tolist() if x not in Historical_flows.columns.tolist()]
-    for connection in ConList:
-        c = connection.split(' -> ')
-        if len(c) != 2:
-            logging.warning('WARNING: Connection "' + connection + '" in the interconnection tables is not properly named. It will be ignored')
-        else:
-            if c[0] in Simulation_list:
-                all_connections.append(connection)
-                if c[1] in Simulation_list:
-                    simulation_connections.append(connection)
-            elif c[1] in Simulation_list:
-                all_connections.append(connection)
-
-    df_zones_simulated = pd.DataFrame(index=index)
-    for interconnection in simulation_connections:
-        if interconnection in NTC_inter.columns:
-            df_zones_simulated[interconnection] = NTC_inter[interconnection]
-            #logging.info('Detected interconnection ' + interconnection + '. The historical NTCs will be imposed as maximum flow value')
+    topology = network_topology(ConList, Simulation_list)
+    for connection in np.array(ConList)[~topology['valid']]:
+        logging.warning('WARNING: Connection "' + connection + '" in the interconnection tables is not properly named. It will be ignored')
+    from_sim = topology['valid'] & (topology['from_idx'] >= 0)
+    to_sim = topology['valid'] & (topology['to_idx'] >= 0)
+    simulated = from_sim & to_sim & pd.Index(ConList).isin(NTC_inter.columns)
+    to_row = from_sim & ~to_sim & pd.Index(ConList).isin(Historical_flows.columns)
+    from_row = to_sim & ~from_sim & pd.Index(ConList).isin(Historical_flows.columns)
+
+    df_zones_simulated = NTC_inter.reindex(index=index, columns=np.array(ConList)[simulated])
     interconnections1 = df_zones_simulated.columns
 
-    # Display a warning if a country is isolated:
-    for c in Simulation_list:
-        if not any([c in conn for conn in interconnections1]) and len(Simulation_list)>1:
+    # Display a warning if a zone is isolated:
+    connected = np.asarray(abs(topology['incidence'][np.where(simulated)[0], :]).sum(axis=0)).ravel() > 0
+    if len(Simulation_list) > 1:
+        for c in np.array(Simulation_list)[~connected]:
             logging.warning('Zone ' + c + ' does not appear to be connected to any other zone in the NTC table. It should be simulated in isolation')
 
-    df_RoW_temp = pd.DataFrame(index=index)
-    connNames = []
-    for interconnection in all_connections:
-        if interconnection in Historical_flows.columns and interconnection not in simulation_connections:
-            df_RoW_temp[interconnection] = Historical_flows[interconnection]
-            connNames.append(interconnection)
-
-    compare_set = set()
-    for k in connNames:
-        if not k[0:2] in compare_set and k[0:2] in Simulation_list:
-            compare_set.add(k[0:2])
-
-    df_zones_RoW = pd.DataFrame(index=index)
-    while compare_set:
-        nameToCompare = compare_set.pop()
-        exports = []
-        imports = []
-        for name in connNames:
-            if nameToCompare[0:2] in name[0:2]:
-                exports.append(connNames.index(name))
-                logging.info('Detected interconnection ' + name + ', happening between a simulated zone and the rest of the world. The historical flows will be imposed to the model')
-            elif nameToCompare[0:2] in name[6:8]:
-                imports.append(connNames.index(name))
-                logging.info('Detected interconnection ' + name + ', happening between the rest of the world and a simulated zone. The historical flows will be imposed to the model')
-
-        flows_out = pd.concat(df_RoW_temp[connNames[exports[i]]] for i in range(len(exports)))
-        flows_out = flows_out.groupby(flows_out.index).sum()
-        flows_out.name = nameToCompare + ' -> RoW'
-        df_zones_RoW[nameToCompare + ' -> RoW'] = flows_out
-        flows_in = pd.concat(df_RoW_temp[connNames[imports[j]]] for j in range(len(imports)))
-        flows_in = flows_in.groupby(flows_in.index).sum()
-        flows_in.name = 'RoW -> ' + nameToCompare
-        df_zones_RoW['RoW -> ' + nameToCompare] = flows_in
+    # The flows with the rest of the world are summed for each simulated zone:
+    for i in np.where(to_row)[0]:
+        logging.info('Detected interconnection ' + ConList[i] + ', happening between a simulated zone and the rest of the world. The historical flows will be imposed to the model')
+    for i in np.where(from_row)[0]:
+        logging.info('Detected interconnection ' + ConList[i] + ', happening between the rest of the world and a simulated zone. The historical flows will be imposed to the model')
+    RoW_lines = np.where(to_row | from_row)[0]
+    flows = Historical_flows.reindex(index=index, columns=np.array(ConList)[RoW_lines]).fillna(0).values
+    exports = -topology['incidence'][RoW_lines, :].minimum(0)
+    imports = topology['incidence'][RoW_lines, :].maximum(0)
+    zones = np.where(np.asarray(abs(topology['incidence'][RoW_lines, :]).sum(axis=0)).ravel() > 0)[0]
+    columns = [name for z in zones for name in (Simulation_list[z] + ' -> RoW', 'RoW -> ' + Simulation_list[z])]
+    values = np.empty([len(index), len(columns)])
+    values[:, 0::2] = np.asarray(exports[:, zones].T.dot(flows.T)).T
+    values[:, 1::2] = np.asarray(imports[:, zones].T.dot(flows.T)).T
+    df_zones_RoW = pd.DataFrame(values, index=index, columns=columns)
     interconnections2 = df_zones_RoW.columns
     inter = list(interconnections1) + list(interconnections2)
     return (df_zones_simulated, df_zones_RoW, inter)
 
 
 
-def clustering(plants, method='Standard', Nslices=2, PartLoadMax=0.1, Pmax=30):
+# Technical characteristics used to compare the units in the clustering and their scale (upper bound of the slices):
+CLUSTERING_KEYS = ['PartLoadMin', 'RampUpRate', 'RampDownRate', 'StartUpTime', 'MinUpTime', 'MinDownTime',
+                   'NoLoadCost', 'StartUpCost', 'Efficiency']
+CLUSTERING_SCALES = [1, 1, 1, 36, 168, 168, 50, 500, 1]
+# Number of units of one type above which the memory used by the target-size clustering is reported (_ward_merges):
+CLUSTERING_MAX_TYPE_SIZE = 5000
+
+
+def clustering(plants, method='Standard', Nslices=2, PartLoadMax=0.1, Pmax=30, Ntarget=None, MaxBinaries=None):
     """
     Merge excessively disaggregated power Units.
 
+    With the 'Standard' (or 'MILP') method, a target size can be imposed instead of the slicing: the units of each
+    zone and technology are merged by a capacity-weighted hierarchical clustering on their technical characteristics,
+    until the number of units is lower than Ntarget in each zone and technology and/or lower than MaxBinaries in total.
+    Only units with the same fuel and CHP type are merged. The distortion introduced by the clustering is provided in
+    the mapping output.
+
     :param plants:          Pandas dataframe with each power plant and their characteristics (following the DispaSET format)
     :param method:          Select clustering method ('Standard'/'LP'/None)
     :param Nslices:         Number of slices used to fingerprint each power plant characteristics. slices in the power plant data to categorize them  (fewer slices involves that the plants will be aggregated more easily)
     :param PartLoadMax:     Maximum part-load capability for the unit to be clustered
     :param Pmax:            Maximum power for the unit to be clustered
-    :return:                A list with the merged plants and the mapping between the original and merged units
+    :param Ntarget:         Target number of units per zone and technology (integer or dictionary with the technologies as keys)
+    :param MaxBinaries:     Maximum total number of units (i.e. of binary commitment variables per time step)
+    :return:                A list with the merged plants and the mapping between the original and merged units. The
+                            'Distortion' entry of the mapping is a dataframe with the capacity-weighted mean absolute
+                            deviation of the characteristics of the original units from their merged unit
     """
 
     # Checking the the required columns are present in the input pandas dataframe:
@@ -183,10 +316,6 @@ def clustering(plants, method='Standard', Nslices=2, PartLoadMax=0.1, Pmax=30):
     Nunits = len(plants)
     plants.index = range(Nunits)
 
-    # Definition of the mapping variable, from the old power plant list the new (merged) one:
-    map_old_new = np.zeros(Nunits)
-    map_plant_orig = []
-
     # Slicing:
     bounds = {'PartLoadMin': np.linspace(0, 1, Nslices), 'RampUpRate': np.linspace(0, 1, Nslices),
               'RampDownRate': np.linspace(0, 1, Nslices), 'StartUpTime': _mylogspace(0, 36, Nslices),
@@ -195,144 +324,126 @@ def clustering(plants, method='Standard', Nslices=2, PartLoadMax=0.1, Pmax=30):
               'Efficiency': np.linspace(0, 1, Nslices)}
 
     # Definition of the fingerprint value of each power plant, i.e. the pattern of the slices number in which each of
-    # its characteristics falls:
-    fingerprints = []
-    fingerprints_merged = []
-    for i in plants.index:
-        fingerprints.append([_find_nearest(bounds['PartLoadMin'], plants['PartLoadMin'][i]),
-                             _find_nearest(bounds['RampUpRate'], plants['RampUpRate'][i]),
-                             _find_nearest(bounds['RampDownRate'], plants['RampDownRate'][i]),
-                             _find_nearest(bounds['StartUpTime'], plants['StartUpTime'][i]),
-                             _find_nearest(bounds['MinUpTime'], plants['MinUpTime'][i]),
-                             _find_nearest(bounds['MinDownTime'], plants['MinDownTime'][i]),
-                             _find_nearest(bounds['NoLoadCost'], plants['NoLoadCost'][i]),
-                             _find_nearest(bounds['StartUpCost'], plants['StartUpCost'][i]),
-                             _find_nearest(bounds['Efficiency'], plants['Efficiency'][i])])
-
-    # Definition of the merged power plants dataframe:
-    plants_merged = pd.DataFrame(columns=plants.columns)
-
-    # Find the columns containing string values (in addition to "Unit")
-    #    string_keys = []
-    #    for i in range(len(plants.columns)):
-    #        if plants.columns[i] != 'Unit' and plants.dtypes[i] == np.dtype('O'):
-    #            string_keys.append(plants.columns[i])
+    # its characteristics falls (index of the nearest slice value):
+    fingerprints = np.column_stack([_find_nearest(bounds[key], plants[key].values) for key in CLUSTERING_KEYS])
+
     string_keys = ['Zone', 'Technology', 'Fuel','CHPType']
     # First, fill nan values:
     for key in string_keys:
         plants[key].fillna('',inplace=True)
 
-    for i in plants.index:  # i is the plant to be added to the new list
-        merged = False
-        plants_string = plants[string_keys].iloc[i].fillna('')
-        for j in plants_merged.index:  # j corresponds to the clustered plants
-            same_type = all(plants_string == plants_merged[string_keys].iloc[j].fillna(''))
-            same_fingerprint = (fingerprints[i] == fingerprints_merged[j])
-            low_pmin = (plants['PartLoadMin'][i] <= PartLoadMax)
-            low_pmax = (plants['PowerCapacity'][i] <= Pmax)
-            highly_flexible = plants['RampUpRate'][i] > 1 / 60 and (plants['RampDownRate'][i] > 1 / 60) and (
-            plants['StartUpTime'][i] < 1) and (plants['MinDownTime'][i] <= 1) and (plants['MinUpTime'][i] <= 1)
-            cluster = OnlyOnes and same_type and ((same_fingerprint and low_pmin) or highly_flexible or low_pmax)
-            if method in ('Standard','MILP') and cluster:  # merge the two plants in plants_merged:
-                P_old = plants_merged['PowerCapacity'][j]  # Old power in plants_merged
-                P_add = plants['PowerCapacity'][i]  # Additional power to be added
-                for key in plants_merged:
-                    if key in ['RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency',
-                               'MinEfficiency', 'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge','CHPPowerToHeat','CHPPowerLossFactor']:
-                        # Do a weighted average:
-                        plants_merged.loc[j, key] = (plants_merged[key][j] * P_old + plants[key][i] * P_add) / (
-                        P_add + P_old)
-                    elif key in ['PowerCapacity', 'STOCapacity', 'STOMaxChargingPower','InitialPower','CHPMaxHeat']:
-                        # Do a sum:
-                        plants_merged.loc[j, key] = plants_merged[key][j] + plants[key][i]
-                    elif key in ['PartLoadMin', 'StartUpTime']:
-                        # Take the minimum
-                        plants_merged.loc[j, key] = np.minimum(plants_merged[key][j] * P_old,
-                                                               plants[key][i] * P_add) / (P_add + P_old)
-                    elif key == 'RampingCost':
-                        # The starting cost must be added to the ramping cost
-                        Cost_to_fullload = P_add * (1 - plants['PartLoadMin'][i]) * plants['RampingCost'][i] + \
-                                           plants['StartUpCost'][i]
-                        plants_merged.loc[j, key] = (P_old * plants_merged[key][j] + Cost_to_fullload) / (P_old + P_add)
-                    elif key == 'Nunits':
-                        plants_merged.loc[j, key] = 1
-                map_old_new[i] = j
-                map_plant_orig[j].append(i)
-                merged = True
-                break
-            elif method == 'LP clustered' and same_type and OnlyOnes:
-                P_old = plants_merged['PowerCapacity'][j]  # Old power in plants_merged
-                P_add = plants['PowerCapacity'][i]  # Additional power to be added
-                for key in plants_merged:
-                    if key in ['RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency',
-                               'MinEfficiency', 'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge']:
-                        # Do a weighted average:
-                        plants_merged.loc[j, key] = (plants_merged[key][j] * P_old + plants[key][i] * P_add) / (
-                        P_add + P_old)
-                    elif key in ['PowerCapacity', 'STOCapacity', 'STOMaxChargingPower','InitialPower','CHPMaxHeat']:
-                        # Do a sum:
-                        plants_merged.loc[j, key] = plants_merged[key][j] + plants[key][i]
-                    elif key in ['PartLoadMin', 'StartUpTime']:
-                        # impose 0
-                        plants_merged.loc[j, key] = 0
-                    elif key == 'RampingCost':
-                        # The starting cost must be added to the ramping cost
-                        Cost_to_fullload = P_add * (1 - plants['PartLoadMin'][i]) * plants['RampingCost'][i] + \
-                                           plants['StartUpCost'][i]
-                        plants_merged.loc[j, key] = (P_old * plants_merged[key][j] + Cost_to_fullload) / (P_old + P_add)
-                    elif key == 'Nunits':
-                        plants_merged.loc[j, key] = 1
-                map_old_new[i] = j
-                map_plant_orig[j].append(i)
-                merged = True
-                break
-            elif method == 'Integer clustering' and same_type:
-                for key in plants_merged:
-                    if key in ['PowerCapacity','RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency',
-                               'MinEfficiency', 'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge',
-                               'STOCapacity', 'STOMaxChargingPower','InitialPower','PartLoadMin', 'StartUpTime','RampingCost',
-                               'CHPPowerToHeat','CHPPowerLossFactor','CHPMaxHeat']:
+    # Each plant is merged into the first cluster (ordered by the plant that created it) that satisfies the clustering
+    # conditions. The plant creating the cluster of each plant ("founder") is found by group operations:
+    position = np.arange(Nunits)
+    types = plants.groupby(string_keys, sort=False).ngroup().values
+    first_of_type = pd.Series(position).groupby(types).transform('min').values
+    if method in ('Standard', 'MILP') and OnlyOnes and (Ntarget is not None or MaxBinaries is not None):
+        founder = _target_founders(plants, types, Ntarget, MaxBinaries)
+    elif method in ('Standard', 'MILP') and OnlyOnes:
+        low_pmin = (plants['PartLoadMin'] <= PartLoadMax).values
+        low_pmax = (plants['PowerCapacity'] <= Pmax).values
+        highly_flexible = ((plants['RampUpRate'] > 1 / 60) & (plants['RampDownRate'] > 1 / 60) & (plants['StartUpTime'] < 1) &
+                           (plants['MinDownTime'] <= 1) & (plants['MinUpTime'] <= 1)).values
+        # Highly flexible or small plants join the first cluster of the same type:
+        any_cluster = highly_flexible | low_pmax
+        # The other plants with a low part load join the first cluster of the same type and fingerprint, i.e.
+        # the first plant of the group that created its own cluster:
+        groups = pd.DataFrame(np.column_stack([types, fingerprints])).groupby(list(range(1 + fingerprints.shape[1])), sort=False).ngroup().values
+        creates_cluster = (first_of_type == position) | ~any_cluster
+        first_of_group = pd.Series(np.where(creates_cluster, position, Nunits)).groupby(groups).transform('min').values
+        founder = np.where(any_cluster, first_of_type, np.where(low_pmin, first_of_group, position))
+    elif method in ('LP clustered', 'Integer clustering') and (OnlyOnes or method == 'Integer clustering'):
+        founder = first_of_type
+    else:
+        founder = position
+
+    # Definition of the merged power plants dataframe and of the mapping between original and merged plants:
+    founders = np.unique(founder)
+    cluster = np.searchsorted(founders, founder)
+    sizes = np.bincount(cluster)
+    map_plant_orig = [members.tolist() for members in
+                      np.split(position[np.argsort(cluster, kind='stable')], np.cumsum(sizes)[:-1])]
+    plants_merged = plants.iloc[founders].copy()
+    plants_merged.index = range(len(founders))
+
+    # The plants are merged in their original order: the k-th plant of all clusters is merged at the same time
+    rank = pd.Series(cluster).groupby(cluster).cumcount().values
+    if method in ('Standard', 'MILP'):
+        average = ['RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency', 'MinEfficiency',
+                   'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge', 'CHPPowerToHeat', 'CHPPowerLossFactor']
+    elif method == 'LP clustered':
+        average = ['RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency', 'MinEfficiency',
+                   'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge']
+    else:
+        average = ['PowerCapacity', 'RampUpRate', 'RampDownRate', 'MinUpTime', 'MinDownTime', 'NoLoadCost', 'Efficiency',
+                   'MinEfficiency', 'STOChargingEfficiency', 'CO2Intensity', 'STOSelfDischarge', 'STOCapacity',
+                   'STOMaxChargingPower', 'InitialPower', 'PartLoadMin', 'StartUpTime', 'RampingCost',
+                   'CHPPowerToHeat', 'CHPPowerLossFactor', 'CHPMaxHeat']
+    summed = ['PowerCapacity', 'STOCapacity', 'STOMaxChargingPower', 'InitialPower', 'CHPMaxHeat']
+    keys = [key for key in plants_merged if key in average + summed + ['PartLoadMin', 'StartUpTime', 'RampingCost', 'Nunits']]
+    if len(founders) < Nunits:
+        needed = [key for key in plants if key in keys + ['PowerCapacity', 'PartLoadMin', 'StartUpCost']]
+        values = {key: plants_merged[key].values.astype('float') for key in needed}
+        original = {key: plants[key].values.astype('float') for key in needed}
+        for r in range(1, rank.max() + 1):
+            i = np.where(rank == r)[0]          # plants to be added
+            j = cluster[i]                      # clusters to which they are added
+            if method == 'Integer clustering':
+                N_old = values['Nunits'][j]
+                N_add = original['Nunits'][i]
+                for key in keys:
+                    if key in average:
                         # Do a weighted average:
-                        plants_merged.loc[j, key] = (plants_merged.loc[j,key] * plants_merged.loc[j,'Nunits'] + plants.loc[i,key] * plants.loc[i,'Nunits']) / (plants_merged.loc[j,'Nunits'] + plants.loc[i,'Nunits'])
-                plants_merged.loc[j, 'Nunits'] = plants_merged.loc[j,'Nunits'] + plants.loc[i,'Nunits']
-
-                map_old_new[i] = j
-                map_plant_orig[j].append(i)
-                merged = True
-                break
-
-        if not merged:  # Add a new plant in plants_merged:
-            plants_merged = plants_merged.append(plants.loc[i], ignore_index=True)
-            plants_merged = plants_merged.copy()
-            map_plant_orig.append([i])
-            map_old_new[i] = len(map_plant_orig) - 1
-            fingerprints_merged.append(fingerprints[i])
+                        values[key][j] = (values[key][j] * N_old + original[key][i] * N_add) / (N_old + N_add)
+                values['Nunits'][j] = N_old + N_add
+                continue
+            P_old = values['PowerCapacity'][j]  # Old power in plants_merged
+            P_add = original['PowerCapacity'][i]  # Additional power to be added
+            for key in keys:
+                if key in average:
+                    # Do a weighted average:
+                    values[key][j] = (values[key][j] * P_old + original[key][i] * P_add) / (P_add + P_old)
+                elif key in summed:
+                    # Do a sum:
+                    values[key][j] = values[key][j] + original[key][i]
+                elif key in ['PartLoadMin', 'StartUpTime'] and method == 'LP clustered':
+                    # impose 0
+                    values[key][j] = 0
+                elif key in ['PartLoadMin', 'StartUpTime']:
+                    # Take the minimum
+                    values[key][j] = np.minimum(values[key][j] * P_old, original[key][i] * P_add) / (P_add + P_old)
+                elif key == 'RampingCost':
+                    # The starting cost must be added to the ramping cost
+                    Cost_to_fullload = P_add * (1 - original['PartLoadMin'][i]) * original['RampingCost'][i] + \
+                                       original['StartUpCost'][i]
+                    values[key][j] = (P_old * values[key][j] + Cost_to_fullload) / (P_old + P_add)
+                elif key == 'Nunits':
+                    values[key][j] = 1
+        merged = sizes > 1
+        for key in keys:
+            plants_merged.loc[merged, key] = values[key][merged]
 
     Nunits_merged = len(plants_merged)
     mapping = {'NewIndex': {}, 'FormerIndexes': {}}
     #    mapping['NewIdx'] = map_plant_orig
     #    mapping['OldIdx'] = map_old_new
     # Modify the Unit names with the original index number. In case of merged plants, indicate all indexes + the plant type and fuel
+    names = []
     for j in range(Nunits_merged):
         if len(map_plant_orig[j]) == 1:  # The plant has not been merged
             NewName = str(map_plant_orig[j]) + ' - ' + plants_merged['Unit'][j]
-            NewName = shrink_to_64(clean_strings(NewName))
-            NewName = NewName.rstrip()                          # remove space at the end because it is not considered by gams
-            plants_merged.loc[j, 'Unit'] = NewName
-            mapping['FormerIndexes'][NewName] = [map_plant_orig[j][0]]
-            mapping['NewIndex'][map_plant_orig[j][0]] = NewName
         else:
             all_stringkeys = ''
             for key in string_keys:
                 all_stringkeys = all_stringkeys + ' - ' + plants_merged[key][j]
             NewName = str(map_plant_orig[j]) + all_stringkeys
-            NewName = shrink_to_64(clean_strings(NewName))
-            NewName = NewName.rstrip()                          # remove space at the end because it is not considered by gams
-            plants_merged.loc[j, 'Unit'] = NewName
-            list_oldplants = [x for x in map_plant_orig[j]]
-            mapping['FormerIndexes'][NewName] = list_oldplants
-            for oldplant in list_oldplants:
-                mapping['NewIndex'][oldplant] = NewName
+        NewName = shrink_to_64(clean_strings(NewName))
+        NewName = NewName.rstrip()                          # remove space at the end because it is not considered by gams
+        names.append(NewName)
+        mapping['FormerIndexes'][NewName] = list(map_plant_orig[j])
+        for oldplant in map_plant_orig[j]:
+            mapping['NewIndex'][oldplant] = NewName
+    plants_merged['Unit'] = names
 
     # Transforming the start-up cost into ramping for the plants that did not go through any clustering:
     if method == 'LP clustered':
@@ -354,14 +465,128 @@ def clustering(plants, method='Standard', Nslices=2, PartLoadMax=0.1, Pmax=30):
     # Updating the index of the merged plants dataframe with the new unit names, after some cleaning:
     plants_merged.index = plants_merged['Unit']
 
+    # Distortion, i.e. capacity-weighted mean absolute deviation of the characteristics of the original units:
+    weights = plants['PowerCapacity'].fillna(0).values * plants['Nunits'].values
+    deviation = np.abs(plants[CLUSTERING_KEYS].values.astype('float') - plants_merged[CLUSTERING_KEYS].values.astype('float')[cluster])
+    deviation = pd.DataFrame(np.nan_to_num(deviation) * weights[:, np.newaxis], columns=CLUSTERING_KEYS)
+    total_weights = np.bincount(cluster, weights=weights, minlength=len(plants_merged))
+    mapping['Distortion'] = deviation.groupby(cluster).sum().div(np.where(total_weights > 0, total_weights, 1), axis=0)
+    mapping['Distortion'].index = plants_merged.index
+
     if Nunits != len(plants_merged):
         logging.info('Clustered ' + str(Nunits) + ' original units into ' + str(len(plants_merged)) + ' new units')
+        if weights.sum() > 0:
+            logging.info('Mean deviation of the clustered characteristics: ' + ', '.join(
+                key + ': ' + '{:.3g}'.format(value) for key, value in (deviation.sum() / weights.sum()).items()))
     else:
         logging.warning('Did not cluster any unit')
     return plants_merged, mapping
 
 ## Helpers
 
+def _target_founders(plants, types, Ntarget=None, MaxBinaries=None):
+    """
+    Selects the merges of the target-size clustering. The complete merge sequence of each unit type is computed
+    (capacity-weighted Ward clustering on the scaled characteristics) and the cheapest merges are selected until the
+    targets are met. Returns the first unit of the cluster of each unit.
+    """
+    Nunits = len(plants)
+    X = np.nan_to_num(plants[CLUSTERING_KEYS].values.astype('float') / CLUSTERING_SCALES)
+    w = np.maximum(plants['PowerCapacity'].fillna(0).values.astype('float'), 1e-6)
+    merges = []         # cost, type, rank in the merge sequence of the type, units
+    for t, members in pd.Series(np.arange(Nunits)).groupby(types):
+        members = members.values
+        costs, pairs = _ward_merges(X[members], w[members])
+        for rank in range(len(costs)):
+            merges.append((costs[rank], t, rank, members[pairs[rank, 0]], members[pairs[rank, 1]]))
+    merges = pd.DataFrame(merges, columns=['cost', 'type', 'rank', 'a', 'b'])
+    merges = merges.sort_values(['cost', 'type', 'rank'], kind='mergesort')
+    selected = np.zeros(len(merges), dtype='bool')
+
+    # Merges required to meet the target of each zone and technology:
+    if Ntarget is not None:
+        group = plants.groupby(['Zone', 'Technology'], sort=False).ngroup().values
+        for g, members in pd.Series(np.arange(Nunits)).groupby(group):
+            tech = plants['Technology'].iloc[members.values[0]]
+            target = Ntarget.get(tech, None) if isinstance(Ntarget, dict) else Ntarget
+            if target is None or len(members) <= target:
+                continue
+            candidates = np.where(np.isin(merges['a'].values, members.values))[0]
+            needed = len(members) - int(target)
+            if needed > len(candidates):
+                logging.warning('The target of ' + str(target) + ' units cannot be met for zone ' + str(plants['Zone'].iloc[members.values[0]]) +
+                                ' and technology ' + str(tech) + ' since units with different fuels or CHP types cannot be merged')
+            selected[candidates[:needed]] = True
+
+    # Additional merges to meet the maximum number of units:
+    if MaxBinaries is not None:
+        needed = Nunits - selected.sum() - int(MaxBinaries)
+        if needed > 0:
+            candidates = np.where(~selected)[0]
+            if needed > len(candidates):
+                logging.warning('The maximum number of units (' + str(MaxBinaries) + ') cannot be met since units with different '
+                                'zones, technologies, fuels or CHP types cannot be merged')
+            selected[candidates[:needed]] = True
+
+    # Applying the merges (the costs are monotonic, so that the selected merges of each type are its first merges):
+    parent = np.arange(Nunits)
+    def root(i):
+        while parent[i] != i:
+            i = parent[i]
+        return i
+    for a, b in merges[selected][['a', 'b']].values:
+        ra, rb = root(a), root(b)
+        parent[max(ra, rb)] = min(ra, rb)
+    return np.array([root(i) for i in range(Nunits)])
+
+
+def _ward_merges(X, w):
+    """
+    Agglomerative clustering with the Ward criterion, in which each point is weighted by w. Returns the cost
+    (increase of the weighted sum of squared deviations) and the pair of points representing the merged clusters
+    for each of the len(w) - 1 merges. The matrix of the merge costs is dense: the memory required is of the order of
+    2 * 8 * len(w) ** 2 bytes (e.g. 256 MB for 4000 points)
+    """
+    N = len(w)
+    if N > CLUSTERING_MAX_TYPE_SIZE:
+        logging.warning('Computing the merge sequence of ' + str(N) + ' units of the same zone, technology, fuel '
+                        'and CHP type requires about ' + str(int(16 * N ** 2 / 1024 ** 2)) + ' MB of memory')
+    w = w.copy()
+    # Squared distances (without building the N x N x len(CLUSTERING_KEYS) differences), weighted in place:
+    D = cdist(X, X, 'sqeuclidean') if N > 0 else np.zeros([0, 0])
+    D *= w[:, np.newaxis]
+    D *= w
+    D /= np.add.outer(w, w)
+    np.fill_diagonal(D, np.inf)
+    rowmin = D.min(axis=1) if N > 0 else np.zeros(0)
+    rowarg = D.argmin(axis=1) if N > 0 else np.zeros(0, dtype='int')
+    costs = np.zeros(max(N - 1, 0))
+    pairs = np.zeros([max(N - 1, 0), 2], dtype='int')
+    for m in range(N - 1):
+        a = rowmin.argmin()
+        b = rowarg[a]
+        a, b = min(a, b), max(a, b)
+        costs[m] = D[a, b]
+        pairs[m] = a, b
+        # Lance-Williams update for the merged cluster (stored in a):
+        new = ((w + w[a]) * D[a] + (w + w[b]) * D[b] - w * D[a, b]) / (w + w[a] + w[b])
+        w[a] += w[b]
+        D[a, :] = D[:, a] = new
+        D[b, :] = D[:, b] = np.inf
+        D[a, a] = np.inf
+        rowmin[b] = np.inf
+        update = (rowarg == a) | (rowarg == b)
+        update[a] = True
+        update[b] = False
+        closer = ~update & (new < rowmin)
+        rowmin[closer] = new[closer]
+        rowarg[closer] = a
+        rowmin[update] = D[update].min(axis=1)
+        rowarg[update] = D[update].argmin(axis=1)
+    # Rounding errors must not break the monotonicity of the merge costs:
+    return np.maximum.accumulate(costs) if N > 1 else costs, pairs
+
+
 def _mylogspace(low, high, N):
     """
     Self-defined logspace function in which low and high are the first and last values of the space
@@ -373,7 +598,10 @@ def _mylogspace(low, high, N):
 
 def _find_nearest(array, value):
     """
-    Self-defined function to find the index of the nearest value in a vector
+    Self-defined function to find the index of the nearest value in a vector. If value is an array, the index is
+    returned for each of its elements
     """
-    idx = (np.abs(array - value)).argmin()
-    return idx
+    if np.ndim(value) == 0:
+        return (np.abs(array - value)).argmin()
+    value = np.asarray(value, dtype='float')
+    return (np.abs(array[np.newaxis, :] - value[:, np.newaxis])).argmin(axis=1)
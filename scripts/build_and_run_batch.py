@@ -59,4 +59,6 @@ for iheat, ipower, icost_heat, iresmod in all_combinations:
     filename = os.path.join(path_to_save, scenario_name+".p")
     with open(filename, "wb") as f:
         pickle.dump((inputs, results), f, protocol=pickle.HIGHEST_PROTOCOL)
+    # Release the result file before the next run overwrites it:
+    results.close()
     logging.info('Saved {} to pickle file'.format(scenario_name))
@@ -117,6 +117,8 @@ for i,path in enumerate(paths_ok):
     for key in ['Out_LostLoad_MaxPower','Out_LostLoad_MinPower','Out_LostLoad_Reserve2D','Out_LostLoad_Reserve2U']:
         if key in results:
             LostLoad = LostLoad = results[key].sum().sum()
+    # Release the result file of this run:
+    results.close()
     
     # Get input data from folder name (to be improved!):
     cap,flex,hours,sto,wind,pv = [float(x) for x in path.split(' - ')]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+"""
+Example file showing how to compile the csv files of the Database folder into a consolidated columnar store.
+The store is then used by setting the 'DataStore' field of the config to its path.
+
+@author: Sylvain Quoilin
+"""
+
+# Add the root folder of Dispa-SET to the path so that the library can be loaded:
+import sys,os
+sys.path.append(os.path.abspath('..'))
+
+# Import Dispa-SET
+import dispaset as ds
+
+# Compile (or update) the store:
+manifest = ds.ingest_database('../Database', '../Database.store')
+
+# Build a simulation reading its time series from the store:
+config = ds.load_config_excel('../ConfigFiles/ConfigTest.xlsx')
+config['DataStore'] = '../Database.store'
+SimData = ds.build_simulation(config)
@@ -33,6 +33,7 @@ setup(
         "future >= 0.15",
         "click >= 3.3",
         "numpy >= 1.12",
+        "scipy >= 0.15",
         "pandas >= 0.19",
         "xlrd >= 0.9",
         "matplotlib >= 1.5.1",
@@ -0,0 +1,25 @@
+import numpy as np
+import pandas as pd
+
+from dispaset.postprocessing.aggregation import aggregate, aggregated_symbols, zone_hierarchy
+
+
+def test_aggregate():
+    hierarchy = zone_hierarchy(['Z1', 'Z2', 'Z3'], {'A': ['Z1', 'Z2'], 'B': ['Z3', 'Z4']}, {'R': ['A', 'B']})
+    demand = pd.DataFrame({'Z1': [1., 2.], 'Z2': [3., 4.], 'Z3': [5., 6.]})
+    np.testing.assert_allclose(aggregate(hierarchy, demand)[['A', 'B']].values, [[4, 5], [6, 6]])
+    np.testing.assert_allclose(aggregate(hierarchy, demand, 'region')['R'], [9, 12])
+
+    # Multi-index columns: the other levels are kept
+    power = pd.DataFrame([[1., 2., 3.]], columns=pd.MultiIndex.from_tuples([('Z1', 'GAS'), ('Z2', 'GAS'), ('Z2', 'OIL')]))
+    assert list(aggregate(hierarchy, power).columns) == [('A', 'GAS'), ('A', 'OIL')]
+    np.testing.assert_allclose(aggregate(hierarchy, power).values, [[3, 3]])
+
+    # Weighted average:
+    price = pd.DataFrame({'Z1': [10., 10.], 'Z2': [20., 40.], 'Z3': [1., 1.]})
+    np.testing.assert_allclose(aggregate(hierarchy, price, weights=demand)['A'], [17.5, 30])
+
+    inputs = {'sets': {'n': ['Z1', 'Z2', 'Z3']}, 'config': {'country_zones': {'KSA': ['Z1', 'Z2']}}}
+    derived = aggregated_symbols(inputs, {'TotalNodeDemand': demand, 'NodeFuelPower': power})
+    np.testing.assert_allclose(derived['TotalKSADemand'], [4, 6])
+    assert list(derived['KSAFuelPower'].columns) == ['GAS', 'OIL']
@@ -0,0 +1,42 @@
+from dispaset._version import __version__
+from dispaset.preprocessing.build_cache import build_cache, build_cache_info, code_version, run_stage, run_stages
+
+calls = []
+
+
+def _stage(name, path):
+    calls.append(name)
+    with open(path) as f:
+        return name + f.read()
+
+
+def test_run_stages(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    with open(path, 'w') as f:
+        f.write('1')
+    stages = {'a': (_stage, ['a', path], {}, {'path': path}, []),
+              'b': (_stage, ['b', path], {}, {'option': 1}, [])}
+
+    cache = build_cache(str(tmp_path / 'cache'))
+    assert run_stages(cache, stages) == {'a': 'a1', 'b': 'b1'}
+    assert run_stage(cache, 'c', _stage, ['c', path], {}, {}, ['a']) == 'c1'
+    assert build_cache_info(str(tmp_path / 'cache'))['entries'] == 3
+
+    # Only the stages depending on the modified file are executed again:
+    with open(path, 'w') as f:
+        f.write('2')
+    del calls[:]
+    cache = build_cache(str(tmp_path / 'cache'))
+    assert run_stages(cache, stages, workers=2) == {'a': 'a2', 'b': 'b1'}
+    assert run_stage(cache, 'c', _stage, ['c', path], {}, {}, ['a']) == 'c2'
+    assert sorted(calls) == ['a', 'c'] and cache['reused'] == ['b']
+
+    # Without cache directory, the stages are always executed:
+    del calls[:]
+    run_stages(build_cache(), stages)
+    assert sorted(calls) == ['a', 'b']
+
+
+def test_code_version():
+    # Package version and hash of the sources of the pre-processing:
+    assert code_version().startswith(__version__ + '-') and code_version() == code_version()
@@ -0,0 +1,34 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dispaset.preprocessing.data_check import check_units, validate_units, isStorage, _validated
+
+
+def test_validate_units():
+    plants = pd.DataFrame({'Unit': ['A', 'B', 'B'], 'Fuel': ['GAS', 'GAS', ''], 'Zone': 'Z1', 'Technology': 'GTUR',
+                           'PowerCapacity': [100., -1., 50.], 'PartLoadMin': 0.2, 'RampUpRate': 0.1, 'RampDownRate': 0.1,
+                           'StartUpTime': 0., 'MinUpTime': 1., 'MinDownTime': 1., 'NoLoadCost': 0., 'StartUpCost': 0.,
+                           'Efficiency': [0.4, np.nan, 0.4], 'CO2Intensity': 0.4, 'RampingCost': 0.})
+    config = {'HorizonLength': 3}
+    report = validate_units(config, plants)
+    # All the violations are reported:
+    assert sorted(zip(report['Field'], report['Rule'])) == [('Efficiency', 'not missing'), ('Fuel', 'not empty'),
+                                                           ('PowerCapacity', '>= 0'), ('Unit', 'unique name (the value is the zone)'),
+                                                           ('Unit', 'unique name (the value is the zone)')]
+    assert (report['Level'] == 'error').all()
+    with pytest.raises(SystemExit):
+        check_units(config, plants)
+    assert check_units(config, plants.iloc[:1])
+
+    # The inputs are only hashed and recorded if the validated tables are skipped:
+    validated = list(_validated)
+    check_units(config, plants.iloc[:1])
+    assert list(_validated) == validated
+    check_units(dict(config, SkipValidated=True), plants.iloc[:1])
+    assert len(_validated) == len(validated) + 1
+
+
+def test_isStorage():
+    assert isStorage('HPHS') and not isStorage('GTUR')
+    assert list(isStorage(pd.Series(['HPHS', 'GTUR', np.nan, 'BATS']))) == [True, False, False, True]
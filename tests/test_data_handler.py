@@ -0,0 +1,105 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dispaset.preprocessing.data_handler import load_csv, load_csv_cache_info, merge_series, align_time_series, \
+    load_sources, NodeBasedTable, _write_cache_entry
+from dispaset.preprocessing.data_store import ingest_database
+
+
+def test_load_csv_cache(tmp_path):
+    path = str(tmp_path / 'data.csv')
+    cache = str(tmp_path / 'cache')
+    index = pd.date_range('2015-01-01', periods=24, freq='h')
+    pd.DataFrame({'Z1': np.arange(24.), 'Z2': 1.}, index=index).to_csv(path)
+
+    data = load_csv(path, TempPath=cache, index_col=0, parse_dates=True)
+    cached = load_csv(path, TempPath=cache, index_col=0, parse_dates=True)
+    pd.testing.assert_frame_equal(data, cached)
+    cached.iloc[0, 0] = -1                                  # the cached entry is not modified
+    assert load_csv(path, TempPath=cache, index_col=0, parse_dates=True).iloc[0, 0] == 0
+
+    # Different read options give a different entry:
+    assert len(load_csv(path, TempPath=cache, header=None)) == 25
+    # A modified file is never served from the cache:
+    pd.DataFrame({'Z1': np.ones(24)}, index=index).to_csv(path)
+    assert list(load_csv(path, TempPath=cache, index_col=0, parse_dates=True).columns) == ['Z1']
+    assert load_csv_cache_info(cache)['entries'] == 3
+
+    # The values are removed if the entry file cannot be written:
+    unpicklable = pd.DataFrame({'Z1': [1., 2.]}, index=[len, lambda x: x])
+    assert not _write_cache_entry(os.path.join(cache, 'csv_failed'), unpicklable)
+    assert not os.path.exists(os.path.join(cache, 'csv_failed.npy'))
+
+    # The least recently used entries and the values without entry file are removed when the cache is full:
+    with open(os.path.join(cache, 'csv_orphan.npy'), 'wb') as f:
+        f.write(b'0' * 10)
+    assert load_csv_cache_info(cache)['entries'] == 3
+    size = sum(os.path.getsize(os.path.join(cache, name)) for name in os.listdir(cache))
+    assert load_csv_cache_info(cache)['size'] == size
+    load_csv(path, TempPath=cache, header=None, MaxCacheSize=0)
+    assert load_csv_cache_info(cache)['entries'] == 0 and os.listdir(cache) == []
+
+
+def test_data_store(tmp_path):
+    source = tmp_path / 'Database' / 'Load' / 'Z1'
+    source.mkdir(parents=True)
+    index = pd.date_range('2015-12-31', periods=72, freq='h')
+    pd.Series(np.arange(72.), index=index).to_csv(str(source / '2015.csv'), header=False)
+    manifest = ingest_database(str(tmp_path / 'Database'), str(tmp_path / 'store'))
+    assert sorted(manifest['tables']['Load/Z1/2015.csv']['partitions']) == ['2015', '2016']
+
+    # The csv path is resolved in the store even if the file is not present:
+    window = (index[10], index[40])
+    data = load_csv('/elsewhere/Load/Z1/2015.csv', header=None, index_col=0, parse_dates=True,
+                    window=window, store=str(tmp_path / 'store'))
+    assert list(data.iloc[:, 0]) == list(np.arange(10., 41.))
+
+    # A single file without header, read for one zone with a header, gives the same series as the csv file:
+    idx = index[:30]
+    stored = NodeBasedTable('/elsewhere/Load/Z1/2015.csv', idx, ['Z1'], store=str(tmp_path / 'store'))
+    local = NodeBasedTable(str(source / '2015.csv'), idx, ['Z1'])
+    pd.testing.assert_frame_equal(stored, local)
+    assert list(stored['Z1']) == list(np.arange(30.))
+
+    # A local csv file modified since the ingest is read instead of the store:
+    pd.Series(-np.arange(72.), index=index).to_csv(str(source / '2015.csv'), header=False)
+    data = load_csv(str(source / '2015.csv'), TempPath=str(tmp_path / 'cache'), header=None, index_col=0,
+                    parse_dates=True, store=str(tmp_path / 'store'))
+    assert data.iloc[1, 0] == -1
+
+
+def test_merge_series():
+    plants = pd.DataFrame({'Unit': ['A', 'B', 'C'], 'PowerCapacity': [100., 300., 50.], 'Nunits': 1})
+    mapping = {'FormerIndexes': {'[0, 1] - AB': [0, 1], '[2] - C': [2]},
+               'NewIndex': {0: '[0, 1] - AB', 1: '[0, 1] - AB', 2: '[2] - C'}}
+    data = pd.DataFrame({'C': [1., 0.], 'B': [1., 0.5], 'A': [0., 1.], 'Other': 1.})
+    merged = merge_series(plants, data, mapping)
+    assert list(merged.columns) == ['[2] - C', '[0, 1] - AB']
+    np.testing.assert_allclose(merged['[0, 1] - AB'], [0.75, 0.625])
+    np.testing.assert_allclose(merge_series(plants, data, mapping, method='Sum')['[0, 1] - AB'], [1, 1.5])
+
+
+def test_align_time_series():
+    index = pd.date_range('2015-01-01', periods=24, freq='h')
+    idx_long = pd.date_range('2015-01-01', periods=48, freq='h')
+    tables = {'A': pd.DataFrame({'Z1': np.arange(24.), 'Z2': np.nan}, index=index),
+              'B': pd.DataFrame({'Z1': [np.nan, 1., 2.]}, index=index[[0, 10, 20]])}
+    aligned = align_time_series(tables, idx_long, check=['A'], StartDate=index[0], StopDate=index[-1])
+    for key in tables:
+        pd.testing.assert_frame_equal(aligned[key], tables[key].reindex(idx_long, method='nearest').fillna(method='bfill'))
+
+
+def test_load_sources(tmp_path):
+    index = pd.date_range('2015-01-01', periods=24, freq='h')
+    sources = {}
+    for i in range(4):
+        path = str(tmp_path / ('data' + str(i) + '.csv'))
+        pd.DataFrame({'Z1': np.arange(24.) * i}, index=index).to_csv(path)
+        sources[i] = (load_csv, [path], {'index_col': 0, 'parse_dates': True})
+    serial = load_sources(sources)
+    parallel = load_sources(sources, workers=4)
+    assert list(parallel) == list(sources)
+    for i in sources:
+        pd.testing.assert_frame_equal(serial[i], parallel[i])
@@ -0,0 +1,50 @@
+import os
+
+import numpy as np
+import pandas as pd
+import yaml
+
+import dispaset as ds
+from dispaset.preprocessing.preprocessing import adjust_fuel_prices
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PRICE_ENTRIES = ['PriceOfDiesel', 'PriceOfHFO', 'PriceOfMunicipalSolidWaste', 'PriceOfLandFillGas', 'PriceOfCrudeOil']
+
+
+def _config(tmp_path):
+    with open(os.path.join(ROOT, 'tests', 'conf.yml')) as f:
+        config = yaml.load(f, Loader=getattr(yaml, 'UnsafeLoader', yaml.Loader))
+    for key in ['Demand', 'HeatDemand', 'Interconnections', 'NTC', 'PowerPlantData', 'PriceOfBiomass', 'PriceOfFuelOil',
+                'PriceOfPeat', 'RenewablesAF']:
+        config[key] = os.path.join(ROOT, config[key])
+    for key in PRICE_ENTRIES + ['PriceOfCrudeOil', 'ReservoirLevels', 'ReservoirScaledInflows', 'FuelsPricesPerZone']:
+        config.setdefault(key, '')
+    for key in PRICE_ENTRIES:
+        config['default'].setdefault(key, 0.)
+    config['zones'] = config['countries']
+    config['GAMS_ModelCode'] = 'Standard'
+    config['WriteGDX'] = 0
+    config['SimulationDirectory'] = str(tmp_path / 'sim')
+
+    # Local and international prices of some of the fuels:
+    config['FuelsPricesPerZone'] = str(tmp_path / 'FuelsPricesPerZone.csv')
+    pd.DataFrame({'International': [30., 12., 40.], 'Z1': [10., 5., 20.], 'Z2': [15., 6., 25.]},
+                 index=['GAS', 'HRD', 'BIO']).to_csv(config['FuelsPricesPerZone'])
+    return config
+
+
+def test_adjust_fuel_prices(tmp_path):
+    config = _config(tmp_path)
+    SimData, FuelPrices, FuelPrices2 = ds.build_simulation(config)
+    reference = ds.build_simulation(dict(config, SimulationDirectory=str(tmp_path / 'ref')), 0.5, 2)[0]
+
+    adjusted = adjust_fuel_prices(SimData, FuelPrices, FuelPrices2, (0.5, 2))[(0.5, 2)]
+    for p in ['CostVariable', 'CostVariableB', 'FuelPricePerZone']:
+        np.testing.assert_allclose(adjusted[p], reference['parameters'][p]['val'], err_msg=p)
+    # The multipliers change the costs and the input data is not modified:
+    assert not np.allclose(SimData['parameters']['CostVariable']['val'], adjusted['CostVariable'])
+
+    # One sub-directory per multiplier pair, without copies of the other ones:
+    adjust_fuel_prices(SimData, FuelPrices, FuelPrices2, [(0.5, 2), (1, 1)], dest_path=config['SimulationDirectory'])
+    assert os.path.isfile(os.path.join(config['SimulationDirectory'], 'LSM1_ECM1', 'Inputs.p'))
+    assert not os.path.exists(os.path.join(config['SimulationDirectory'], 'LSM1_ECM1', 'LSM0.5_ECM2'))
@@ -0,0 +1,86 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dispaset.postprocessing.postprocessing import ds_to_df, get_units_operation_cost, get_nodes_generation_cost
+from dispaset.postprocessing.result_cache import result_cache, read_result_entry, write_result_entry, result_cache_info
+from dispaset.postprocessing.results import SimResults
+
+
+def test_sim_results():
+    index_long = pd.date_range('2016-01-01', periods=6, freq='h')
+    index = index_long[:4]
+    raw = {'UnitOutputPower': pd.DataFrame({'U1': [1., 2., 3., 4.]}, index=[1, 2, 3, 4]),
+           'LostLoad_MaxPower': pd.DataFrame({'Z1': range(6)}, index=range(1, 7)),
+           'PowerFlow': pd.DataFrame({'Z1 -> Z2': [5.]}, index=[2])}
+    inputs = {'units': pd.DataFrame(index=['U1']), 'sets': {'u': ['U1']}}
+    results = SimResults(inputs, index, index_long, raw=raw)
+    assert 'PowerFlow' in results and 'NodeShadowPrice' in results and 'Other' not in results
+    assert results._data == {}      # nothing is decoded before being accessed
+    assert results['UnitOutputPower'].index.equals(index)
+    assert results['LostLoad_MaxPower'].index.equals(index_long)
+    assert list(results['PowerFlow']['Z1 -> Z2']) == [0, 5, 0, 0]
+    assert results['NodeShadowPrice'].index.equals(index) and results['NodeShadowPrice'].empty
+
+    window = SimResults(inputs, index, index_long, raw=raw, window=('2016-01-01 01:00', '2016-01-01 02:00'))
+    assert list(window['PowerFlow']['Z1 -> Z2']) == [5, 0]
+
+
+def test_result_cache(tmp_path):
+    resultfile = str(tmp_path / 'Results.gdx')
+    with open(resultfile, 'w') as f:
+        f.write('1')
+    path = str(tmp_path / 'cache')
+    cache = result_cache(path, resultfile)
+    data = pd.DataFrame({'Z1': [1., 2.], 'Z2': [3., 4.]}, index=[1, 2])
+    assert read_result_entry(cache, 'PowerFlow') is None
+    assert write_result_entry(cache, 'PowerFlow', data) and write_result_entry(cache, 'status', data['Z1'])
+    pd.testing.assert_frame_equal(read_result_entry(cache, 'PowerFlow'), data)
+    pd.testing.assert_series_equal(read_result_entry(cache, 'status'), data['Z1'])
+    assert result_cache_info(path)['entries'] == 2
+
+    # A modified result file does not use the previous entries:
+    with open(resultfile, 'w') as f:
+        f.write('2')
+    assert read_result_entry(result_cache(path, resultfile), 'PowerFlow') is None
+
+    # The values are removed if the entry file cannot be written:
+    assert not write_result_entry(cache, 'UnitOutputPower', data.set_index(pd.Index([len, lambda x: x])))
+    assert not any(name.endswith('.npy') for name in os.listdir(path) if 'UnitOutputPower' in name)
+
+    # The least recently used entries, values without entry file and hashes of the result files are removed when the
+    # cache is full:
+    with open(os.path.join(path, 'gdx_orphan_PowerFlow.npy'), 'wb') as f:
+        f.write(b'0' * 10)
+    assert result_cache_info(path)['size'] > sum(os.path.getsize(os.path.join(path, name)) for name in
+                                                 os.listdir(path) if name.endswith('.p'))
+    write_result_entry(dict(cache, size=1), 'PowerFlow', data)
+    assert result_cache_info(path) == {'entries': 0, 'size': 0} and os.listdir(path) == []
+
+
+def test_ds_to_df():
+    sets = {'h': ['1', '2', '3'], 'z': ['1', '2'], 'n': ['Z1', 'Z2'], 'mk': ['DA']}
+    demand = np.arange(12.).reshape(1, 2, 6)[:, :, :3].copy()
+    inputs = {'sets': sets, 'parameters': {'Demand': {'sets': ['mk', 'n', 'h'], 'val': demand}}}
+    param_df = ds_to_df(inputs)
+    assert list(param_df) == ['sets', 'Demand'] and inputs['parameters']['Demand']['firstrow'] == 1
+    assert list(param_df['Demand'].columns) == [('DA', 'Z1'), ('DA', 'Z2')]
+    assert list(param_df['Demand'][('DA', 'Z2')]) == [6., 7.]      # integer index of the time steps of z
+    assert np.shares_memory(param_df['Demand'].values, demand)      # view of the parameter, without copy
+
+
+def test_nodes_generation_cost():
+    index = pd.date_range('2016-01-01', periods=3, freq='h')
+    units = pd.DataFrame({'Zone': ['Z1', 'Z1', 'Z2']}, index=['U1', 'U2', 'U3'])
+    parameters = dict((p, {'sets': ['u'], 'val': np.array([1., 10., 100.])}) for p in
+                      ['CostFixed', 'CostStartUp', 'CostShutDown', 'CostRampUp', 'CostRampDown'])
+    inputs = {'units': units, 'parameters': parameters, 'config': {'zones': ['Z1', 'Z2', 'Z3']},
+              'param_df': {'CostVariable': pd.DataFrame(2., index=index, columns=units.index)}}
+    results = {'UnitCommitment': pd.DataFrame({'U2': [0., 1., 1.], 'U1': [1., 1., 1.]}, index=index),
+               'UnitOutputPower': pd.DataFrame({'U1': [5., 5., 5.], 'U2': [0., 4., 2.]}, index=index)}
+    # U2: shut-down and ramping down at the first step (which follows the last one), start-up at the second step:
+    assert list(get_units_operation_cost(inputs, results)['U2']) == [10. + 20., 10. + 10. + 40. + 8., 10. + 20. + 4.]
+    cost = get_nodes_generation_cost(inputs, results)
+    assert list(cost.columns) == ['Z1', 'Z2', 'Z3'] and list(cost['Z3']) == [0., 0., 0.]
+    assert list(cost['Z1']) == [11. + 30., 11. + 68., 11. + 34.]
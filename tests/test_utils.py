@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from dispaset.misc.topology import flow_balance, network_topology
+from dispaset.preprocessing.utils import clustering, fuel_price_array, variable_costs, zone_fuel_prices
+
+FUELS = ['BIO', 'GAS', 'CO2']
+ENTRIES = ['PriceOfBiomass', 'PriceOfGas', 'PriceOfCO2']
+
+
+def test_variable_costs():
+    index = pd.date_range('2015-01-01', periods=3, freq='h')
+    FuelPrices = pd.DataFrame({('Z1', 'PriceOfBiomass'): [10., 10., 10.],
+                               ('Z1', 'PriceOfGas'): [20., 30., 40.],
+                               ('Z1', 'PriceOfCO2'): [5., 5., 10.]}, index=index)
+    plants = pd.DataFrame({'Zone': ['Z1', 'Z1', 'Z1', 'Z2'],
+                           'Fuel': ['GAS', 'BIO', 'SUN', 'GAS'],
+                           'Efficiency': [0.5, 0.25, 1, 0.5],
+                           'EmissionRate': [0.4, 1, 0, 0.4]})
+    prices = fuel_price_array(FuelPrices, ['Z1'], ENTRIES)
+    assert prices.shape == (3, 1, 3)
+    costs = variable_costs(plants, ['Z1'], prices, FUELS)
+    np.testing.assert_allclose(costs[0], [42, 62, 84])
+    np.testing.assert_allclose(costs[1], [40, 40, 40])      # biomass emissions are not priced
+    np.testing.assert_allclose(costs[2:], 0)                 # no fuel price or zone not simulated
+
+    # Several price sets are computed in the same pass:
+    both = variable_costs(plants, ['Z1'], np.stack([prices, 2 * prices]), FUELS)
+    np.testing.assert_allclose(both[1], 2 * costs)
+
+    # A missing CO2 price is an error (it would give NaN costs):
+    with pytest.raises(SystemExit):
+        variable_costs(plants, ['Z1'], fuel_price_array(FuelPrices.drop(columns=('Z1', 'PriceOfCO2')), ['Z1'], ENTRIES),
+                       FUELS)
+
+
+def test_zone_fuel_prices():
+    FuelPricesPerZone = pd.DataFrame({'International': [10., 20.], 'Z1': [6., 0.]}, index=['BIO', 'GAS'])
+    prices, found = zone_fuel_prices(FuelPricesPerZone, ['Z1', 'Z2'], FUELS, LocalSubsidyMultiplier=0.5,
+                                     ExportCostMultiplier=2)
+    np.testing.assert_allclose(prices[0, 0, 0], 8)              # 10 - (10 - 6) * 0.5
+    assert np.isnan(prices[0, 0, 1]) and found[0, 0, 1]       # non-positive local price: not applied
+    assert not found[0, 1].any()                              # zone not in the table: default value
+    np.testing.assert_allclose(prices[1, :, :2], [[20, 40], [20, 40]])
+    assert not found[:, :, 2].any()
+
+
+def test_clustering():
+    plants = pd.DataFrame({'Unit': ['A', 'B', 'C', 'D', 'E'], 'Zone': 'Z1', 'Fuel': 'GAS', 'CHPType': np.nan,
+                           'Technology': ['GTUR', 'GTUR', 'STUR', 'GTUR', 'GTUR'],
+                           'PowerCapacity': [100., 20., 100., 300., 100.], 'PartLoadMin': [0.6, 0.5, 0.5, 0.05, 0.05],
+                           'RampUpRate': 0.01, 'RampDownRate': 0.01, 'StartUpTime': 2., 'MinUpTime': 3.,
+                           'MinDownTime': 3., 'NoLoadCost': 0., 'StartUpCost': 0., 'Efficiency': [0.3, 0.5, 0.4, 0.4, 0.4],
+                           'RampingCost': 0.})
+    merged, mapping = clustering(plants, method='Standard')
+    # Small units join the first unit of the same type, units with low part load the first unit with the same fingerprint:
+    assert [mapping['FormerIndexes'][unit] for unit in merged.index] == [[0, 1], [2], [3, 4]]
+    np.testing.assert_allclose(merged['PowerCapacity'], [120, 100, 400])
+    np.testing.assert_allclose(merged['Efficiency'], [(0.3 * 100 + 0.5 * 20) / 120, 0.4, 0.4])
+    assert merged.index[1] == '[2] - C'
+
+
+def test_clustering_target():
+    N = 6
+    plants = pd.DataFrame({'Unit': ['U' + str(i) for i in range(N)], 'Zone': 'Z1', 'Technology': 'STUR', 'CHPType': np.nan,
+                           'Fuel': ['HRD'] * 5 + ['GAS'], 'PowerCapacity': 200., 'PartLoadMin': 0.4,
+                           'RampUpRate': 0.01, 'RampDownRate': 0.01, 'StartUpTime': 5., 'MinUpTime': 8., 'MinDownTime': 8.,
+                           'NoLoadCost': 0., 'StartUpCost': 0., 'RampingCost': 0.,
+                           'Efficiency': [0.30, 0.31, 0.45, 0.46, 0.47, 0.40]})
+    merged, mapping = clustering(plants, method='MILP', Ntarget=3)
+    # The most similar coal units are merged, the gas unit is kept apart:
+    assert sorted(mapping['FormerIndexes'].values()) == [[0, 1], [2, 3, 4], [5]]
+    np.testing.assert_allclose(mapping['Distortion']['Efficiency'], [0.005, 0.01 * 2 / 3, 0])
+
+    merged, mapping = clustering(plants, method='MILP', MaxBinaries=1)            # cannot be met
+    assert len(merged) == 2 and merged['PowerCapacity'].sum() == 1200
+
+
+def test_network_topology():
+    topology = network_topology(['Z1 -> Z2', 'RoW -> Z1', 'Z2 -> RoW'], ['Z1', 'Z2'])
+    assert list(topology['RoW']) == [False, True, True]
+    np.testing.assert_array_equal(topology['incidence'].toarray(), [[-1, 1], [1, 0], [0, -1]])
+    flows = pd.DataFrame({'Z1 -> Z2': [1., 2.], 'RoW -> Z1': [3., 3.], 'Z2 -> RoW': [0.5, np.nan]})
+    balance = flow_balance(topology, flows)
+    np.testing.assert_allclose(balance.values, [[2, 0.5], [1, 2]])
+    np.testing.assert_allclose(flow_balance(topology, flows, 'out')['Z2'], [-0.5, 0])